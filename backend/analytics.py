@@ -0,0 +1,448 @@
+import asyncio
+import logging
+import uuid
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import ASCENDING, DeleteOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+LEVEL_BUCKET_SIZE = 10
+COIN_BUCKETS = (0, 100, 500, 1000, 5000, 10000, 50000)  # lower bounds
+DAY_FORMAT = "%Y-%m-%d"
+BATCH_MARKERS = 64  # ids of the latest batches kept on a rollup, see Analytics.record_many
+
+WORLD, LEVEL, COINS, DAY = "world", "level", "coins", "day"
+STATE_KINDS = (WORLD, LEVEL, COINS)  # rebuilt from game_progress; days are event counts
+
+
+def level_bucket(level: int) -> int:
+    """First level of the bucket: 1-10 -> 1, 11-20 -> 11, ..."""
+    return level - (level - 1) % LEVEL_BUCKET_SIZE
+
+
+def coin_bucket(coins: int) -> int:
+    return COIN_BUCKETS[bisect_right(COIN_BUCKETS, coins) - 1]
+
+
+def contribution(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields of a progress document the rollups are computed from.
+
+    Must agree with CONTRIBUTION_PIPELINE, which computes the same thing in
+    Mongo for rebuilds.
+    """
+    stats = doc.get("playerStats") or {}
+    updated_at = doc.get("updatedAt")
+    return {
+        "_id": doc["playerId"],
+        "version": doc.get("version", 0),
+        "level": max(stats.get("level", 1), 1),
+        "coins": max(stats.get("coins", 0), 0),
+        "deathCount": doc.get("deathCount", 0),
+        "day": updated_at.strftime(DAY_FORMAT) if updated_at else None,
+        "worlds": [
+            {
+                "worldId": world["worldId"],
+                "unlocked": int(bool(world.get("unlocked"))),
+                "completed": int(bool(world.get("completed"))),
+                "bestTime": world.get("bestTime") or 0,
+                "highScore": world.get("highScore") or 0,
+            }
+            for world in doc.get("worldProgress") or []
+        ],
+    }
+
+
+CONTRIBUTION_PIPELINE: List[Dict[str, Any]] = [
+    {"$project": {
+        "_id": "$playerId",
+        "version": {"$ifNull": ["$version", 0]},
+        "level": {"$max": [{"$ifNull": ["$playerStats.level", 1]}, 1]},
+        "coins": {"$max": [{"$ifNull": ["$playerStats.coins", 0]}, 0]},
+        "deathCount": {"$ifNull": ["$deathCount", 0]},
+        "day": {"$dateToString": {"format": DAY_FORMAT, "date": "$updatedAt"}},
+        "worlds": {"$map": {
+            "input": {"$ifNull": ["$worldProgress", []]},
+            "as": "w",
+            "in": {
+                "worldId": "$$w.worldId",
+                "unlocked": {"$cond": ["$$w.unlocked", 1, 0]},
+                "completed": {"$cond": ["$$w.completed", 1, 0]},
+                "bestTime": {"$ifNull": ["$$w.bestTime", 0]},
+                "highScore": {"$ifNull": ["$$w.highScore", 0]},
+            },
+        }},
+    }},
+]
+
+
+def _world_counters(world: Dict[str, Any]) -> Dict[str, int]:
+    timed = world["bestTime"] > 0
+    scored = world["highScore"] > 0
+    return {
+        "unlocked": world["unlocked"],
+        "completed": world["completed"],
+        "bestTimeCount": int(timed),
+        "bestTimeTotal": world["bestTime"] if timed else 0,
+        "highScoreCount": int(scored),
+        "highScoreTotal": world["highScore"] if scored else 0,
+    }
+
+
+def rollup_counters(contrib: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """What one player adds to each state rollup, by rollup _id"""
+    counters = {
+        f"{LEVEL}:{level_bucket(contrib['level'])}": {
+            "players": 1, "deathCount": contrib["deathCount"], "coins": contrib["coins"],
+        },
+        f"{COINS}:{coin_bucket(contrib['coins'])}": {"players": 1},
+    }
+    for world in contrib["worlds"]:
+        counters[f"{WORLD}:{world['worldId']}"] = _world_counters(world)
+    return counters
+
+
+def rollup_deltas(previous: Optional[Dict[str, Any]], current: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """Non-zero counter changes from replacing `previous` with `current`,
+    including the day rollup of the save"""
+    deltas: Dict[str, Dict[str, int]] = defaultdict(dict)
+    for rollup_id, fields in rollup_counters(current).items():
+        for field, value in fields.items():
+            deltas[rollup_id][field] = value
+    if previous is not None:
+        for rollup_id, fields in rollup_counters(previous).items():
+            for field, value in fields.items():
+                deltas[rollup_id][field] = deltas[rollup_id].get(field, 0) - value
+
+    if current["day"] is not None:
+        day = deltas[f"{DAY}:{current['day']}"]
+        day["saves"] = 1
+        if previous is None:
+            day["newPlayers"] = 1
+        if previous is None or previous.get("day") != current["day"]:
+            day["activePlayers"] = 1
+
+    return {
+        rollup_id: nonzero
+        for rollup_id, fields in deltas.items()
+        if (nonzero := {field: value for field, value in fields.items() if value})
+    }
+
+
+def _kind_and_key(rollup_id: str):
+    kind, key = rollup_id.split(":", 1)
+    return kind, (key if kind == DAY else int(key))
+
+
+def _ratio(numerator: int, denominator: int, digits: int = 2) -> Optional[float]:
+    return round(numerator / denominator, digits) if denominator else None
+
+
+def summarize(rollups: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Response body of /api/analytics from the stored rollup documents"""
+    worlds, levels, coins, days = [], [], [], []
+    for rollup in sorted(rollups, key=lambda doc: (doc["kind"], doc["key"])):
+        kind = rollup["kind"]
+        if kind == WORLD:
+            worlds.append({
+                "worldId": rollup["key"],
+                "players": rollup.get("unlocked", 0),
+                "completed": rollup.get("completed", 0),
+                "completionRate": _ratio(rollup.get("completed", 0), rollup.get("unlocked", 0), 4),
+                "avgBestTime": _ratio(rollup.get("bestTimeTotal", 0), rollup.get("bestTimeCount", 0)),
+                "avgHighScore": _ratio(rollup.get("highScoreTotal", 0), rollup.get("highScoreCount", 0)),
+            })
+        elif kind == LEVEL:
+            players = rollup.get("players", 0)
+            levels.append({
+                "minLevel": rollup["key"],
+                "maxLevel": rollup["key"] + LEVEL_BUCKET_SIZE - 1,
+                "players": players,
+                "avgDeathCount": _ratio(rollup.get("deathCount", 0), players),
+                "avgCoins": _ratio(rollup.get("coins", 0), players),
+            })
+        elif kind == COINS:
+            index = COIN_BUCKETS.index(rollup["key"])
+            coins.append({
+                "min": rollup["key"],
+                "max": COIN_BUCKETS[index + 1] - 1 if index + 1 < len(COIN_BUCKETS) else None,
+                "players": rollup.get("players", 0),
+            })
+        elif kind == DAY:
+            days.append({
+                "date": rollup["key"],
+                "saves": rollup.get("saves", 0),
+                "activePlayers": rollup.get("activePlayers", 0),
+                "newPlayers": rollup.get("newPlayers", 0),
+            })
+    # Buckets everyone has left are kept at zero by $inc but dropped by rebuilds
+    return {
+        "players": sum(level["players"] for level in levels),
+        "worlds": [world for world in worlds if world["players"]],
+        "levels": [level for level in levels if level["players"]],
+        "coins": [bucket for bucket in coins if bucket["players"]],
+        "days": days,
+    }
+
+
+class Analytics:
+    """Gameplay rollups maintained incrementally as saves arrive.
+
+    Each player's current contribution to the rollups (level, coins, death
+    count, per-world results) is kept in `contributions`. A save swaps in the
+    new contribution, only if its progress version is newer than the stored
+    one, and applies the difference to the rollup documents with `$inc`, so
+    rollups always equal the sum over players and reading them costs the
+    same for any number of players. Per-day rollups count events (saves,
+    active and new players) rather than current state.
+    """
+
+    def __init__(self, rollups, contributions):
+        self.rollups = rollups
+        self.contributions = contributions
+
+    async def ensure_indexes(self) -> None:
+        await self.rollups.create_index([("kind", ASCENDING), ("key", ASCENDING)])
+
+    async def record(self, doc: Dict[str, Any]) -> bool:
+        """Account for a saved progress document; False when a newer (or the
+        same) version of it was already counted"""
+        return await self.record_many([doc]) > 0
+
+    async def record_many(self, docs: Iterable[Dict[str, Any]]) -> int:
+        """Account for several saved documents; returns how many were counted.
+
+        The documents of one player are merged into a single contribution
+        swap, and the rollup changes of the whole batch are summed into one
+        bulk `$inc`. A swap only lands on the contribution it was computed
+        from; when another recorder got there first the player is read and
+        computed again.
+
+        Every rollup the `$inc` reaches is marked with the batch id. If the
+        write fails, the marked rollups are decremented again and the
+        contributions put back, so recording the same documents again
+        counts them exactly once.
+        """
+        pending: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for doc in docs:
+            pending[doc["playerId"]].append(contribution(doc))
+        for contribs in pending.values():
+            contribs.sort(key=lambda contrib: contrib["version"])
+
+        swapped: List[Tuple[Optional[Dict[str, Any]], Dict[str, Any]]] = []
+        deltas: Dict[str, Dict[str, int]] = defaultdict(dict)
+        counted = 0
+        try:
+            while pending:
+                pending, chains = await self._swap(pending, swapped)
+                for chain in chains:
+                    counted += len(chain) - 1
+                    # Intermediate saves still count as day events
+                    for previous, current in zip(chain, chain[1:]):
+                        for rollup_id, fields in rollup_deltas(previous, current).items():
+                            for field, value in fields.items():
+                                deltas[rollup_id][field] = deltas[rollup_id].get(field, 0) + value
+        except Exception:
+            await self._restore(swapped)
+            raise
+
+        deltas = {rollup_id: nonzero for rollup_id, fields in deltas.items() if (nonzero := {f: v for f, v in fields.items() if v})}
+        if deltas:
+            batch_id = uuid.uuid4().hex
+            try:
+                await self.rollups.bulk_write([
+                    UpdateOne(
+                        {"_id": rollup_id},
+                        {
+                            "$inc": fields,
+                            "$setOnInsert": dict(zip(("kind", "key"), _kind_and_key(rollup_id))),
+                            "$push": {"batches": {"$each": [batch_id], "$slice": -BATCH_MARKERS}},
+                        },
+                        upsert=True,
+                    )
+                    for rollup_id, fields in deltas.items()
+                ], ordered=False)
+            except Exception:
+                await self._revert(batch_id, deltas, swapped)
+                raise
+        return counted
+
+    async def _swap(
+        self,
+        pending: Dict[str, List[Dict[str, Any]]],
+        swapped: List[Tuple[Optional[Dict[str, Any]], Dict[str, Any]]],
+    ) -> Tuple[Dict[str, List[Dict[str, Any]]], List[List[Optional[Dict[str, Any]]]]]:
+        """Swap in the newest contribution of each pending player whose stored
+        one is older. Returns the players to retry, whose stored contribution
+        changed since it was read, and for each swap the stored contribution
+        followed by the newer ones it was replaced with."""
+        stored = {
+            contrib["_id"]: contrib
+            async for contrib in self.contributions.find({"_id": {"$in": list(pending)}})
+        }
+        chains: List[List[Optional[Dict[str, Any]]]] = []
+        for player_id, contribs in pending.items():
+            previous = stored.get(player_id)
+            newer = [contrib for contrib in contribs if previous is None or contrib["version"] > previous["version"]]
+            if newer:
+                chains.append([previous, *newer])
+        if not chains:
+            return {}, []
+
+        # Upserting over a changed contribution hits the unique _id instead
+        operations = [
+            ReplaceOne(
+                {"_id": chain[-1]["_id"], "version": chain[0]["version"] if chain[0] else {"$exists": False}},
+                chain[-1],
+                upsert=True,
+            )
+            for chain in chains
+        ]
+        conflicts = set()
+        try:
+            await self.contributions.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            conflicts = {error["index"] for error in errors if error.get("code") == 11000}
+            if len(conflicts) < len(errors):
+                swapped.extend((chain[0], chain[-1]) for index, chain in enumerate(chains) if index not in conflicts)
+                raise
+        except Exception:
+            # Unknown which landed; restoring one that did not is a no-op
+            swapped.extend((chain[0], chain[-1]) for chain in chains)
+            raise
+
+        swapped.extend((chain[0], chain[-1]) for index, chain in enumerate(chains) if index not in conflicts)
+        retry = {chains[index][-1]["_id"]: pending[chains[index][-1]["_id"]] for index in conflicts}
+        return retry, [chain for index, chain in enumerate(chains) if index not in conflicts]
+
+    async def _revert(self, batch_id: str, deltas: Dict[str, Dict[str, int]], swapped: List[Any]) -> None:
+        """Undo a failed rollup write: decrement the rollups holding its
+        batch id, then put the contributions back"""
+        try:
+            await self.rollups.bulk_write([
+                UpdateOne(
+                    {"_id": rollup_id, "batches": batch_id},
+                    {"$inc": {field: -value for field, value in fields.items()}, "$pull": {"batches": batch_id}},
+                )
+                for rollup_id, fields in deltas.items()
+            ], ordered=False)
+        except Exception:
+            # Contributions stay swapped so a retry cannot count them twice;
+            # rollups the batch missed are short until rebuild-analytics
+            logger.exception("Could not revert analytics batch %s", batch_id)
+            return
+        await self._restore(swapped)
+
+    async def _restore(self, swapped: List[Tuple[Optional[Dict[str, Any]], Dict[str, Any]]]) -> None:
+        # Newest first, and only where nothing newer was recorded since
+        operations = [
+            DeleteOne({"_id": current["_id"], "version": current["version"]}) if previous is None
+            else ReplaceOne({"_id": current["_id"], "version": current["version"]}, previous)
+            for previous, current in reversed(swapped)
+        ]
+        if operations:
+            await self.contributions.bulk_write(operations, ordered=False)
+
+    async def rebuild(self, progress_collections: Sequence[Any]) -> Dict[str, int]:
+        """Recompute contributions and state rollups from `game_progress`.
+
+        Contributions are rewritten server side by an aggregation with `$out`
+        and the rollups grouped from them, so only the rollups themselves come
+        back to the app. Day rollups are history and are left alone. Saves
+        recorded while this runs can be lost from the rollups; run it when
+        traffic is low.
+
+        Partitions outside this database cannot `$out` here; their
+        contributions are computed concurrently on each partition, copied into
+        a staging collection and swapped in with a rename.
+        """
+        rebuilt_at = datetime.utcnow()
+        local = self.contributions.database
+        if len(progress_collections) == 1 and progress_collections[0].database.name == local.name \
+                and progress_collections[0].database.client is local.client:
+            await progress_collections[0].aggregate(
+                CONTRIBUTION_PIPELINE + [{"$out": self.contributions.name}]
+            ).to_list(None)
+        else:
+            await self._copy_contributions(progress_collections)
+
+        level_start = {"$subtract": ["$level", {"$mod": [{"$subtract": ["$level", 1]}, LEVEL_BUCKET_SIZE]}]}
+        pipelines = {
+            LEVEL: [{"$group": {
+                "_id": level_start,
+                "players": {"$sum": 1},
+                "deathCount": {"$sum": "$deathCount"},
+                "coins": {"$sum": "$coins"},
+            }}],
+            COINS: [{"$bucket": {
+                "groupBy": "$coins",
+                "boundaries": list(COIN_BUCKETS),
+                "default": COIN_BUCKETS[-1],
+                "output": {"players": {"$sum": 1}},
+            }}],
+            WORLD: [
+                {"$unwind": "$worlds"},
+                {"$group": {
+                    "_id": "$worlds.worldId",
+                    "unlocked": {"$sum": "$worlds.unlocked"},
+                    "completed": {"$sum": "$worlds.completed"},
+                    "bestTimeCount": {"$sum": {"$cond": [{"$gt": ["$worlds.bestTime", 0]}, 1, 0]}},
+                    "bestTimeTotal": {"$sum": {"$cond": [{"$gt": ["$worlds.bestTime", 0]}, "$worlds.bestTime", 0]}},
+                    "highScoreCount": {"$sum": {"$cond": [{"$gt": ["$worlds.highScore", 0]}, 1, 0]}},
+                    "highScoreTotal": {"$sum": {"$cond": [{"$gt": ["$worlds.highScore", 0]}, "$worlds.highScore", 0]}},
+                }},
+            ],
+        }
+
+        operations = []
+        for kind, pipeline in pipelines.items():
+            for group in await self.contributions.aggregate(pipeline).to_list(None):
+                key = int(group.pop("_id"))
+                operations.append(ReplaceOne(
+                    {"_id": f"{kind}:{key}"},
+                    {"kind": kind, "key": key, **group, "rebuiltAt": rebuilt_at},
+                    upsert=True,
+                ))
+        if operations:
+            await self.rollups.bulk_write(operations, ordered=False)
+        # Buckets no player falls in any more
+        await self.rollups.delete_many({"kind": {"$in": list(STATE_KINDS)}, "rebuiltAt": {"$ne": rebuilt_at}})
+        return {
+            "players": await self.contributions.estimated_document_count(),
+            "rollups": len(operations),
+        }
+
+    async def _copy_contributions(self, progress_collections: Sequence[Any], batch_size: int = 1000) -> None:
+        staging = self.contributions.database[f"{self.contributions.name}_rebuild"]
+        await staging.drop()
+
+        async def copy(progress_collection) -> None:
+            batch: List[Dict[str, Any]] = []
+            async for contrib in progress_collection.aggregate(CONTRIBUTION_PIPELINE, batchSize=batch_size):
+                batch.append(contrib)
+                if len(batch) >= batch_size:
+                    await staging.insert_many(batch, ordered=False)
+                    batch = []
+            if batch:
+                await staging.insert_many(batch, ordered=False)
+
+        await asyncio.gather(*(copy(collection) for collection in progress_collections))
+        if await staging.estimated_document_count():
+            await staging.rename(self.contributions.name, dropTarget=True)
+        else:
+            await self.contributions.delete_many({})
+
+    async def summary(self, days: int, today: Optional[datetime] = None) -> Dict[str, Any]:
+        """Every state rollup plus the last `days` day rollups"""
+        today = today or datetime.utcnow()
+        first_day = (today - timedelta(days=days - 1)).strftime(DAY_FORMAT)
+        rollups = await self.rollups.find({"$or": [
+            {"kind": {"$in": list(STATE_KINDS)}},
+            {"kind": DAY, "key": {"$gte": first_day}},
+        ]}, {"batches": 0}).to_list(None)
+        return summarize(rollups)
@@ -0,0 +1,111 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+from pymongo import UpdateOne
+
+from catalog import equipped_move_ids
+from models import (
+    GameProgressCreate,
+    GameProgressUpdate,
+    ProgressBatchItem,
+    ProgressBatchItemResult,
+)
+
+
+class PlannedWrite:
+    """All batch items for one player, folded into a single upsert"""
+
+    def __init__(self, player_id: str):
+        self.player_id = player_id
+        self.item_indexes: List[int] = []
+        self.insert_doc: Optional[Dict[str, Any]] = None
+        self.set_fields: Dict[str, Any] = {}
+        self.updates = 0
+
+    def to_operation(self, new_document: Callable[[str, Any], Dict[str, Any]]) -> UpdateOne:
+        # Players missing from the collection are created from defaults
+        # (or from the batch's own create item) and the updates applied on top
+        insert_doc = self.insert_doc or new_document(self.player_id, None)
+        insert_doc = {key: value for key, value in insert_doc.items() if key not in self.set_fields}
+        update: Dict[str, Any] = {"$setOnInsert": insert_doc}
+        if self.updates:
+            del insert_doc["version"], insert_doc["updatedAt"]
+            update["$set"] = {**self.set_fields, "updatedAt": datetime.utcnow()}
+            update["$inc"] = {"version": self.updates}
+        return UpdateOne({"playerId": self.player_id}, update, upsert=True)
+
+
+def plan_progress_batch(
+    items: List[ProgressBatchItem],
+    new_document: Callable[[str, Any], Dict[str, Any]],
+    rejected: Optional[Dict[int, ProgressBatchItemResult]] = None,
+) -> Tuple[List[PlannedWrite], Dict[int, ProgressBatchItemResult]]:
+    """Validate batch items and fold them into one write per player.
+
+    An unordered bulk write gives no ordering guarantee between operations,
+    so items for the same player are merged in submission order (later
+    fields win) rather than sent as separate operations. Items already in
+    `rejected` are left out. Returns the planned writes and the results of
+    items that were rejected or failed validation.
+    """
+    writes: Dict[str, PlannedWrite] = {}
+    invalid: Dict[int, ProgressBatchItemResult] = dict(rejected or {})
+
+    for index, item in enumerate(items):
+        if index in invalid:
+            continue
+        try:
+            if "playerId" in item.data:
+                raise ValueError("playerId is given on the item, not in its data")
+            if item.op == "create":
+                create = GameProgressCreate.model_validate({**item.data, "playerId": item.playerId})
+            else:
+                update = GameProgressUpdate.model_validate(item.data)
+                if update.version is not None:
+                    raise ValueError("version checks are not supported in batches, use PUT")
+        except (ValidationError, ValueError) as e:
+            invalid[index] = ProgressBatchItemResult(
+                index=index, playerId=item.playerId, status="invalid", error=str(e)
+            )
+            continue
+
+        write = writes.setdefault(item.playerId, PlannedWrite(item.playerId))
+        write.item_indexes.append(index)
+        if item.op == "create":
+            if write.insert_doc is None:
+                write.insert_doc = new_document(item.playerId, create.playerStats)
+        else:
+            fields = update.model_dump(exclude_unset=True, exclude={"version", "runs"})
+            if fields.get("equippedMoves"):
+                fields["equippedMoves"] = equipped_move_ids(fields["equippedMoves"])
+            write.set_fields.update(fields)
+            write.updates += 1
+
+    return list(writes.values()), invalid
+
+
+def collect_batch_results(
+    items: List[ProgressBatchItem],
+    writes: List[PlannedWrite],
+    invalid: Dict[int, ProgressBatchItemResult],
+    bulk_result: Dict[str, Any],
+) -> List[ProgressBatchItemResult]:
+    """Map a bulk write result (or BulkWriteError details) back to items"""
+    upserted = {entry["index"] for entry in bulk_result.get("upserted", [])}
+    errors = {entry["index"]: entry.get("errmsg", "write failed") for entry in bulk_result.get("writeErrors", [])}
+
+    results = dict(invalid)
+    for op_index, write in enumerate(writes):
+        for index in write.item_indexes:
+            if op_index in errors:
+                status, error = "error", errors[op_index]
+            elif op_index in upserted:
+                status, error = "created", None
+            else:
+                status = "exists" if items[index].op == "create" else "updated"
+                error = None
+            results[index] = ProgressBatchItemResult(
+                index=index, playerId=write.player_id, status=status, error=error
+            )
+    return [results[index] for index in range(len(items))]
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: per-request serialization cost of a full GameProgress
+
+Compares the previous response path (build a GameProgress from the Mongo
+document, let FastAPI validate it against response_model, encode with the
+stdlib JSON encoder) with the direct document-to-bytes path used by the
+progress endpoints, for JSON and MessagePack.
+
+Usage: python benchmarks/bench_serialization.py [--iterations N]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from catalog import MoveCatalog
+from models import GameProgress
+from serialization import encode_json, encode_msgpack, progress_payload
+
+
+def full_progress_document(catalog):
+    """Stored document for a player with ten played worlds and all slots equipped"""
+    return {
+        "_id": ObjectId(),
+        "playerId": "bench_player",
+        "playerStats": {"level": 12, "xp": 340, "xpToNext": 743, "health": 100, "maxHealth": 100, "coins": 1250},
+        "equippedMoves": {
+            move_type: moves[-1].id for move_type, moves in catalog.by_type.items()
+        },
+        "ownedMoves": [move.id for move in catalog.moves],
+        "worldProgress": [
+            {"worldId": i, "unlocked": True, "completed": i < 10, "bestTime": 240 + i * 7, "highScore": 10000 + i * 1337}
+            for i in range(1, 11)
+        ],
+        "deathCount": 57,
+        "settings": {"soundEnabled": True, "musicEnabled": False},
+        "version": 311,
+        "updatedAt": datetime.utcnow(),
+    }
+
+
+async def measure(label, func, iterations):
+    for _ in range(min(1000, iterations)):
+        await func()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        body = await func()
+    elapsed = time.perf_counter() - start
+    per_request = elapsed / iterations * 1e6
+    print(f"{label:<44} {per_request:8.2f} us/request  {len(body):6d} bytes")
+    return per_request
+
+
+async def main(iterations):
+    catalog = MoveCatalog.load(Path(__file__).resolve().parent.parent / "data" / "moves.json")
+    doc = full_progress_document(catalog)
+    field = create_response_field(name="Response_get_game_progress", type_=GameProgress)
+
+    async def model_response():
+        # Previous path: model construction, response_model validation, stdlib JSON
+        progress = dict(doc)
+        progress["id"] = str(progress.pop("_id"))
+        progress["equippedMoves"] = catalog.hydrate_equipped(progress["equippedMoves"])
+        content = await serialize_response(field=field, response_content=GameProgress(**progress))
+        return JSONResponse(content).body
+
+    async def direct_json():
+        return encode_json(progress_payload(doc, catalog))
+
+    async def direct_msgpack():
+        return encode_msgpack(progress_payload(doc, catalog))
+
+    print(f"Serializing a ten-world GameProgress, {iterations} iterations")
+    baseline = await measure("GameProgress + response_model + json", model_response, iterations)
+    for label, func in (("document -> orjson", direct_json), ("document -> msgpack", direct_msgpack)):
+        cost = await measure(label, func, iterations)
+        print(f"{'':<44} {baseline / cost:8.1f}x faster")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations))
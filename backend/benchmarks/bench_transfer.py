@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Benchmark: bulk export/import throughput for synthetic players
+
+Generates progress documents for N synthetic players (one million by
+default) batch by batch and runs them through the export and import codecs
+of transfer.py: encoding to NDJSON or BSON (optionally gzipped) on the way
+out, incremental decoding of 64 KB chunks and building the bulk upserts on
+the way back in. Documents are never all held at once; peak RSS is printed
+at the end to show memory stays bounded.
+
+With --mongo-url the same players are also inserted into a scratch database
+and exported to / imported from a temporary file end to end, which adds the
+server's cursor and bulk write time. The scratch database is dropped after.
+
+Usage: python benchmarks/bench_transfer.py [--players N] [--batch-size B] [--mongo-url URL]
+"""
+
+import argparse
+import asyncio
+import random
+import resource
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bson import ObjectId
+
+import transfer
+from catalog import MoveCatalog
+
+CHUNK_SIZE = 64 * 1024
+VARIANTS = [(fmt, compress) for fmt in transfer.FORMATS for compress in (False, True)]
+
+
+def synthetic_players(catalog, count, batch_size, seed=0):
+    """Progress documents in the stored shape, `batch_size` at a time"""
+    rng = random.Random(seed)
+    started = datetime(2026, 1, 1)
+    for first in range(0, count, batch_size):
+        batch = []
+        for i in range(first, min(first + batch_size, count)):
+            worlds = rng.randint(1, 10)
+            batch.append({
+                "_id": ObjectId(),
+                "playerId": f"player_{i:07d}",
+                "playerStats": {
+                    "level": rng.randint(1, 50), "xp": rng.randint(0, 5000), "xpToNext": rng.randint(100, 9000),
+                    "health": 100, "maxHealth": 100, "coins": rng.randint(0, 20000),
+                },
+                "equippedMoves": {move_type: rng.choice(moves).id for move_type, moves in catalog.by_type.items()},
+                "ownedMoves": [move.id for move in rng.sample(catalog.moves, rng.randint(3, len(catalog.moves)))],
+                "worldProgress": [
+                    {"worldId": w, "unlocked": True, "completed": w < worlds,
+                     "bestTime": rng.randint(200, 900), "highScore": rng.randint(1000, 90000)}
+                    for w in range(1, worlds + 1)
+                ],
+                "deathCount": rng.randint(0, 500),
+                "settings": {"soundEnabled": True, "musicEnabled": rng.random() < 0.5},
+                "version": rng.randint(1, 400),
+                "updatedAt": started + timedelta(seconds=i),
+            })
+        yield batch
+
+
+def report(label, documents, seconds, size=None):
+    line = f"{label:<28} {documents / seconds:>10,.0f} docs/s  {seconds:7.2f}s"
+    if size is not None:
+        line += f"  {size / seconds / 1e6:7.1f} MB/s  {size / 1e6:9.1f} MB total"
+    print(line)
+
+
+def bench_codecs(catalog, players, batch_size):
+    print(f"Codecs, {players:,} players in batches of {batch_size}")
+    generating = 0.0
+    encode = {variant: [0.0, 0] for variant in VARIANTS}
+    decode = {variant: 0.0 for variant in VARIANTS}
+    compressors = {variant: zlib.compressobj(wbits=transfer.GZIP_WBITS) for variant in VARIANTS if variant[1]}
+    decoders = {variant: transfer.DocumentDecoder(variant[0]) for variant in VARIANTS}
+
+    batches = synthetic_players(catalog, players, batch_size)
+    while True:
+        started = time.perf_counter()
+        batch = next(batches, None)
+        generating += time.perf_counter() - started
+        if batch is None:
+            break
+        for variant in VARIANTS:
+            fmt, compress = variant
+            started = time.perf_counter()
+            data = transfer.encode_documents(batch, fmt)
+            if compress:
+                data = compressors[variant].compress(data) + compressors[variant].flush(zlib.Z_SYNC_FLUSH)
+            encode[variant][0] += time.perf_counter() - started
+            encode[variant][1] += len(data)
+
+            started = time.perf_counter()
+            docs = []
+            for offset in range(0, len(data), CHUNK_SIZE):
+                docs += decoders[variant].feed(data[offset:offset + CHUNK_SIZE])
+            transfer.upsert_operations(docs, "playerId")
+            decode[variant] += time.perf_counter() - started
+            assert len(docs) == len(batch)
+
+    print(f"{'(generating documents)':<28} {players / generating:>10,.0f} docs/s  {generating:7.2f}s")
+    for variant in VARIANTS:
+        label = variant[0] + (" + gzip" if variant[1] else "")
+        seconds, size = encode[variant]
+        report(f"export {label}", players, seconds, size)
+        report(f"import {label}", players, decode[variant])
+
+
+async def bench_end_to_end(catalog, players, batch_size, mongo_url, db_name):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+    print(f"\nEnd to end against {db_name}, {players:,} players")
+    try:
+        await db.game_progress.drop()
+        await db.game_progress.create_index("playerId", unique=True)
+        started = time.perf_counter()
+        for batch in synthetic_players(catalog, players, batch_size):
+            await db.game_progress.insert_many(batch, ordered=False)
+        report("insert_many (seeding)", players, time.perf_counter() - started)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for fmt, compress in VARIANTS:
+                label = fmt + (" + gzip" if compress else "")
+                path = Path(directory) / f"game_progress.{fmt}"
+                stats = {}
+                started = time.perf_counter()
+                with path.open("wb") as out:
+                    async for chunk in transfer.export_chunks(
+                        db.game_progress, fmt, batch_size=batch_size, compress=compress, stats=stats,
+                    ):
+                        out.write(chunk)
+                report(f"export {label}", stats["documents"], time.perf_counter() - started, stats["bytes"])
+
+                async def read_chunks():
+                    with path.open("rb") as source:
+                        while True:
+                            chunk = source.read(1 << 20)
+                            if not chunk:
+                                return
+                            yield chunk
+
+                # Half the players are missing, half are overwritten in place
+                await db.game_progress.delete_many({"playerId": {"$lt": f"player_{players // 2:07d}"}})
+                started = time.perf_counter()
+                stats = await transfer.import_chunks(db.game_progress, "playerId", read_chunks(), fmt, batch_size=batch_size)
+                report(f"import {label}", stats["documents"], time.perf_counter() - started)
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--mongo-url", help="also run export/import end to end against this server")
+    parser.add_argument("--db-name", default="bench_transfer", help="scratch database, dropped afterwards")
+    args = parser.parse_args()
+
+    catalog = MoveCatalog.load(Path(__file__).resolve().parent.parent / "data" / "moves.json")
+    bench_codecs(catalog, args.players, args.batch_size)
+    if args.mongo_url:
+        asyncio.run(bench_end_to_end(catalog, args.players, args.batch_size, args.mongo_url, args.db_name))
+    print(f"\nPeak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
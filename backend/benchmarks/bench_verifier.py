@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: run verification throughput
+
+Verifies batches of random run logs (a few percent of them impossible) with
+RunVerifier and reports runs per second for each batch size, including the
+cost of building the RunLog models the verifier receives from requests.
+
+Usage: python benchmarks/bench_verifier.py [--runs N] [--seed S]
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from catalog import MoveCatalog
+from models import RunLog
+from verifier import RunVerifier
+
+
+def random_runs(catalog, count, rng):
+    runs = []
+    for _ in range(count):
+        elapsed = rng.randint(30_000, 900_000)
+        moves = rng.sample(catalog.moves, 3)
+        cheat = rng.random() < 0.03
+        attacks = {
+            move.id: rng.randint(0, elapsed // max(move.cooldown, 1) + (50 if cheat else 1))
+            for move in moves
+        }
+        runs.append({
+            "worldId": rng.randint(1, 10),
+            "elapsedMs": elapsed,
+            "attacks": attacks,
+            "kills": rng.randint(0, 60),
+            "bossDefeated": elapsed >= 300_000 and rng.random() < 0.5,
+            "score": rng.randint(0, 20_000),
+        })
+    return runs
+
+
+def measure(label, func, count, repeat=5):
+    func()
+    best = min(_timed(func) for _ in range(repeat))
+    print(f"{label:<36} {best * 1e3:9.2f} ms  {count / best:12,.0f} runs/s")
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(total, seed):
+    catalog = MoveCatalog.load(Path(__file__).resolve().parent.parent / "data" / "moves.json")
+    verifier = RunVerifier(catalog)
+    raw = random_runs(catalog, total, random.Random(seed))
+    runs = [RunLog(**run) for run in raw]
+
+    verdicts = verifier.verify(runs)
+    print(f"{total} runs, {int((~verdicts.ok).sum())} flagged as impossible")
+    for size in (1, 10, 100, 1000, total):
+        if size > total:
+            continue
+        batches = [runs[i:i + size] for i in range(0, total, size)]
+        measure(f"verify, batches of {size}", lambda: [verifier.verify(batch) for batch in batches], total)
+    measure("parse RunLog + verify, one batch", lambda: verifier.verify([RunLog(**run) for run in raw]), total)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    main(args.runs, args.seed)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Load test: throughput and latency of every /api route, in process
+
+Builds the app with server.create_app inside this process, backed by an
+in-memory Motor fake (mongomock-motor) or by a real mongod given with
+--mongo-url, seeds a pool of players and drives each route in turn with
+--concurrency clients through httpx's ASGI transport. Requests/sec and p50/p95/p99 latency per route are
+written to --output as JSON; with --baseline, routes whose p95 latency rose
+or whose throughput fell by more than --threshold fail the run.
+
+Numbers against the fake measure the application's own CPU cost (routing,
+validation, encoding) plus an in-memory store; use --mongo-url for figures
+that include the driver and network.
+
+Absolute numbers depend on the machine: the committed baseline is only
+meaningful on the machine that recorded it, so regenerate it with
+--update-baseline before comparing anywhere else (e.g. on a new CI
+runner). A baseline recorded with a different --requests, --concurrency or
+store is not compared against at all. Routes are driven in order, so a
+route run on its own with --routes also pays for warming what the routes
+before it would have (leaderboard boards, caches).
+
+Usage:
+    python benchmarks/load_test.py [--requests N] [--concurrency C]
+        [--mongo-url URL] [--output results.json]
+        [--baseline benchmarks/baseline.json] [--threshold 0.25]
+        [--update-baseline]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+SEED_PLAYERS = 200
+ADMIN_TOKEN = "load-test-admin"
+ADMIN_HEADERS = {"Authorization": f"Bearer {ADMIN_TOKEN}"}
+IMPORT_DOCUMENTS = 100
+# Run settings a baseline must share with the current run to be comparable
+COMPARABLE_META = ("mongo", "requests", "concurrency")
+
+
+class Scenario(NamedTuple):
+    route: str  # "METHOD path_format", as reported
+    request: Callable[[int, random.Random], Tuple[str, str, Dict[str, Any]]]  # -> method, url, httpx kwargs
+    expected: Tuple[int, ...] = (200,)
+
+
+def player(rng: random.Random) -> str:
+    return f"load_player_{rng.randrange(SEED_PLAYERS)}"
+
+
+def world_progress(rng: random.Random) -> List[Dict[str, Any]]:
+    return [
+        {"worldId": i, "unlocked": True, "completed": i < 5, "bestTime": rng.randint(300_000, 600_000), "highScore": rng.randint(0, 10000)}
+        for i in range(1, 11)
+    ]
+
+
+def backing_runs(worlds: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Possible runs achieving each world's results, so saves are verified rather than capped"""
+    return [
+        {
+            "worldId": world["worldId"],
+            "elapsedMs": world["bestTime"],
+            "attacks": {"hold_1": world["bestTime"] // 8000},
+            "bossDefeated": True,
+            "score": world["highScore"],
+        }
+        for world in worlds
+    ]
+
+
+def progress_save(rng: random.Random, xp: int) -> Dict[str, Any]:
+    worlds = world_progress(rng)
+    return {
+        "playerStats": {"level": 5, "xp": xp, "xpToNext": 300, "health": 100, "maxHealth": 100, "coins": 1000},
+        "worldProgress": worlds,
+        "runs": backing_runs(worlds),
+    }
+
+
+def status_import(run_id: str) -> bytes:
+    """An ndjson export of status checks; repeated imports update the same documents"""
+    timestamp = {"$date": datetime.utcnow().isoformat(timespec="milliseconds") + "Z"}
+    return "".join(
+        json.dumps({"id": f"load_import_{run_id}_{i}", "client_name": f"load_{i % 16}", "timestamp": timestamp}) + "\n"
+        for i in range(IMPORT_DOCUMENTS)
+    ).encode()
+
+
+def scenarios(run_id: str, array_filters: bool = True) -> List[Scenario]:
+    # mongomock does not implement arrayFilters, which per-world patches use
+    def patch_body(rng: random.Random) -> Dict[str, Any]:
+        body: Dict[str, Any] = {"increment": {"coins": 5, "xp": 10}}
+        if array_filters:
+            worlds = [{"worldId": rng.randint(1, 10), "bestTime": rng.randint(300_000, 600_000), "highScore": rng.randint(0, 10000)}]
+            body.update(worlds=worlds, runs=backing_runs(worlds))
+        return body
+
+    import_body = status_import(run_id)
+
+    return [
+        Scenario("GET /api/", lambda i, rng: ("GET", "/api/", {})),
+        Scenario("GET /api/health/live", lambda i, rng: ("GET", "/api/health/live", {})),
+        Scenario("GET /api/health/ready", lambda i, rng: ("GET", "/api/health/ready", {})),
+        Scenario("POST /api/status", lambda i, rng: ("POST", "/api/status", {"json": {"client_name": f"load_{i % 16}"}})),
+        Scenario("GET /api/status", lambda i, rng: ("GET", "/api/status", {"params": {"limit": 100}})),
+        Scenario("GET /api/status/buckets", lambda i, rng: (
+            "GET", "/api/status/buckets", {"params": {"granularity": rng.choice(["minute", "hour"]), "limit": 100}}
+        )),
+        Scenario("GET /api/status/clients", lambda i, rng: ("GET", "/api/status/clients", {})),
+        Scenario("POST /api/game/progress", lambda i, rng: (
+            "POST", "/api/game/progress", {"json": {"playerId": f"load_new_{run_id}_{i}"}}
+        )),
+        Scenario("POST /api/game/progress/batch", lambda i, rng: ("POST", "/api/game/progress/batch", {"json": {"items": [
+            {"op": "update", "playerId": player(rng), "data": {"deathCount": rng.randint(0, 100)}} for _ in range(20)
+        ]}})),
+        Scenario("GET /api/game/progress/{player_id}", lambda i, rng: ("GET", f"/api/game/progress/{player(rng)}", {})),
+        Scenario("POST /api/game/progress/{player_id}/checkpoint", lambda i, rng: (
+            "POST", f"/api/game/progress/{player(rng)}/checkpoint", {}
+        )),
+        Scenario("GET /api/cache/stats", lambda i, rng: ("GET", "/api/cache/stats", {})),
+        Scenario("GET /api/jobs/stats", lambda i, rng: ("GET", "/api/jobs/stats", {})),
+        Scenario("GET /api/metrics", lambda i, rng: ("GET", "/api/metrics", {})),
+        Scenario("GET /api/analytics", lambda i, rng: ("GET", "/api/analytics", {"params": {"days": rng.choice([7, 30, 90])}})),
+        Scenario("GET /api/admin/export/{collection}", lambda i, rng: (
+            "GET", f"/api/admin/export/{rng.choice(['game_progress', 'status_checks'])}", {"headers": ADMIN_HEADERS}
+        )),
+        Scenario("POST /api/admin/import/{collection}", lambda i, rng: (
+            "POST", "/api/admin/import/status_checks",
+            {"headers": {**ADMIN_HEADERS, "Content-Type": "application/x-ndjson"}, "content": import_body},
+        )),
+        Scenario("PUT /api/game/progress/{player_id}", lambda i, rng: (
+            "PUT", f"/api/game/progress/{player(rng)}", {"json": progress_save(rng, rng.randint(0, 300))}
+        )),
+        Scenario("PATCH /api/game/progress/{player_id}", lambda i, rng: (
+            "PATCH", f"/api/game/progress/{player(rng)}", {"json": patch_body(rng)}
+        )),
+        # Each player can buy a move once; later purchases are the conflict path
+        Scenario("POST /api/shop/{player_id}/purchase", lambda i, rng: (
+            "POST", f"/api/shop/{player(rng)}/purchase", {"json": {"moveId": rng.choice(["hold_2", "double_2", "triple_2"])}}
+        ), (200, 409)),
+        Scenario("POST /api/shop/{player_id}/equip", lambda i, rng: (
+            "POST", f"/api/shop/{player(rng)}/equip", {"json": {"slot": "hold", "moveId": "hold_1"}}
+        )),
+        Scenario("GET /api/leaderboards/{world_id}", lambda i, rng: (
+            "GET", f"/api/leaderboards/{rng.randint(1, 10)}", {"params": {"limit": 50}}
+        )),
+        Scenario("GET /api/leaderboards/{world_id}/players/{player_id}", lambda i, rng: (
+            "GET", f"/api/leaderboards/{rng.randint(1, 10)}/players/{player(rng)}", {}
+        ), (200, 404)),
+        Scenario("GET /api/moves/available", lambda i, rng: ("GET", "/api/moves/available", {"params": {"maxCost": 500}})),
+        Scenario("GET /api/moves/{move_id}", lambda i, rng: ("GET", f"/api/moves/{rng.choice(['hold_1', 'double_3', 'triple_5'])}", {})),
+    ]
+
+
+def api_routes(app) -> List[str]:
+    return sorted(
+        f"{method} {route.path}"
+        for route in app.routes
+        if route.path.startswith("/api") and hasattr(route, "methods")
+        for method in route.methods - {"HEAD", "OPTIONS"}
+    )
+
+
+async def seed(client: httpx.AsyncClient) -> None:
+    items = [{"op": "create", "playerId": f"load_player_{i}"} for i in range(SEED_PLAYERS)]
+    for start in range(0, len(items), 1000):
+        response = await client.post("/api/game/progress/batch", json={"items": items[start:start + 1000]})
+        response.raise_for_status()
+    for i in range(SEED_PLAYERS):
+        response = await client.put(f"/api/game/progress/load_player_{i}", json=progress_save(random.Random(i), 0))
+        response.raise_for_status()
+
+
+async def drive(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int, seed_value: int) -> Dict[str, Any]:
+    latencies = np.zeros(requests)
+    errors: Dict[str, int] = {}
+    counter = iter(range(requests))
+    rng = random.Random(seed_value)
+
+    async def worker():
+        for i in counter:
+            method, url, kwargs = scenario.request(i, rng)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies[i] = time.perf_counter() - start
+            if response.status_code not in scenario.expected:
+                errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e3
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "mean_ms": round(float(latencies.mean() * 1e3), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Routes slower or less productive than the baseline by more than `threshold`"""
+    regressions = []
+    for route, current in results["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if previous is None:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            regressions.append(f"{route}: p95 {previous['p95_ms']:.2f} -> {current['p95_ms']:.2f} ms")
+        if current["rps"] < previous["rps"] * (1 - threshold):
+            regressions.append(f"{route}: {previous['rps']:.0f} -> {current['rps']:.0f} req/s")
+        if current["errors"] and not previous["errors"]:
+            regressions.append(f"{route}: unexpected responses {current['errors']}")
+    return regressions
+
+
+def mismatched_meta(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Run settings that differ between the current run and the baseline"""
+    current, previous = results["meta"], baseline.get("meta", {})
+    return [
+        f"{key} {previous.get(key)} -> {current[key]}"
+        for key in COMPARABLE_META
+        if previous.get(key) != current[key]
+    ]
+
+
+def load_app(mongo_url: Optional[str]):
+    os.environ["ADMIN_TOKEN"] = ADMIN_TOKEN
+    if mongo_url:
+        os.environ["MONGO_URL"] = mongo_url
+        os.environ["DB_NAME"] = os.environ.get("LOAD_TEST_DB_NAME", "phoenix_load_test")
+    else:
+        import mongomock_motor
+        import motor.motor_asyncio
+        motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+        os.environ.setdefault("MONGO_URL", "mongodb://in-memory")
+        os.environ.setdefault("DB_NAME", "phoenix_load_test")
+    import server
+    return server
+
+
+async def drop_databases(server) -> None:
+    """Drop DB_NAME and every database the partition router writes progress to"""
+    databases = {(id(server.client), server.db.name): (server.client, server.db.name)}
+    for collection in server.partitions.collections:
+        database = collection.database
+        databases[(id(database.client), database.name)] = (database.client, database.name)
+    for client, name in databases.values():
+        await client.drop_database(name)
+
+
+async def main(args) -> int:
+    server = load_app(args.mongo_url)
+    # One INFO line per request from the client would drown the results
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    app = server.create_app()
+    run_id = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+
+    plan = [s for s in scenarios(run_id, array_filters=bool(args.mongo_url)) if not args.routes or any(part in s.route for part in args.routes)]
+    uncovered = set(api_routes(app)) - {s.route for s in scenarios(run_id)}
+    if uncovered:
+        print(f"warning: routes without a scenario: {', '.join(sorted(uncovered))}")
+
+    async with app.router.lifespan_context(app):
+        # Start from an empty database with the server's indexes
+        await drop_databases(server)
+        await server.ensure_indexes()
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=60) as client:
+            await seed(client)
+            if server.job_queue is not None:
+                await server.job_queue.join()  # the seed's follow-ups would slow the first route
+            results: Dict[str, Any] = {
+                "meta": {
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "mongo": "mongomock-motor" if not args.mongo_url else "mongod",
+                    "requests": args.requests,
+                    "concurrency": args.concurrency,
+                    "python": platform.python_version(),
+                },
+                "routes": {},
+            }
+            print(f"{'route':<56} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  errors")
+            for index, scenario in enumerate(plan):
+                stats = await drive(client, scenario, args.requests, args.concurrency, seed_value=index)
+                results["routes"][scenario.route] = stats
+                print(
+                    f"{scenario.route:<56} {stats['rps']:9.0f} {stats['p50_ms']:8.2f} "
+                    f"{stats['p95_ms']:8.2f} {stats['p99_ms']:8.2f}  {stats['errors'] or ''}"
+                )
+        await drop_databases(server)
+
+    Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+    print(f"Results written to {args.output}")
+    if args.update_baseline:
+        Path(args.baseline).write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if Path(args.baseline).exists():
+        baseline = json.loads(Path(args.baseline).read_text())
+        mismatched = mismatched_meta(results, baseline)
+        if mismatched:
+            print(f"Not comparing against {args.baseline}, recorded with other settings: {', '.join(mismatched)}")
+            return 0
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    else:
+        print(f"No baseline at {args.baseline}; record one with --update-baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mongo-url", help="run against this mongod instead of the in-memory fake")
+    parser.add_argument("--routes", nargs="*", help="only routes containing one of these substrings")
+    parser.add_argument("--output", default="load_test_results.json")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,142 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class CacheBackend(ABC):
+    """Storage behind a ProgressCache.
+
+    Methods are async so a networked store (e.g. Redis) can implement the
+    same interface; values are Mongo documents and must be treated as
+    read-only by callers. `evictions` and `__len__` feed /api/cache/stats
+    and may be left at their defaults by stores that do not track them.
+    """
+
+    evictions = 0
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Any) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    def __len__(self) -> int:
+        return 0
+
+
+class InMemoryLRUCache(CacheBackend):
+    """Bounded in-process LRU with a per-entry time to live"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ProgressCache:
+    """Read-through cache of game progress documents keyed by playerId.
+
+    Concurrent misses for the same player share one load. Writers keep the
+    cache current with `put` (when they have the post-update document) or
+    `invalidate`; a load that started before such a write is not stored.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    async def get(self, player_id: str, loader: Callable[[str], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        doc = await self.backend.get(player_id)
+        if doc is not None:
+            self.hits += 1
+            return doc
+
+        self.misses += 1
+        loading = self._loading.get(player_id)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        loading = asyncio.get_running_loop().create_future()
+        self._loading[player_id] = loading
+        try:
+            doc = await loader(player_id)
+        except BaseException as e:
+            if self._loading.get(player_id) is loading:
+                del self._loading[player_id]
+            if isinstance(e, asyncio.CancelledError):
+                loading.cancel()
+            else:
+                loading.set_exception(e)
+                # Nobody else may be waiting; keep asyncio from warning about it
+                loading.exception()
+            raise
+
+        # A write since the load started took it out of `_loading`: the result
+        # is still fine for the waiters but must not be cached
+        if self._loading.get(player_id) is loading:
+            del self._loading[player_id]
+            if doc is not None:
+                await self.backend.set(player_id, doc)
+        loading.set_result(doc)
+        return doc
+
+    async def peek(self, player_id: str) -> Optional[Dict[str, Any]]:
+        """The cached document, without loading it on a miss"""
+        return await self.backend.get(player_id)
+
+    async def put(self, player_id: str, doc: Dict[str, Any]) -> None:
+        """Cache a document just written, unless a newer version already is
+        (racing saves can finish in either order)"""
+        self._loading.pop(player_id, None)
+        cached = await self.backend.get(player_id)
+        if cached is not None and (cached.get("version") or 0) >= (doc.get("version") or 0):
+            return
+        await self.backend.set(player_id, doc)
+
+    async def invalidate(self, player_id: str) -> None:
+        self._loading.pop(player_id, None)
+        await self.backend.delete(player_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions,
+            "size": len(self.backend),
+        }
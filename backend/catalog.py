@@ -0,0 +1,143 @@
+import bisect
+import hashlib
+import json
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from models import AttackMove
+
+
+class EncodedResponse(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def encode_response(payload: dict) -> EncodedResponse:
+    """Encode a JSON payload once and derive a strong ETag from its bytes"""
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+    return EncodedResponse(body, etag)
+
+
+def equipped_move_ids(equipped: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """Storage form of equipped moves: slot -> move id (or None).
+
+    Accepts whole moves as sent by clients and documents written before
+    moves were stored as ids, or ids already.
+    """
+    return {slot: move["id"] if isinstance(move, dict) else move for slot, move in equipped.items()}
+
+
+class MoveCatalog:
+    """Read-only catalog of the attack moves sold in the shop.
+
+    The catalog is loaded once and never changes at runtime, so all lookups
+    are served from indexes built up front, and every response the
+    `/moves` endpoints can produce is encoded to bytes ahead of time.
+    """
+
+    # Fields that describe a player's relation to a move, not the move itself
+    PLAYER_FIELDS = {"isOwned", "isEquipped"}
+
+    def __init__(self, moves: Iterable[AttackMove]):
+        # Every listing uses one order: grouped by type (in order of first
+        # appearance), cheapest first within a type
+        moves = tuple(moves)
+        type_order: Dict[str, int] = {}
+        for move in moves:
+            type_order.setdefault(move.type, len(type_order))
+        self.moves: Tuple[AttackMove, ...] = tuple(sorted(moves, key=lambda m: (type_order[m.type], m.cost)))
+
+        by_id: Dict[str, AttackMove] = {}
+        for move in self.moves:
+            if move.id in by_id:
+                raise ValueError(f"Duplicate move id in catalog: {move.id}")
+            by_id[move.id] = move
+        self.by_id = MappingProxyType(by_id)
+
+        # Per type, moves sorted by cost so `maxCost` filters are a bisect
+        by_type: Dict[str, List[AttackMove]] = {}
+        for move in self.moves:
+            by_type.setdefault(move.type, []).append(move)
+        self.by_type = MappingProxyType({t: tuple(ms) for t, ms in by_type.items()})
+        self._costs = {t: tuple(m.cost for m in ms) for t, ms in by_type.items()}
+
+        # Every distinct price point; a `maxCost` query is normalized to the
+        # highest of these it admits, which keeps the set of responses finite
+        self._price_points = tuple(sorted({m.cost for m in self.moves}))
+
+        self._encoded: Dict[Tuple[Optional[str], Optional[int]], EncodedResponse] = {}
+        for move_type in (None, *by_type):
+            self._encoded[(move_type, None)] = self._encode_list(move_type, None)
+            for cost in self._price_points:
+                self._encoded[(move_type, cost)] = self._encode_list(move_type, cost)
+        self._encoded_moves = {
+            move.id: encode_response(self._public(move)) for move in self.moves
+        }
+        self._empty = encode_response({"moves": [], "total": 0})
+
+        # Progress documents store equipped moves as ids; these are the
+        # shared, read-only moves they expand to in responses
+        self._equipped = {
+            move.id: move.model_dump() | {"isOwned": True, "isEquipped": True} for move in self.moves
+        }
+
+    @classmethod
+    def load(cls, path: Path) -> "MoveCatalog":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(AttackMove(**move) for move in json.load(f))
+
+    @classmethod
+    def _public(cls, move: AttackMove) -> dict:
+        return move.model_dump(exclude=cls.PLAYER_FIELDS)
+
+    def get(self, move_id: str) -> Optional[AttackMove]:
+        return self.by_id.get(move_id)
+
+    def filter(self, move_type: Optional[str] = None, max_cost: Optional[int] = None) -> Tuple[AttackMove, ...]:
+        """Moves of a type (all types when None) costing at most `max_cost`, in catalog order"""
+        if move_type is None:
+            if max_cost is None:
+                return self.moves
+            return tuple(m for t in self.by_type for m in self.filter(t, max_cost))
+
+        moves = self.by_type.get(move_type, ())
+        if max_cost is None:
+            return moves
+        return moves[:bisect.bisect_right(self._costs[move_type], max_cost)]
+
+    def missing(self, move_ids: Iterable[str]) -> List[str]:
+        """Ids that are not in the catalog"""
+        return [move_id for move_id in move_ids if move_id not in self.by_id]
+
+    def hydrate_equipped(self, equipped: Dict[str, Any]) -> Dict[str, Optional[dict]]:
+        """Response form of stored equipped moves.
+
+        Ids unknown to the catalog read as an empty slot; documents still
+        embedding whole moves (not yet migrated) are passed through.
+        """
+        return {
+            slot: self._equipped.get(move) if isinstance(move, str) else move
+            for slot, move in equipped.items()
+        }
+
+    def encoded_list(self, move_type: Optional[str] = None, max_cost: Optional[int] = None) -> EncodedResponse:
+        if move_type is not None and move_type not in self.by_type:
+            return self._empty
+        if max_cost is not None:
+            index = bisect.bisect_right(self._price_points, max_cost)
+            if index == 0:
+                return self._empty
+            max_cost = self._price_points[index - 1]
+        return self._encoded[(move_type, max_cost)]
+
+    def encoded_move(self, move_id: str) -> Optional[EncodedResponse]:
+        return self._encoded_moves.get(move_id)
+
+    def _encode_list(self, move_type: Optional[str], max_cost: Optional[int]) -> EncodedResponse:
+        moves = self.filter(move_type, max_cost)
+        return encode_response({
+            "moves": [self._public(move) for move in moves],
+            "total": len(moves),
+        })
@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Literal, Tuple
+
+from metrics import Histogram, labels, render_histogram
+
+logger = logging.getLogger(__name__)
+
+# Seconds from enqueue to done, and of one handler call
+JOB_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+JOB_RUN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+Handler = Callable[[List[Any]], Awaitable[None]]
+
+
+class JobType:
+    """A kind of job, its batch handler and retry policy, and its counters"""
+
+    def __init__(self, name: str, handler: Handler, batch_size: int, max_attempts: int, retry_delay: float, max_retry_delay: float):
+        self.name = name
+        self.handler = handler
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.pending: Deque["Job"] = deque()
+
+        self.enqueued = 0
+        self.shed = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.latency = Histogram(JOB_LATENCY_BUCKETS)
+        self.run_time = Histogram(JOB_RUN_BUCKETS)
+
+    def backoff(self, attempts: int) -> float:
+        # Exponential with jitter, so a batch failing everywhere does not retry in step
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self.pending),
+            "enqueued": self.enqueued,
+            "shed": self.shed,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "avgLatencyMs": round(self.latency.sum / self.latency.count * 1000, 2) if self.latency.count else None,
+        }
+
+
+class Job:
+    __slots__ = ("payload", "enqueued_at", "attempts")
+
+    def __init__(self, payload: Any):
+        self.payload = payload
+        self.enqueued_at = time.perf_counter()
+        self.attempts = 0
+
+
+class JobQueue:
+    """Bounded in-process queue for work that follows a response.
+
+    Save endpoints `enqueue` follow-ups (leaderboards, analytics, ...) and
+    return; `workers` tasks run them. Each job type has a batch handler
+    that receives the payloads of up to `batch_size` jobs of that type at
+    once, and types are served round robin so a busy one cannot starve the
+    rest. A handler that raises has its batch retried with exponential
+    backoff up to `max_attempts`, then the jobs are logged and counted as
+    failed; handlers must therefore be safe to repeat.
+
+    At most `max_size` jobs are queued, running or waiting for a retry.
+    When full, `enqueue` sheds the job (returns False) with
+    overflow="shed", or with "block" waits up to `block_timeout` seconds
+    for room first. `stop` stops taking jobs and drains what is queued.
+    With `workers=0` jobs run inline in `enqueue`, once.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        workers: int = 4,
+        overflow: Literal["shed", "block"] = "shed",
+        block_timeout: float = 1.0,
+    ):
+        self.max_size = max_size
+        self.workers = workers
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.types: Dict[str, JobType] = {}
+        self.size = 0  # queued + running + waiting for a retry
+        self._order: List[JobType] = []
+        self._next = 0
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks: List[asyncio.Task] = []
+        self._retries: Dict[asyncio.TimerHandle, Tuple[JobType, List[Job]]] = {}
+        self._closed = False
+
+    def register(
+        self,
+        name: str,
+        handler: Handler,
+        batch_size: int = 100,
+        max_attempts: int = 5,
+        retry_delay: float = 0.5,
+        max_retry_delay: float = 30.0,
+    ) -> None:
+        job_type = JobType(name, handler, batch_size, max_attempts, retry_delay, max_retry_delay)
+        self.types[name] = job_type
+        self._order.append(job_type)
+
+    @property
+    def depth(self) -> int:
+        """Jobs waiting for a worker"""
+        return sum(len(job_type.pending) for job_type in self._order)
+
+    async def enqueue(self, name: str, payload: Any) -> bool:
+        """Queue one job; False when it was shed"""
+        job_type = self.types[name]
+        if self.workers <= 0:
+            job_type.enqueued += 1
+            await self._run(job_type, [Job(payload)], retry=False)
+            return True
+        if self._closed:
+            job_type.shed += 1
+            logger.warning("Job queue stopped, shed a %s job", name)
+            return False
+        if self.size >= self.max_size and not await self._wait_for_space():
+            job_type.shed += 1
+            logger.warning("Job queue full (%d jobs), shed a %s job", self.size, name)
+            return False
+        job_type.enqueued += 1
+        job_type.pending.append(Job(payload))
+        self.size += 1
+        self._idle.clear()
+        self._ready.set()
+        return True
+
+    async def _wait_for_space(self) -> bool:
+        if self.overflow != "block":
+            return False
+        deadline = time.monotonic() + self.block_timeout
+        while self.size >= self.max_size and not self._closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._space.clear()
+            try:
+                await asyncio.wait_for(self._space.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return not self._closed
+
+    def start(self) -> None:
+        if not self._tasks and self.workers > 0:
+            self._closed = False
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def join(self) -> None:
+        """Wait until every job enqueued so far is done or has failed"""
+        await self._idle.wait()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Stop accepting jobs and drain the queue, retries included, for up
+        to `timeout` seconds; whatever is left after that is dropped"""
+        self._closed = True
+        self._space.set()  # blocked producers give up
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Job queue drain timed out, dropping %d jobs", self.size)
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        while True:
+            job_type, jobs = await self._take()
+            await self._run(job_type, jobs)
+
+    async def _take(self) -> Tuple[JobType, List[Job]]:
+        while True:
+            for _ in range(len(self._order)):
+                job_type = self._order[self._next % len(self._order)]
+                self._next += 1
+                if job_type.pending:
+                    count = min(len(job_type.pending), job_type.batch_size)
+                    return job_type, [job_type.pending.popleft() for _ in range(count)]
+            self._ready.clear()
+            await self._ready.wait()
+
+    async def _run(self, job_type: JobType, jobs: List[Job], retry: bool = True) -> None:
+        started = time.perf_counter()
+        try:
+            await job_type.handler([job.payload for job in jobs])
+        except Exception:
+            job_type.run_time.observe(time.perf_counter() - started)
+            self._failed(job_type, jobs, retry)
+            return
+        finished = time.perf_counter()
+        job_type.run_time.observe(finished - started)
+        for job in jobs:
+            job_type.latency.observe(finished - job.enqueued_at)
+        job_type.completed += len(jobs)
+        if retry:
+            self._done(len(jobs))
+
+    def _failed(self, job_type: JobType, jobs: List[Job], retry: bool) -> None:
+        attempts = max(job.attempts for job in jobs) + 1
+        for job in jobs:
+            job.attempts += 1
+        if retry and attempts < job_type.max_attempts:
+            job_type.retried += len(jobs)
+            delay = job_type.backoff(attempts)
+            logger.warning("%d %s jobs failed (attempt %d), retrying in %.2fs", len(jobs), job_type.name, attempts, delay, exc_info=True)
+            handle = asyncio.get_running_loop().call_later(delay, self._requeue, job_type, jobs)
+            self._retries[handle] = (job_type, jobs)
+            return
+        job_type.failed += len(jobs)
+        logger.exception("%d %s jobs failed after %d attempts, dropped", len(jobs), job_type.name, attempts)
+        if retry:
+            self._done(len(jobs))
+
+    def _requeue(self, job_type: JobType, jobs: List[Job]) -> None:
+        for handle, (_, retried) in list(self._retries.items()):
+            if retried is jobs:
+                del self._retries[handle]
+        # Ahead of newer jobs of the type, in their original order
+        job_type.pending.extendleft(reversed(jobs))
+        self._ready.set()
+
+    def _done(self, count: int) -> None:
+        self.size -= count
+        self._space.set()
+        if not self.size:
+            self._idle.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "maxSize": self.max_size,
+            "size": self.size,
+            "depth": self.depth,
+            "types": {name: job_type.stats() for name, job_type in self.types.items()},
+        }
+
+    def render_metrics(self) -> bytes:
+        """Queue metrics in the Prometheus text format, to follow Metrics.render"""
+        lines = [
+            "# HELP jobs_queue_depth Jobs waiting for a worker",
+            "# TYPE jobs_queue_depth gauge",
+            f"jobs_queue_depth {self.depth}",
+            "# HELP jobs_in_system Jobs queued, running or waiting for a retry",
+            "# TYPE jobs_in_system gauge",
+            f"jobs_in_system {self.size}",
+            "# HELP jobs_total Jobs by type and outcome",
+            "# TYPE jobs_total counter",
+        ]
+        for name, job_type in sorted(self.types.items()):
+            for outcome in ("enqueued", "shed", "completed", "retried", "failed"):
+                lines.append(f"jobs_total{{{labels(type=name, outcome=outcome)}}} {getattr(job_type, outcome)}")
+        lines += [
+            "# HELP job_latency_seconds Time from enqueue to completion by job type",
+            "# TYPE job_latency_seconds histogram",
+        ]
+        for name, job_type in sorted(self.types.items()):
+            render_histogram(lines, "job_latency_seconds", labels(type=name), job_type.latency)
+        lines += [
+            "# HELP job_run_seconds Duration of one batch handler call by job type",
+            "# TYPE job_run_seconds histogram",
+        ]
+        for name, job_type in sorted(self.types.items()):
+            render_histogram(lines, "job_run_seconds", labels(type=name), job_type.run_time)
+        return ("\n".join(lines) + "\n").encode()
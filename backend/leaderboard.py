@@ -0,0 +1,348 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from sortedcontainers import SortedList
+
+logger = logging.getLogger(__name__)
+
+HIGH_SCORE = "highScore"
+BEST_TIME = "bestTime"
+METRICS = (HIGH_SCORE, BEST_TIME)
+
+
+class WorldBoard:
+    """The top `capacity` players of one world, ordered for both metrics.
+
+    Entries are kept in sorted lists keyed so that index 0 is first place
+    (highest score, fastest time; ties broken by playerId), which makes a
+    page of the top a slice and a top player's rank a bisect. Players below
+    the cut live only in `leaderboard_entries`. Bests only improve, so a
+    player pushed out of the top never needs to come back until a reload.
+    `totals` counts every ranked player, as of the last load plus the
+    players this worker has since ranked.
+    """
+
+    def __init__(self, capacity: int = 1000, totals: Optional[Dict[str, int]] = None):
+        self.capacity = capacity
+        self.totals = dict(totals or {HIGH_SCORE: 0, BEST_TIME: 0})
+        self._sorted = {HIGH_SCORE: SortedList(), BEST_TIME: SortedList()}
+        self._best: Dict[str, Dict[str, int]] = {HIGH_SCORE: {}, BEST_TIME: {}}
+        self._evicted = {HIGH_SCORE: False, BEST_TIME: False}
+        self.loaded_at = time.monotonic()
+
+    @staticmethod
+    def _key(metric: str, player_id: str, value: int) -> Tuple[int, str]:
+        return (-value if metric == HIGH_SCORE else value, player_id)
+
+    @staticmethod
+    def improves(metric: str, value: int, current: Optional[int]) -> bool:
+        if value <= 0:
+            return False  # 0 means "not played" for both metrics
+        if current is None:
+            return True
+        return value > current if metric == HIGH_SCORE else value < current
+
+    def best(self, metric: str, player_id: str) -> Optional[int]:
+        return self._best[metric].get(player_id)
+
+    def update(self, metric: str, player_id: str, value: int) -> bool:
+        """Record an improved best; returns whether the top changed. O(log n)"""
+        ranked = self._sorted[metric]
+        key = self._key(metric, player_id, value)
+        current = self._best[metric].get(player_id)
+        if current is not None:
+            if not self.improves(metric, value, current):
+                return False
+            ranked.remove(self._key(metric, player_id, current))
+        elif value <= 0 or (len(ranked) >= self.capacity and key >= ranked[-1]):
+            return False
+        ranked.add(key)
+        self._best[metric][player_id] = value
+        if len(ranked) > self.capacity:
+            _, evicted = ranked.pop()
+            del self._best[metric][evicted]
+            self._evicted[metric] = True
+        return True
+
+    def size(self, metric: str) -> int:
+        return len(self._sorted[metric])
+
+    def complete(self, metric: str) -> bool:
+        """Whether every ranked player is in the top.
+
+        Never once a player has been pushed out: they are still ranked, and
+        `totals` may not know of players other workers ranked since the load.
+        """
+        return not self._evicted[metric] and self.totals[metric] <= self.size(metric)
+
+    def rank(self, metric: str, player_id: str) -> Optional[int]:
+        """1-based rank, or None when the player is not in the top"""
+        value = self._best[metric].get(player_id)
+        if value is None:
+            return None
+        return self._sorted[metric].bisect_left(self._key(metric, player_id, value)) + 1
+
+    def entries(self, metric: str, start: int, stop: int) -> List[Dict[str, Any]]:
+        """Entries ranked start+1 .. stop, as far as the top reaches"""
+        start = max(start, 0)
+        return [
+            {"rank": rank, "playerId": player_id, "value": abs(sort_value)}
+            for rank, (sort_value, player_id) in enumerate(self._sorted[metric][start:stop], start=start + 1)
+        ]
+
+
+class Leaderboards:
+    """Per-world high score and best time rankings.
+
+    `leaderboard_entries` holds one document per (world, player) and is the
+    durable store shared by all workers; it is only written when a save
+    improves a player's best, with `$max`/`$min` so concurrent writers
+    cannot move a best backwards. Each worker keeps a WorldBoard of the top
+    `top_size` players per world, loaded on first use and then updated
+    incrementally. Pages past the top and ranks of players outside it are
+    answered from the collection's indexes. Boards older than
+    `refresh_interval` seconds are reloaded in the background, to pick up
+    improvements recorded by other workers, while the old board keeps
+    serving.
+    """
+
+    def __init__(self, collection, refresh_interval: float = 300.0, top_size: int = 1000):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self.top_size = top_size
+        self._boards: Dict[int, WorldBoard] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._reloads: Dict[int, asyncio.Task] = {}
+        # Improvements recorded while a world's reload runs, replayed onto the new board
+        self._recorded: Dict[int, List[Tuple[str, str, int]]] = {}
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index(
+            [("worldId", ASCENDING), (HIGH_SCORE, DESCENDING), ("playerId", ASCENDING)]
+        )
+        await self.collection.create_index(
+            [("worldId", ASCENDING), (BEST_TIME, ASCENDING), ("playerId", ASCENDING)],
+            partialFilterExpression={BEST_TIME: {"$gt": 0}},
+        )
+
+    async def board(self, world_id: int) -> WorldBoard:
+        board = self._boards.get(world_id)
+        if board is not None:
+            if self._is_stale(board) and world_id not in self._reloads:
+                self._reloads[world_id] = asyncio.create_task(self._reload(world_id))
+            return board
+
+        lock = self._locks.setdefault(world_id, asyncio.Lock())
+        async with lock:
+            board = self._boards.get(world_id)
+            if board is None:
+                board = self._boards[world_id] = await self._load(world_id)
+            return board
+
+    async def entries(self, world_id: int, metric: str, start: int, stop: int) -> List[Dict[str, Any]]:
+        """Entries ranked start+1 .. stop"""
+        board = await self.board(world_id)
+        start = max(start, 0)
+        if stop <= board.size(metric) or board.complete(metric):
+            return board.entries(metric, start, stop)
+        if stop <= start:
+            return []
+        cursor = self.collection.find(
+            self._ranked(world_id, metric), {"_id": 0, "playerId": 1, metric: 1}
+        ).sort(self._order(metric)).skip(start).limit(stop - start)
+        return [
+            {"rank": rank, "playerId": entry["playerId"], "value": entry[metric]}
+            for rank, entry in enumerate(await cursor.to_list(None), start=start + 1)
+        ]
+
+    async def rank(self, world_id: int, metric: str, player_id: str) -> Optional[Tuple[int, int]]:
+        """A player's 1-based rank and best, or None when they have no entry"""
+        board = await self.board(world_id)
+        rank = board.rank(metric, player_id)
+        if rank is not None:
+            return rank, board.best(metric, player_id)
+
+        entry = await self.collection.find_one({"_id": self._entry_id(world_id, player_id)}, {metric: 1})
+        value = (entry or {}).get(metric) or 0
+        if value <= 0:
+            return None
+        # Players strictly ahead, then players tied but ahead by playerId
+        ahead = await asyncio.gather(
+            self.collection.count_documents({"worldId": world_id, metric: self._better(metric, value)}),
+            self.collection.count_documents({"worldId": world_id, metric: value, "playerId": {"$lt": player_id}}),
+        )
+        return sum(ahead) + 1, value
+
+    async def total(self, world_id: int, metric: str) -> int:
+        return (await self.board(world_id)).totals[metric]
+
+    async def record(self, player_id: str, worlds: Iterable[Dict[str, Any]]) -> int:
+        """Apply a player's saved world progress; returns how many bests improved"""
+        return await self.record_many([(player_id, worlds)])
+
+    async def record_many(self, saves: Iterable[Tuple[str, Iterable[Dict[str, Any]]]]) -> int:
+        """Apply several (player_id, worlds) saves with one read and one bulk write.
+
+        The stored entries of every (world, player) saved are read first so
+        only improvements are written; boards are updated once the write
+        has succeeded, so a failed batch can simply be retried.
+        """
+        saves = [(player_id, list(worlds)) for player_id, worlds in saves]
+        entry_ids = {
+            self._entry_id(world["worldId"], player_id)
+            for player_id, worlds in saves for world in worlds
+            if any((world.get(metric) or 0) > 0 for metric in METRICS)
+        }
+        if not entry_ids:
+            return 0
+        stored = {
+            entry["_id"]: entry
+            async for entry in self.collection.find({"_id": {"$in": list(entry_ids)}}, {HIGH_SCORE: 1, BEST_TIME: 1})
+        }
+
+        operations = []
+        improvements: List[Tuple[int, str, Dict[str, int], List[str]]] = []
+        for player_id, worlds in saves:
+            for world in worlds:
+                entry = stored.setdefault(self._entry_id(world["worldId"], player_id), {})
+                improved = {
+                    metric: world.get(metric) or 0
+                    for metric in METRICS
+                    if WorldBoard.improves(metric, world.get(metric) or 0, entry.get(metric))
+                }
+                if not improved:
+                    continue
+                # Metrics the player had no entry for rank them for the first time
+                added = [metric for metric in improved if not entry.get(metric)]
+                entry.update(improved)
+                improvements.append((world["worldId"], player_id, improved, added))
+                update: Dict[str, Any] = {"$set": {"worldId": world["worldId"], "playerId": player_id, "updatedAt": datetime.utcnow()}}
+                if HIGH_SCORE in improved:
+                    update["$max"] = {HIGH_SCORE: improved[HIGH_SCORE]}
+                if BEST_TIME in improved:
+                    update["$min"] = {BEST_TIME: improved[BEST_TIME]}
+                operations.append(UpdateOne({"_id": self._entry_id(world["worldId"], player_id)}, update, upsert=True))
+
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+        for world_id, player_id, improved, added in improvements:
+            board = self._boards.get(world_id)
+            for metric, value in improved.items():
+                if board is not None:
+                    if metric in added:
+                        board.totals[metric] += 1
+                    board.update(metric, player_id, value)
+                if world_id in self._recorded:
+                    self._recorded[world_id].append((metric, player_id, value))
+        return len(operations)
+
+    async def rebuild(self, progress_collections: Iterable[Any], batch_size: int = 1000) -> int:
+        """Recompute every entry from `game_progress`, streaming it in batches.
+
+        Every partition in `progress_collections` is scanned concurrently.
+        Entries are rewritten with exact values (so bests that were lowered
+        by hand are honoured) and entries neither rebuilt nor recorded during
+        the run, such as those of deleted players, are removed afterwards.
+        """
+        run_started = datetime.utcnow()
+
+        async def scan(progress_collection) -> int:
+            operations: List[UpdateOne] = []
+            players = 0
+            cursor = progress_collection.find({}, {"_id": 0, "playerId": 1, "worldProgress": 1}).batch_size(batch_size)
+            async for progress in cursor:
+                players += 1
+                for world in progress.get("worldProgress") or []:
+                    best = {metric: world.get(metric) or 0 for metric in METRICS}
+                    if not any(value > 0 for value in best.values()):
+                        continue
+                    entry = {"worldId": world["worldId"], "playerId": progress["playerId"], "updatedAt": run_started}
+                    entry.update((metric, value) for metric, value in best.items() if value > 0)
+                    unset = {metric: "" for metric, value in best.items() if value <= 0}
+                    update: Dict[str, Any] = {"$set": entry}
+                    if unset:
+                        update["$unset"] = unset
+                    operations.append(UpdateOne(
+                        {"_id": self._entry_id(world["worldId"], progress["playerId"])}, update, upsert=True
+                    ))
+                if len(operations) >= batch_size:
+                    await self.collection.bulk_write(operations, ordered=False)
+                    operations = []
+            if operations:
+                await self.collection.bulk_write(operations, ordered=False)
+            return players
+
+        players = sum(await asyncio.gather(*(scan(collection) for collection in progress_collections)))
+
+        await self.collection.delete_many({"$or": [
+            {"updatedAt": {"$lt": run_started}},
+            {"updatedAt": {"$exists": False}},
+        ]})
+        self._boards.clear()
+        return players
+
+    async def stop(self) -> None:
+        """Cancel background reloads"""
+        reloads = list(self._reloads.values())
+        for task in reloads:
+            task.cancel()
+        await asyncio.gather(*reloads, return_exceptions=True)
+
+    def _is_stale(self, board: WorldBoard) -> bool:
+        return self.refresh_interval > 0 and time.monotonic() - board.loaded_at > self.refresh_interval
+
+    async def _reload(self, world_id: int) -> None:
+        self._recorded[world_id] = []
+        try:
+            board = await self._load(world_id)
+            for metric, player_id, value in self._recorded[world_id]:
+                board.update(metric, player_id, value)
+            if world_id in self._boards:  # not dropped by a rebuild meanwhile
+                self._boards[world_id] = board
+        except Exception:
+            logger.exception("Reloading leaderboard for world %d failed", world_id)
+            # Keep serving the old board and try again after another interval
+            if world_id in self._boards:
+                self._boards[world_id].loaded_at = time.monotonic()
+        finally:
+            self._recorded.pop(world_id, None)
+            self._reloads.pop(world_id, None)
+
+    async def _load(self, world_id: int) -> WorldBoard:
+        started = time.monotonic()
+        totals = await asyncio.gather(*(
+            self.collection.count_documents(self._ranked(world_id, metric)) for metric in METRICS
+        ))
+        board = WorldBoard(self.top_size, dict(zip(METRICS, totals)))
+        for metric in METRICS:
+            cursor = self.collection.find(
+                self._ranked(world_id, metric), {"_id": 0, "playerId": 1, metric: 1}
+            ).sort(self._order(metric)).limit(self.top_size)
+            async for entry in cursor:
+                board.update(metric, entry["playerId"], entry[metric])
+        logger.info(
+            "Loaded leaderboard for world %d: top %d of %d players in %.2fs",
+            world_id, board.size(HIGH_SCORE), board.totals[HIGH_SCORE], time.monotonic() - started,
+        )
+        return board
+
+    @staticmethod
+    def _ranked(world_id: int, metric: str) -> Dict[str, Any]:
+        # `$gt: 0` also lets best times use their partial index
+        return {"worldId": world_id, metric: {"$gt": 0}}
+
+    @staticmethod
+    def _better(metric: str, value: int) -> Dict[str, Any]:
+        return {"$gt": value} if metric == HIGH_SCORE else {"$gt": 0, "$lt": value}
+
+    @staticmethod
+    def _order(metric: str) -> List[Tuple[str, int]]:
+        return [(metric, DESCENDING if metric == HIGH_SCORE else ASCENDING), ("playerId", ASCENDING)]
+
+    @staticmethod
+    def _entry_id(world_id: int, player_id: str) -> str:
+        return f"{world_id}:{player_id}"
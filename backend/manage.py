@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Phoenix Flying Game backend maintenance commands
+
+Run from the backend directory, with the same environment as the server:
+    python manage.py --help
+"""
+
+import asyncio
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+app = typer.Typer(help="Phoenix Flying Game backend maintenance commands", no_args_is_help=True)
+
+
+@app.callback()
+def main():
+    """Phoenix Flying Game backend maintenance commands"""
+
+
+def run(coro):
+    """Run a command against the server's database and close the client afterwards"""
+    import server
+    from settings import Settings
+
+    async def main():
+        server.connect(Settings.from_env())
+        try:
+            return await coro(server)
+        finally:
+            server.partitions.close()
+            server.client.close()
+
+    return asyncio.run(main())
+
+
+@app.command("rebuild-leaderboards")
+def rebuild_leaderboards(batch_size: int = typer.Option(1000, help="Documents per cursor batch and bulk write")):
+    """Recompute all leaderboard entries from game_progress"""
+    async def rebuild(server):
+        await server.leaderboards.ensure_indexes()
+        started = time.monotonic()
+        players = await server.leaderboards.rebuild(server.partitions.collections, batch_size=batch_size)
+        elapsed = time.monotonic() - started
+        typer.echo(f"Rebuilt leaderboards from {players} players in {elapsed:.1f}s ({players / max(elapsed, 1e-9):.0f} players/s)")
+
+    run(rebuild)
+
+
+@app.command("rebuild-analytics")
+def rebuild_analytics():
+    """Recompute the analytics rollups from game_progress with aggregation pipelines"""
+    from analytics import Analytics
+
+    async def rebuild(server):
+        analytics = server.analytics or Analytics(server.db.analytics_rollups, server.db.analytics_contributions)
+        await analytics.ensure_indexes()
+        started = time.monotonic()
+        stats = await analytics.rebuild(server.partitions.collections)
+        elapsed = time.monotonic() - started
+        typer.echo(f"Rebuilt {stats['rollups']} rollups from {stats['players']} players in {elapsed:.1f}s")
+
+    run(rebuild)
+
+
+@app.command("compact-status-checks")
+def compact_status_checks():
+    """Compact raw status checks into minute/hour buckets up to the compaction lag"""
+    async def compact(server):
+        await server.status_retention.ensure_indexes()
+        started = time.monotonic()
+        stats = await server.status_retention.compact()
+        if stats is None:
+            typer.echo("Another worker is compacting status checks; try again later", err=True)
+            raise typer.Exit(1)
+        elapsed = time.monotonic() - started
+        typer.echo(
+            f"Compacted {stats['checks']} checks into {stats['minuteBuckets']} minute and "
+            f"{stats['hourBuckets']} hour buckets in {elapsed:.1f}s; compacted up to {stats['watermark']}"
+        )
+
+    run(compact)
+
+
+@app.command("migrate-equipped-moves")
+def migrate_equipped_moves(
+    batch_size: int = typer.Option(1000, help="Documents per cursor batch and bulk write"),
+    restart: bool = typer.Option(False, help="Ignore the checkpoint of an earlier run and scan from the start"),
+):
+    """Store equipped moves as catalog ids instead of embedded moves (resumable)"""
+    from migrations import EQUIPPED_MOVE_IDS, migrate_equipped_move_ids
+    from partitions import DEFAULT_PARTITION
+
+    async def migrate_partition(server, partition):
+        prefix = "" if partition.name == DEFAULT_PARTITION else f"[{partition.name}] "
+
+        def report(stats):
+            rate = stats["scanned"] / max(stats["elapsed"], 1e-9)
+            typer.echo(f"  {prefix}{stats['migrated']} migrated / {stats['scanned']} scanned, {rate:.0f} docs/s")
+
+        stats = await migrate_equipped_move_ids(
+            partition.collection,
+            server.db.migrations,
+            slots=server.move_catalog.by_type,
+            batch_size=batch_size,
+            restart=restart,
+            report=report,
+            state_id=EQUIPPED_MOVE_IDS if partition.name == DEFAULT_PARTITION else f"{EQUIPPED_MOVE_IDS}:{partition.name}",
+        )
+        if stats["resumedFrom"] is not None:
+            typer.echo(f"{prefix}Resumed after _id {stats['resumedFrom']}")
+        rate = stats["scanned"] / max(stats["elapsed"], 1e-9)
+        typer.echo(f"{prefix}Migrated {stats['migrated']} of {stats['scanned']} documents in {stats['elapsed']:.1f}s ({rate:.0f} docs/s)")
+
+    async def migrate(server):
+        await asyncio.gather(*(migrate_partition(server, partition) for partition in server.partitions.partitions))
+
+    run(migrate)
+
+
+@app.command("rebalance-partitions")
+def rebalance_partitions(
+    batch_size: int = typer.Option(1000, help="Players moved per bulk write"),
+    dry_run: bool = typer.Option(False, help="Only count the players that would move"),
+):
+    """Move players onto the partition they hash to after PROGRESS_PARTITIONS changed.
+
+    Servers should run with PROGRESS_PARTITIONS_MIGRATING=true (and the new
+    partitions) until this finishes; re-running it is safe.
+    """
+    def report(stats):
+        typer.echo(f"  {stats['moved']} moved / {stats['misplaced']} misplaced / {stats['scanned']} scanned")
+
+    async def rebalance(server):
+        await server.partitions.ensure_indexes()
+        started = time.monotonic()
+        stats = await server.partitions.rebalance(batch_size=batch_size, dry_run=dry_run, report=report)
+        elapsed = time.monotonic() - started
+        names = ", ".join(partition.name for partition in server.partitions.partitions)
+        typer.echo(f"Scanned {stats['scanned']} players across {names} in {elapsed:.1f}s; {stats['misplaced']} misplaced")
+        for route, players in sorted(stats["routes"].items()):
+            typer.echo(f"  {route}: {players}")
+        if not dry_run:
+            typer.echo(f"Moved {stats['moved']}; {stats['kept']} changed during the move and were left for the next run")
+
+    run(rebalance)
+
+
+def transfer_format(path: Path, fmt: Optional[str]) -> str:
+    """Explicit --format, else from the file name (players.bson.gz -> bson)"""
+    import transfer
+
+    fmt = fmt or ("bson" if ".bson" in path.suffixes else "ndjson")
+    if fmt not in transfer.FORMATS:
+        raise typer.BadParameter(f"format must be one of {', '.join(transfer.FORMATS)}")
+    return fmt
+
+
+def check_collection(collection: str) -> str:
+    import transfer
+
+    if collection not in transfer.COLLECTIONS:
+        raise typer.BadParameter(f"collection must be one of {', '.join(transfer.COLLECTIONS)}")
+    return collection
+
+
+@app.command("export")
+def export(
+    collection: str = typer.Argument(..., callback=check_collection, help="game_progress or status_checks"),
+    output: Path = typer.Argument(..., help="File to write; '-' for stdout"),
+    format: Optional[str] = typer.Option(None, help="ndjson or bson (default: from the file name, else ndjson)"),
+    gzip: Optional[bool] = typer.Option(None, help="Compress the output (default: when the file name ends in .gz)"),
+    since: Optional[datetime] = typer.Option(None, help="Only documents updated at or after this time (UTC)"),
+    until: Optional[datetime] = typer.Option(None, help="Only documents updated before this time (UTC)"),
+    batch_size: int = typer.Option(1000, help="Documents per cursor batch"),
+):
+    """Stream a collection to NDJSON (Extended JSON) or BSON, optionally gzipped"""
+    import transfer
+
+    fmt = transfer_format(output, format)
+    compress = gzip if gzip is not None else output.suffix == ".gz"
+    spec = transfer.COLLECTIONS[collection]
+
+    async def export_collection(server):
+        stats = {}
+        started = time.monotonic()
+        source = server.partitions.collections if collection == "game_progress" else server.db[collection]
+        chunks = transfer.export_chunks(
+            source, fmt, transfer.time_filter(spec, since, until),
+            batch_size=batch_size, compress=compress, stats=stats,
+        )
+        out = sys.stdout.buffer if str(output) == "-" else output.open("wb")
+        try:
+            async for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        elapsed = time.monotonic() - started
+        typer.echo(
+            f"Exported {stats['documents']} documents ({stats['bytes'] / 1e6:.1f} MB) in {elapsed:.1f}s "
+            f"({stats['documents'] / max(elapsed, 1e-9):.0f} docs/s)",
+            err=True,
+        )
+
+    run(export_collection)
+
+
+@app.command("import")
+def import_(
+    collection: str = typer.Argument(..., callback=check_collection, help="game_progress or status_checks"),
+    input: Path = typer.Argument(..., help="Export to read, gzipped or not; '-' for stdin"),
+    format: Optional[str] = typer.Option(None, help="ndjson or bson (default: from the file name, else ndjson)"),
+    batch_size: int = typer.Option(1000, help="Documents per bulk upsert"),
+    chunk_size: int = typer.Option(1 << 20, help="Bytes read from the file at a time"),
+):
+    """Upsert an export into a collection (by playerId for game_progress, id for status_checks)"""
+    import transfer
+
+    fmt = transfer_format(input, format)
+    spec = transfer.COLLECTIONS[collection]
+
+    async def read_chunks():
+        source = sys.stdin.buffer if str(input) == "-" else input.open("rb")
+        try:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+
+    async def import_collection(server):
+        started = time.monotonic()
+        try:
+            stats = await transfer.import_chunks(
+                server.db[collection], spec.key, read_chunks(), fmt, batch_size=batch_size,
+                partitions=server.partitions if collection == "game_progress" else None,
+            )
+        except ValueError as e:
+            raise typer.BadParameter(f"{input} is not a valid {fmt} export: {e}")
+        elapsed = time.monotonic() - started
+        typer.echo(
+            f"Imported {stats['documents']} documents in {elapsed:.1f}s ({stats['documents'] / max(elapsed, 1e-9):.0f} docs/s): "
+            f"{stats['inserted']} inserted, {stats['updated']} updated, {stats['skipped']} skipped, {stats['errors']} errors"
+        )
+        if collection == "game_progress":
+            typer.echo("Leaderboards and analytics are not updated by imports; run rebuild-leaderboards and rebuild-analytics next")
+
+    run(import_collection)
+
+
+if __name__ == "__main__":
+    app()
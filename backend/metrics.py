@@ -0,0 +1,224 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import monitoring
+
+# Upper bounds in seconds; a final +Inf bucket is implied
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+UNMATCHED_ROUTE = "<unmatched>"  # one label for every path no route matched (404s, scans)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Fixed-bucket histogram; counts are per bucket and made cumulative on render"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram") -> None:
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+
+class RouteMetrics:
+    __slots__ = ("latency", "statuses")
+
+    def __init__(self):
+        self.latency = Histogram(REQUEST_BUCKETS)
+        self.statuses: Dict[int, int] = {}
+
+
+def labels(**labels: str) -> str:
+    """Prometheus label set, e.g. `method="GET",route="/api/"`"""
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+def render_histogram(lines: List[str], name: str, labels: str, histogram: Histogram) -> None:
+    """Append a histogram's cumulative buckets, sum and count in Prometheus text format"""
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command by collection and command name.
+
+    Motor runs PyMongo on a thread pool, so events arrive on several threads
+    at once. Each thread records into its own histograms (registered once
+    per thread, the only time a lock is taken) and a scrape merges them.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[Dict[Tuple[str, str], List]] = []
+        self._shards_lock = threading.Lock()
+        # request_id -> collection, set when a command starts
+        self._collections: Dict[int, str] = {}
+
+    def _shard(self) -> Dict[Tuple[str, str], List]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        if isinstance(target, str):
+            self._collections[event.request_id] = target
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._record(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._record(event, failed=True)
+
+    def _record(self, event, failed: bool) -> None:
+        collection = self._collections.pop(event.request_id, None)
+        if collection is None:
+            return  # handshakes, pings, session and admin commands
+        shard = self._shard()
+        key = (collection, event.command_name)
+        entry = shard.get(key)
+        if entry is None:
+            entry = shard[key] = [Histogram(COMMAND_BUCKETS), 0]
+        entry[0].observe(event.duration_micros / 1e6)
+        if failed:
+            entry[1] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, str], Tuple[Histogram, int]]:
+        merged: Dict[Tuple[str, str], Tuple[Histogram, int]] = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for key, (histogram, failures) in list(shard.items()):
+                total, total_failures = merged.get(key) or (Histogram(COMMAND_BUCKETS), 0)
+                total.merge(histogram)
+                merged[key] = (total, total_failures + failures)
+        return merged
+
+
+class Metrics:
+    """Request and database metrics, rendered in the Prometheus text format.
+
+    Everything on the request path runs on the event loop thread, so plain
+    counters are enough; per-route series are allocated up front by
+    `register_routes` and requests only look them up.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.started_at = time.time()
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self.commands = CommandMetrics()
+
+    def register_routes(self, routes: Iterable) -> None:
+        for route in routes:
+            for method in getattr(route, "methods", None) or ():
+                self.routes.setdefault((method, route.path), RouteMetrics())
+
+    def observe_request(self, method: str, route: Optional[str], status: int, seconds: float) -> None:
+        key = (method, route or UNMATCHED_ROUTE)
+        metrics = self.routes.get(key)
+        if metrics is None:
+            metrics = self.routes[key] = RouteMetrics()
+        metrics.latency.observe(seconds)
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def render(self) -> bytes:
+        lines = [
+            "# HELP http_requests_in_flight Requests currently being handled",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_request_duration_seconds Request latency by route",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        served = [(key, metrics) for key, metrics in sorted(self.routes.items()) if metrics.latency.count]
+        for (method, route), metrics in served:
+            render_histogram(lines, "http_request_duration_seconds", labels(method=method, route=route), metrics.latency)
+
+        lines += [
+            "# HELP http_responses_total Responses by route and status code",
+            "# TYPE http_responses_total counter",
+        ]
+        for (method, route), metrics in served:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f"http_responses_total{{{labels(method=method, route=route, status=str(status))}}} {count}")
+
+        commands = sorted(self.commands.snapshot().items())
+        lines += [
+            "# HELP mongodb_command_duration_seconds MongoDB command latency by collection and command",
+            "# TYPE mongodb_command_duration_seconds histogram",
+        ]
+        for (collection, command), (histogram, _) in commands:
+            render_histogram(lines, "mongodb_command_duration_seconds", labels(collection=collection, command=command), histogram)
+        lines += [
+            "# HELP mongodb_command_failures_total Failed MongoDB commands by collection and command",
+            "# TYPE mongodb_command_failures_total counter",
+        ]
+        for (collection, command), (_, failures) in commands:
+            lines.append(f"mongodb_command_failures_total{{{labels(collection=collection, command=command)}}} {failures}")
+
+        lines += [
+            "# HELP process_start_time_seconds Start time of the process since the epoch",
+            "# TYPE process_start_time_seconds gauge",
+            f"process_start_time_seconds {self.started_at:.3f}",
+        ]
+        return ("\n".join(lines) + "\n").encode()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing each HTTP request.
+
+    The route label is the matched route's path template, which the router
+    leaves in the scope, so player ids never become label values.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics = self.metrics
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight -= 1
+            route = scope.get("route")
+            metrics.observe_request(scope["method"], getattr(route, "path", None), status, time.perf_counter() - started)
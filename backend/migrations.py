@@ -0,0 +1,73 @@
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from pymongo import ASCENDING, UpdateOne
+
+from catalog import equipped_move_ids
+
+EQUIPPED_MOVE_IDS = "equipped_move_ids"
+
+
+async def migrate_equipped_move_ids(
+    progress_collection,
+    state_collection,
+    slots: Iterable[str],
+    batch_size: int = 1000,
+    restart: bool = False,
+    report: Optional[Callable[[Dict[str, Any]], None]] = None,
+    state_id: str = EQUIPPED_MOVE_IDS,
+) -> Dict[str, Any]:
+    """Rewrite embedded equipped moves in `game_progress` as move ids.
+
+    Documents still embedding a move are streamed in `_id` order and
+    rewritten with unordered bulk writes of `batch_size`. After each batch
+    the last `_id` is checkpointed in `state_collection`, so an interrupted
+    run resumes where it stopped (`restart` ignores the checkpoint). Each
+    update is conditional on the embedded moves it read, so a save that
+    lands meanwhile is left alone; it already stores ids. Each progress
+    partition is checkpointed under its own `state_id`.
+    """
+    state = None if restart else await state_collection.find_one({"_id": state_id})
+    query: Dict[str, Any] = {"$or": [{f"equippedMoves.{slot}": {"$type": "object"}} for slot in slots]}
+    if state and state.get("lastId") is not None:
+        query["_id"] = {"$gt": state["lastId"]}
+
+    stats = {"scanned": 0, "migrated": 0, "elapsed": 0.0, "resumedFrom": state.get("lastId") if state else None}
+    started = time.monotonic()
+    operations: List[UpdateOne] = []
+
+    async def flush(last_id) -> None:
+        result = await progress_collection.bulk_write(operations, ordered=False)
+        operations.clear()
+        stats["migrated"] += result.modified_count
+        stats["elapsed"] = time.monotonic() - started
+        await state_collection.update_one(
+            {"_id": state_id},
+            {"$set": {"lastId": last_id, "updatedAt": datetime.utcnow()}, "$inc": {"migrated": result.modified_count}},
+            upsert=True,
+        )
+        if report is not None:
+            report(stats)
+
+    cursor = progress_collection.find(query, {"equippedMoves": 1}).sort("_id", ASCENDING).batch_size(batch_size)
+    last_id = None
+    async for doc in cursor:
+        stats["scanned"] += 1
+        last_id = doc["_id"]
+        operations.append(UpdateOne(
+            {"_id": doc["_id"], "equippedMoves": doc["equippedMoves"]},
+            {"$set": {"equippedMoves": equipped_move_ids(doc["equippedMoves"])}},
+        ))
+        if len(operations) >= batch_size:
+            await flush(last_id)
+    if operations:
+        await flush(last_id)
+
+    stats["elapsed"] = time.monotonic() - started
+    await state_collection.update_one(
+        {"_id": state_id},
+        {"$set": {"completedAt": datetime.utcnow()}},
+        upsert=True,
+    )
+    return stats
@@ -0,0 +1,140 @@
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Annotated, Any, List, Literal, Optional, Dict
+import uuid
+from datetime import datetime
+from bson import ObjectId
+
+
+class StatusCheck(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    client_name: str
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+
+class StatusCheckCreate(BaseModel):
+    client_name: str
+
+class AttackMove(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    id: str
+    name: str
+    type: str  # 'hold', 'double', 'triple'
+    damage: int
+    cooldown: int
+    cost: int
+    description: str
+    color: str
+    isOwned: bool = False
+    isEquipped: bool = False
+
+class PlayerStats(BaseModel):
+    level: int = 1
+    xp: int = 0
+    xpToNext: int = 100
+    health: int = 100
+    maxHealth: int = 100
+    coins: int = 50
+
+class WorldProgress(BaseModel):
+    worldId: int
+    unlocked: bool = False
+    completed: bool = False
+    bestTime: int = 0
+    highScore: int = 0
+
+class GameProgress(BaseModel):
+    id: Optional[str] = Field(default_factory=lambda: str(ObjectId()))
+    playerId: str
+    playerStats: PlayerStats
+    equippedMoves: Dict[str, Optional[AttackMove]] = {}
+    ownedMoves: List[str] = []
+    worldProgress: List[WorldProgress] = []
+    deathCount: int = 0
+    settings: Dict[str, bool] = {"soundEnabled": True, "musicEnabled": True}
+    version: int = 0  # Bumped on every save, used for optimistic concurrency
+    updatedAt: datetime = Field(default_factory=datetime.utcnow)
+
+class GameProgressCreate(BaseModel):
+    playerId: str
+    playerStats: Optional[PlayerStats] = None
+
+class RunLog(BaseModel):
+    """Compact summary of one played run, submitted for server-side verification"""
+    worldId: int = Field(..., ge=1)
+    elapsedMs: int = Field(..., ge=0)
+    attacks: Dict[str, Annotated[int, Field(ge=0)]] = {}  # move id -> times fired
+    kills: int = Field(0, ge=0)
+    bossDefeated: bool = False
+    score: int = Field(0, ge=0)
+
+class GameProgressUpdate(BaseModel):
+    playerStats: Optional[PlayerStats] = None
+    equippedMoves: Optional[Dict[str, Optional[AttackMove]]] = None
+    ownedMoves: Optional[List[str]] = None
+    worldProgress: Optional[List[WorldProgress]] = None
+    deathCount: Optional[int] = None
+    settings: Optional[Dict[str, bool]] = None
+    # Version the client last saw; when set, the save is rejected if the
+    # stored document has moved on since (e.g. a save from another device)
+    version: Optional[int] = None
+    # Runs played since the last save; verified, never stored on the document
+    runs: Optional[List[RunLog]] = None
+
+class StatIncrements(BaseModel):
+    coins: int = Field(0, ge=0)
+    xp: int = Field(0, ge=0)
+    deathCount: int = Field(0, ge=0)
+
+class WorldPatch(BaseModel):
+    worldId: int = Field(..., ge=1)
+    # Flags can only be raised, scores only improved
+    unlocked: Optional[bool] = None
+    completed: Optional[bool] = None
+    bestTime: Optional[int] = Field(None, gt=0)
+    highScore: Optional[int] = Field(None, ge=0)
+
+class EquipSlot(BaseModel):
+    slot: str  # 'hold', 'double', 'triple'
+    moveId: Optional[str] = None  # None clears the slot
+
+class PurchaseRequest(BaseModel):
+    moveId: str
+
+class PurchaseResult(BaseModel):
+    playerId: str
+    moveId: str
+    coins: int
+    version: int
+
+class EquipResult(BaseModel):
+    playerId: str
+    slot: str
+    moveId: Optional[str]
+    version: int
+
+class GameProgressPatch(BaseModel):
+    increment: Optional[StatIncrements] = None
+    addOwnedMove: Optional[str] = None
+    worlds: List[WorldPatch] = []
+    equip: Optional[EquipSlot] = None
+    version: Optional[int] = None
+    runs: Optional[List[RunLog]] = None
+
+class ProgressBatchItem(BaseModel):
+    op: Literal["create", "update"]
+    playerId: str
+    # Validated per item as GameProgressCreate / GameProgressUpdate, so one
+    # bad item does not reject the whole batch
+    data: Dict[str, Any] = {}
+
+class ProgressBatch(BaseModel):
+    items: List[ProgressBatchItem] = Field(..., max_length=1000)
+
+class ProgressBatchItemResult(BaseModel):
+    index: int
+    playerId: str
+    status: str  # 'created', 'updated', 'exists', 'invalid', 'error'
+    error: Optional[str] = None
+
+class ProgressBatchResult(BaseModel):
+    results: List[ProgressBatchItemResult]
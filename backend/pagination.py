@@ -0,0 +1,31 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+
+def encode_cursor(timestamp: datetime, doc_id: str) -> str:
+    """Opaque cursor pointing just after the document with this sort key"""
+    raw = json.dumps([timestamp.isoformat(), doc_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, doc_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), str(doc_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def keyset_filter(cursor: Optional[str], time_field: str = "timestamp", id_field: str = "id") -> Dict[str, Any]:
+    """Query matching documents after `cursor` in (time_field, id_field) order"""
+    if not cursor:
+        return {}
+    timestamp, doc_id = decode_cursor(cursor)
+    return {"$or": [
+        {time_field: {"$gt": timestamp}},
+        {time_field: timestamp, id_field: {"$gt": doc_id}},
+    ]}
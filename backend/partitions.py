@@ -0,0 +1,283 @@
+import asyncio
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from pymongo import ASCENDING, DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITION = "default"
+PROGRESS_COLLECTION = "game_progress"
+BULK_COUNTS = ("nInserted", "nUpserted", "nMatched", "nModified", "nRemoved")
+
+
+class PartitionSpec(NamedTuple):
+    name: str
+    url: Optional[str]  # None: the server's MONGO_URL
+    db_name: str
+
+
+def parse_partitions(spec: str) -> List[PartitionSpec]:
+    """PROGRESS_PARTITIONS: `name=target` entries separated by `;`, where the
+    target is a database on MONGO_URL or a mongodb:// URL naming its database:
+
+        p0=phoenix_p0;p1=phoenix_p1;p2=mongodb://db2.internal:27017/phoenix_p2
+    """
+    partitions = []
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        name, sep, target = (part.strip() for part in entry.partition("="))
+        if not sep or not name or not target:
+            raise ValueError(f"Partition {entry!r} is not name=database or name=mongodb://host/database")
+        if len(name.encode()) > 64:
+            raise ValueError(f"Partition name {name!r} is longer than 64 bytes")
+        if "://" in target:
+            db_name = urlsplit(target).path.strip("/")
+            if not db_name:
+                raise ValueError(f"Partition {name} URL names no database")
+            partitions.append(PartitionSpec(name, target, db_name))
+        else:
+            partitions.append(PartitionSpec(name, None, target))
+    names = [partition.name for partition in partitions]
+    if len(set(names)) != len(names):
+        raise ValueError("Partition names must be unique")
+    return partitions
+
+
+class Partition:
+    """One `game_progress` collection players are routed to"""
+
+    __slots__ = ("name", "collection", "_key")
+
+    def __init__(self, name: str, collection):
+        self.name = name
+        self.collection = collection
+        self._key = name.encode()
+
+    def weight(self, player_id: str) -> bytes:
+        # Keyed by the partition name, so each partition ranks players independently
+        return hashlib.blake2b(player_id.encode(), digest_size=8, key=self._key).digest()
+
+    def __repr__(self) -> str:
+        return f"Partition({self.name!r})"
+
+
+class PartitionRouter:
+    """Routes each player's progress to one of several partitions.
+
+    Players are placed by rendezvous (highest random weight) hashing: every
+    partition weighs the playerId and the heaviest wins. Weights depend only
+    on partition names, so adding a partition moves just the players it now
+    wins (about 1/n of them, all onto it) and pointing a partition at a new
+    URL moves nobody. After adding partitions, `rebalance` moves the players
+    stored elsewhere; while it runs, servers with `migrating` set move a
+    player not found on its partition when it is first accessed.
+
+    Cross-partition work (batches, exports, rebuilds) is split by partition
+    and sent concurrently.
+    """
+
+    def __init__(self, partitions: Sequence[Partition], migrating: bool = False, clients: Iterable[Any] = ()):
+        if not partitions:
+            raise ValueError("At least one partition is required")
+        self.partitions = list(partitions)
+        self.migrating = migrating
+        self._clients = list(clients)  # opened for partitions on other servers
+
+    @classmethod
+    def from_settings(cls, settings, client, client_factory: Callable[[str], Any]) -> "PartitionRouter":
+        """Partitions from PROGRESS_PARTITIONS; unset, the single `game_progress`
+        collection of DB_NAME. Partitions sharing a URL share one client."""
+        if not settings.progress_partitions:
+            return cls([Partition(DEFAULT_PARTITION, client[settings.db_name][PROGRESS_COLLECTION])])
+        clients: Dict[str, Any] = {}
+        partitions = []
+        for spec in parse_partitions(settings.progress_partitions):
+            partition_client = client
+            if spec.url is not None and spec.url != settings.mongo_url:
+                if spec.url not in clients:
+                    clients[spec.url] = client_factory(spec.url)
+                partition_client = clients[spec.url]
+            partitions.append(Partition(spec.name, partition_client[spec.db_name][PROGRESS_COLLECTION]))
+        return cls(partitions, migrating=settings.progress_partitions_migrating, clients=clients.values())
+
+    @property
+    def collections(self) -> List[Any]:
+        return [partition.collection for partition in self.partitions]
+
+    def partition_for(self, player_id: str) -> Partition:
+        if len(self.partitions) == 1:
+            return self.partitions[0]
+        return max(self.partitions, key=lambda partition: partition.weight(player_id))
+
+    def collection_for(self, player_id: str):
+        return self.partition_for(player_id).collection
+
+    def group(self, player_ids: Iterable[str]) -> Dict[Partition, List[str]]:
+        groups: Dict[Partition, List[str]] = {}
+        for player_id in player_ids:
+            groups.setdefault(self.partition_for(player_id), []).append(player_id)
+        return groups
+
+    async def locate(self, player_id: str):
+        """The collection holding `player_id`; while migrating, a player
+        stored on another partition is moved there first"""
+        owner = self.partition_for(player_id)
+        if self.migrating:
+            await self._relocate(owner, [player_id])
+        return owner.collection
+
+    async def relocate(self, player_ids: Iterable[str]) -> None:
+        """`locate` for many players at once; does nothing unless migrating"""
+        if self.migrating:
+            await asyncio.gather(*(self._relocate(owner, ids) for owner, ids in self.group(player_ids).items()))
+
+    async def _relocate(self, owner: Partition, player_ids: List[str]) -> None:
+        cursor = owner.collection.find({"playerId": {"$in": player_ids}}, {"_id": 0, "playerId": 1})
+        present = {doc["playerId"] async for doc in cursor}
+        missing = [player_id for player_id in player_ids if player_id not in present]
+        if missing:
+            await asyncio.gather(*(
+                self.move(source, owner, missing) for source in self.partitions if source is not owner
+            ))
+
+    async def find_many(self, player_ids: Iterable[str], projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        results = await asyncio.gather(*(
+            partition.collection.find({"playerId": {"$in": ids}}, projection).to_list(None)
+            for partition, ids in self.group(player_ids).items()
+        ))
+        return [doc for docs in results for doc in docs]
+
+    async def bulk_write(self, operations: Sequence[Tuple[str, Any]]) -> Dict[str, Any]:
+        """Unordered bulk write of (playerId, operation) pairs, split by
+        partition and sent concurrently.
+
+        Returns one result in the shape of `bulk_api_result` whose `upserted`
+        and `writeErrors` indexes refer to `operations`. A partition that
+        fails as a whole reports each of its operations as a write error, so
+        the other partitions' results are not lost with it.
+        """
+        positions: Dict[Partition, List[int]] = {}
+        for index, (player_id, _) in enumerate(operations):
+            positions.setdefault(self.partition_for(player_id), []).append(index)
+
+        async def write(partition: Partition, indexes: List[int]) -> Dict[str, Any]:
+            try:
+                result = await partition.collection.bulk_write([operations[i][1] for i in indexes], ordered=False)
+                return result.bulk_api_result
+            except BulkWriteError as e:
+                return e.details
+            except Exception:
+                logger.exception("Bulk write to partition %s failed", partition.name)
+                return {"writeErrors": [
+                    {"index": i, "errmsg": f"Partition {partition.name} unavailable"} for i in range(len(indexes))
+                ]}
+
+        results = await asyncio.gather(*(write(partition, indexes) for partition, indexes in positions.items()))
+        merged: Dict[str, Any] = {count: 0 for count in BULK_COUNTS}
+        merged.update(upserted=[], writeErrors=[])
+        for indexes, result in zip(positions.values(), results):
+            for count in BULK_COUNTS:
+                merged[count] += result.get(count, 0)
+            for field in ("upserted", "writeErrors"):
+                merged[field] += [{**entry, "index": indexes[entry["index"]]} for entry in result.get(field, [])]
+        return merged
+
+    async def move(self, source: Partition, target: Partition, player_ids: Sequence[str]) -> Dict[str, int]:
+        """Copy players' documents from `source` to `target`, then delete them from `source`.
+
+        The copy only overwrites an older version on `target` and the delete
+        only removes the version copied, so a save landing on either side
+        meanwhile is kept; whatever is left behind is moved by the next
+        rebalance. Re-running a move that was interrupted is safe.
+        """
+        stats = {"moved": 0, "kept": 0}
+        docs = await source.collection.find({"playerId": {"$in": list(player_ids)}}).to_list(None)
+        if not docs:
+            return stats
+        copies = [
+            UpdateOne(
+                {"playerId": doc["playerId"], "version": {"$lt": doc.get("version", 0)}},
+                {"$set": {name: value for name, value in doc.items() if name != "_id"}, "$setOnInsert": {"_id": doc["_id"]}},
+                upsert=True,
+            )
+            for doc in docs
+        ]
+        failed = set()
+        try:
+            await target.collection.bulk_write(copies, ordered=False)
+        except BulkWriteError as e:
+            # A duplicate playerId means target already has this version or a newer one
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") != 11000:
+                    failed.add(error["index"])
+                    logger.error("Could not copy %s to partition %s: %s", docs[error["index"]]["playerId"], target.name, error.get("errmsg"))
+        copied = [doc for index, doc in enumerate(docs) if index not in failed]
+        if copied:
+            result = await source.collection.bulk_write([
+                DeleteOne({"playerId": doc["playerId"], "version": doc.get("version")}) for doc in copied
+            ], ordered=False)
+            stats["moved"] = result.deleted_count
+        stats["kept"] = len(docs) - stats["moved"]
+        return stats
+
+    async def rebalance(
+        self,
+        batch_size: int = 1000,
+        dry_run: bool = False,
+        report: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> Dict[str, Any]:
+        """Move every player stored outside the partition it hashes to.
+
+        Partitions are scanned concurrently, reading only playerIds, and
+        misplaced players are moved in batches of `batch_size` per source and
+        target. With `dry_run` they are only counted.
+        """
+        stats: Dict[str, Any] = {"scanned": 0, "misplaced": 0, "moved": 0, "kept": 0, "routes": {}}
+
+        async def flush(source: Partition, owner: Partition, player_ids: List[str]) -> None:
+            route = f"{source.name}->{owner.name}"
+            stats["routes"][route] = stats["routes"].get(route, 0) + len(player_ids)
+            if not dry_run:
+                moved = await self.move(source, owner, player_ids)
+                stats["moved"] += moved["moved"]
+                stats["kept"] += moved["kept"]
+            player_ids.clear()
+            if report is not None:
+                report(stats)
+
+        async def scan(source: Partition) -> None:
+            pending: Dict[Partition, List[str]] = {}
+            cursor = source.collection.find({}, {"_id": 0, "playerId": 1}).batch_size(batch_size)
+            async for doc in cursor:
+                stats["scanned"] += 1
+                owner = self.partition_for(doc["playerId"])
+                if owner is source:
+                    continue
+                stats["misplaced"] += 1
+                player_ids = pending.setdefault(owner, [])
+                player_ids.append(doc["playerId"])
+                if len(player_ids) >= batch_size:
+                    await flush(source, owner, player_ids)
+            for owner, player_ids in pending.items():
+                if player_ids:
+                    await flush(source, owner, player_ids)
+
+        await asyncio.gather(*(scan(partition) for partition in self.partitions))
+        return stats
+
+    async def ensure_indexes(self) -> None:
+        # One progress document per player and partition; creates race on this index
+        await asyncio.gather(*(
+            collection.create_index([("playerId", ASCENDING)], unique=True) for collection in self.collections
+        ))
+
+    async def ping(self) -> None:
+        """Ping the servers of partitions outside the main client"""
+        await asyncio.gather(*(client.admin.command("ping") for client in self._clients))
+
+    def close(self) -> None:
+        for client in self._clients:
+            client.close()
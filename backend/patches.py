@@ -0,0 +1,138 @@
+from typing import Any, Dict, List, Tuple
+
+from catalog import MoveCatalog
+from models import AttackMove, EquipSlot, GameProgressPatch
+
+
+def build_progress_patch(patch: GameProgressPatch, catalog: MoveCatalog) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Translate a progress patch into a Mongo update and its array filters.
+
+    Only the touched fields are written: counters use `$inc`, owned moves
+    `$addToSet`, per-world scores and flags `$max` (or a guarded `$set` for
+    `bestTime`, where lower is better and 0 means unset) on the matching
+    `worldProgress` element. Raises ValueError for patches referring to
+    moves or slots that do not exist.
+    """
+    inc: Dict[str, int] = {}
+    set_fields: Dict[str, Any] = {}
+    max_fields: Dict[str, Any] = {}
+    add_to_set: Dict[str, Any] = {}
+    array_filters: List[Dict[str, Any]] = []
+
+    if patch.increment:
+        for field, path in (("coins", "playerStats.coins"), ("xp", "playerStats.xp"), ("deathCount", "deathCount")):
+            amount = getattr(patch.increment, field)
+            if amount:
+                inc[path] = amount
+
+    if patch.addOwnedMove is not None:
+        if catalog.get(patch.addOwnedMove) is None:
+            raise ValueError(f"Unknown move: {patch.addOwnedMove}")
+        add_to_set["ownedMoves"] = patch.addOwnedMove
+
+    seen_worlds = set()
+    for world in patch.worlds:
+        if world.worldId in seen_worlds:
+            raise ValueError(f"World {world.worldId} patched more than once")
+        seen_worlds.add(world.worldId)
+
+        world_key = f"w{world.worldId}"
+        raised = {
+            field: value
+            for field, value in (("unlocked", world.unlocked), ("completed", world.completed), ("highScore", world.highScore))
+            if value
+        }
+        if raised:
+            for field, value in raised.items():
+                max_fields[f"worldProgress.$[{world_key}].{field}"] = value
+            array_filters.append({f"{world_key}.worldId": world.worldId})
+
+        if world.bestTime is not None:
+            time_key = f"t{world.worldId}"
+            set_fields[f"worldProgress.$[{time_key}].bestTime"] = world.bestTime
+            array_filters.append({
+                f"{time_key}.worldId": world.worldId,
+                "$or": [
+                    {f"{time_key}.bestTime": 0},
+                    {f"{time_key}.bestTime": {"$gt": world.bestTime}},
+                ],
+            })
+
+    if patch.equip:
+        set_fields.update(equip_fields(patch.equip, catalog))
+
+    update: Dict[str, Any] = {"$inc": {**inc, "version": 1}}
+    if set_fields:
+        update["$set"] = set_fields
+    if max_fields:
+        update["$max"] = max_fields
+    if add_to_set:
+        update["$addToSet"] = add_to_set
+    return update, array_filters
+
+
+def equip_fields(equip: EquipSlot, catalog: MoveCatalog) -> Dict[str, Any]:
+    """`$set` fields putting a move in (or clearing) one equipment slot"""
+    if equip.slot not in catalog.by_type:
+        raise ValueError(f"Unknown equip slot: {equip.slot}")
+    move = None
+    if equip.moveId is not None:
+        move = catalog.get(equip.moveId)
+        if move is None:
+            raise ValueError(f"Unknown move: {equip.moveId}")
+        if move.type != equip.slot:
+            raise ValueError(f"Move {move.id} cannot be equipped in the {equip.slot} slot")
+    return {f"equippedMoves.{equip.slot}": move.id if move else None}
+
+
+def owned_move_filter(equip: EquipSlot, catalog: MoveCatalog) -> Dict[str, Any]:
+    """Filter requiring the player to own the move `equip` puts in a slot.
+
+    Free moves are the starter moves every player has, including documents
+    saved before `ownedMoves` listed them, so only paid moves are checked.
+    """
+    move = catalog.get(equip.moveId) if equip.moveId is not None else None
+    if move is not None and move.cost > 0:
+        return {"ownedMoves": move.id}
+    return {}
+
+
+def progress_patch_filter(patch: GameProgressPatch, catalog: MoveCatalog) -> Dict[str, Any]:
+    """Filter conditions a progress patch writes under, beside the player and version.
+
+    A move can only be equipped once owned, as in `build_equip`, unless the
+    same patch adds it.
+    """
+    if patch.equip is None or patch.equip.moveId == patch.addOwnedMove:
+        return {}
+    return owned_move_filter(patch.equip, catalog)
+
+
+def build_purchase(player_id: str, move: AttackMove) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Filter and update buying `move` in one conditional write.
+
+    The filter only matches while the player can afford the move and does
+    not own it yet, so concurrent purchases cannot both succeed and coins
+    never go negative.
+    """
+    query = {
+        "playerId": player_id,
+        "ownedMoves": {"$ne": move.id},
+        "playerStats.coins": {"$gte": move.cost},
+    }
+    update = {
+        "$inc": {"playerStats.coins": -move.cost, "version": 1},
+        "$addToSet": {"ownedMoves": move.id},
+    }
+    return query, update
+
+
+def build_equip(player_id: str, equip: EquipSlot, catalog: MoveCatalog) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Filter and update equipping an owned move (or clearing the slot).
+
+    See `owned_move_filter` for which moves are checked for ownership.
+    Raises ValueError for unknown moves or slots.
+    """
+    update = {"$set": equip_fields(equip, catalog), "$inc": {"version": 1}}
+    query = {"playerId": player_id, **owned_move_filter(equip, catalog)}
+    return query, update
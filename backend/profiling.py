@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+from typing import List, Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+AWAITING = "[awaiting]"  # leaf of samples taken while the request was suspended
+
+
+class RequestTimings:
+    """Per-request accumulator for time spent in MongoDB commands"""
+
+    __slots__ = ("mongo_seconds", "commands")
+
+    def __init__(self):
+        self.mongo_seconds = 0.0
+        self.commands = 0
+
+
+# Motor runs PyMongo through run_in_executor with a copy of the caller's
+# context, so command events raised on executor threads still see the
+# timings of the request that issued them
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("current_timings", default=None)
+
+
+class MongoTimeListener(monitoring.CommandListener):
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._add(event.duration_micros)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._add(event.duration_micros)
+
+    @staticmethod
+    def _add(duration_micros: int) -> None:
+        timings = current_timings.get()
+        if timings is not None:
+            timings.mongo_seconds += duration_micros / 1e6
+            timings.commands += 1
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _is_loop_step(frame) -> bool:
+    # asyncio.events.Handle._run is where the event loop calls into a task
+    return frame.f_code.co_name == "_run" and frame.f_code.co_filename.endswith(os.path.join("asyncio", "events.py"))
+
+
+class TaskSampler:
+    """Samples one asyncio task's stack from a background thread.
+
+    While the task is running on the loop, the loop thread's Python stack
+    is recorded; while it is suspended (awaiting Motor, a lock, the network)
+    the chain of coroutines it is parked in is recorded instead, with an
+    `[awaiting]` leaf, so the profile covers wall time rather than only CPU.
+    Stacks are collected in the folded format flamegraph tools read.
+    """
+
+    def __init__(self, task: asyncio.Task, interval: float):
+        self.task = task
+        self.loop = task.get_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.cpu_samples = 0
+        self.waiting_samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self._sample()
+            except Exception:
+                # The loop keeps running while we look at it; skip torn samples
+                continue
+
+    def _sample(self) -> None:
+        running = asyncio.current_task(self.loop) is self.task
+        stack: List[str] = []
+        if running:
+            frame = sys._current_frames().get(self.loop_thread_id)
+            while frame is not None and not _is_loop_step(frame):
+                stack.append(_label(frame))
+                frame = frame.f_back
+            stack.reverse()
+        else:
+            awaitable = self.task.get_coro()
+            while awaitable is not None:
+                frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+                if frame is None:
+                    break
+                stack.append(_label(frame))
+                awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+            stack.append(AWAITING)
+
+        # Once stop() is called the loop thread is only waiting for us
+        if not stack or self._stopped.is_set():
+            return
+        if running:
+            self.cpu_samples += 1
+        else:
+            self.waiting_samples += 1
+        self.stacks[";".join(stack)] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 5) -> str:
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.rsplit(";", 2)
+            leaves[";".join(frames[-2:]) if frames[-1] == AWAITING else frames[-1]] += count
+        total = sum(leaves.values()) or 1
+        return ", ".join(f"{leaf} {count / total:.0%}" for leaf, count in leaves.most_common(top))
+
+
+class ProfilingMiddleware:
+    """Opt-in request profiling and slow-request logging (pure ASGI).
+
+    Requests are profiled when they carry `X-Profile: <token>` matching the
+    configured token, or at random with probability `sample_rate`; at most
+    `max_concurrent` at a time. Each profile is written to `profile_dir` as
+    `<id>.folded` and the id is returned in an `X-Profile-Id` header.
+    Requests slower than `slow_seconds` are logged with their route,
+    payload sizes and MongoDB time. Only install this when one of the two
+    features is enabled; with neither, the app runs without it.
+    """
+
+    def __init__(
+        self,
+        app,
+        profile_dir: Path,
+        token: Optional[str] = None,
+        sample_rate: float = 0.0,
+        interval: float = 0.002,
+        max_concurrent: int = 2,
+        slow_seconds: float = 0.0,
+    ):
+        self.app = app
+        self.profile_dir = Path(profile_dir)
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_concurrent = max_concurrent
+        self.slow_seconds = slow_seconds
+        self.active = 0
+
+    def _wants_profile(self, scope) -> bool:
+        if self.active >= self.max_concurrent:
+            return False
+        if self.token is not None:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER.encode() and value == self.token:
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        reset = current_timings.set(timings)
+        sizes = {"request": 0, "response": 0}
+        status = 500
+        sampler = None
+        if self._wants_profile(scope):
+            sampler = TaskSampler(asyncio.current_task(), self.interval)
+            profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        async def receive_counted():
+            message = await receive()
+            sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if sampler is not None:
+                    message = {**message, "headers": [*message.get("headers", []), (PROFILE_ID_HEADER, profile_id.encode())]}
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        started = time.perf_counter()
+        if sampler is not None:
+            self.active += 1
+            sampler.start()
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_timings.reset(reset)
+            route = getattr(scope.get("route"), "path", scope["path"])
+            if sampler is not None:
+                sampler.stop()
+                self.active -= 1
+                self._save_profile(profile_id, scope["method"], route, elapsed, sampler)
+            if self.slow_seconds and elapsed >= self.slow_seconds:
+                logger.warning(
+                    "Slow request: %s %s %.3fs status=%d request=%dB response=%dB mongo=%.3fs (%d commands)",
+                    scope["method"], route, elapsed, status, sizes["request"], sizes["response"],
+                    timings.mongo_seconds, timings.commands,
+                )
+
+    def _save_profile(self, profile_id: str, method: str, route: str, elapsed: float, sampler: TaskSampler) -> None:
+        try:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            (self.profile_dir / f"{profile_id}.folded").write_text(sampler.folded())
+        except OSError:
+            logger.exception("Could not write profile %s", profile_id)
+            return
+        logger.info(
+            "Profiled %s %s in %.3fs (%d running / %d awaiting samples) as %s: %s",
+            method, route, elapsed, sampler.cpu_samples, sampler.waiting_samples, profile_id, sampler.summary(),
+        )
@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+MINUTE, HOUR = "minute", "hour"
+MINUTE_FORMAT = "%Y-%m-%dT%H:%M"
+HOUR_FORMAT = "%Y-%m-%dT%H"
+
+STATE_ID = "status_checks"
+LEASE = timedelta(minutes=5)
+WRITE_BATCH_SIZE = 1000
+
+
+def floor_minute(moment: datetime) -> datetime:
+    return moment.replace(second=0, microsecond=0)
+
+
+async def ensure_ttl_index(collection, name: str, field: str, seconds: int, partial_filter: Optional[Dict[str, Any]] = None) -> None:
+    """Create a TTL index, retune it in place (collMod) when `seconds`
+    changed, or drop it when `seconds` is 0"""
+    current = (await collection.index_information()).get(name)
+    if not seconds:
+        if current is not None:
+            await collection.drop_index(name)
+        return
+    if current is None:
+        options = {"partialFilterExpression": partial_filter} if partial_filter else {}
+        await collection.create_index([(field, ASCENDING)], name=name, expireAfterSeconds=seconds, **options)
+    elif current.get("expireAfterSeconds") != seconds:
+        await collection.database.command({"collMod": collection.name, "index": {"name": name, "expireAfterSeconds": seconds}})
+
+
+class StatusRetention:
+    """Retention for `status_checks`: raw checks expire, buckets stay.
+
+    A background job compacts raw checks into per-client minute buckets
+    (count, first and last seen) and rolls those up into hour buckets.
+    Compaction runs over whole minutes older than `lag`, one `window` at a
+    time, and records how far it got in a watermark. Bucket values are
+    recomputed and `$set` rather than incremented, so re-running a window
+    after a crash gives the same result. A lease in the state document
+    keeps other workers from doing the same work at once.
+
+    Raw checks expire `retention_seconds` after their timestamp; the TTL
+    index is only created once compaction has caught up, so checks are
+    never deleted before they are counted. Minute buckets expire after
+    `minute_retention_seconds` (keep it well over an hour, since hour
+    buckets are rolled up from them); hour buckets are kept.
+    """
+
+    def __init__(
+        self,
+        checks,
+        buckets,
+        state,
+        retention_seconds: int = 7 * 86400,
+        minute_retention_seconds: int = 30 * 86400,
+        interval: float = 60.0,
+        lag: float = 120.0,
+        window: timedelta = timedelta(hours=1),
+    ):
+        self.checks = checks
+        self.buckets = buckets
+        self.state = state
+        self.retention_seconds = retention_seconds
+        self.minute_retention_seconds = minute_retention_seconds
+        self.interval = interval
+        self.lag = timedelta(seconds=lag)
+        self.window = window
+        self.owner = uuid.uuid4().hex
+        self._raw_ttl_ready = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self) -> None:
+        await self.buckets.create_index([("granularity", ASCENDING), ("client_name", ASCENDING), ("start", ASCENDING)], unique=True)
+        await self.buckets.create_index([("granularity", ASCENDING), ("start", ASCENDING)])
+        await ensure_ttl_index(self.buckets, "minute_buckets_ttl", "start", self.minute_retention_seconds, {"granularity": MINUTE})
+        if self.interval <= 0:
+            # Nothing is compacted, so there is nothing to wait for
+            await self.ensure_raw_ttl()
+
+    async def ensure_raw_ttl(self) -> None:
+        await ensure_ttl_index(self.checks, "status_checks_ttl", "timestamp", self.retention_seconds)
+        self._raw_ttl_ready = True
+
+    async def compact(self, now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+        """Compact every whole minute older than `lag`; None when another
+        worker holds the lease"""
+        now = now or datetime.utcnow()
+        state = await self._acquire(now)
+        if state is None:
+            return None
+
+        stats: Dict[str, Any] = {"checks": 0, "minuteBuckets": 0, "hourBuckets": 0, "windows": 0}
+        end = floor_minute(now - self.lag)
+        start = state.get("watermark")
+        if start is None:
+            oldest = await self.checks.find_one({}, {"timestamp": 1}, sort=[("timestamp", ASCENDING)])
+            start = floor_minute(oldest["timestamp"]) if oldest else end
+        try:
+            while start < end:
+                window_end = min(start + self.window, end)
+                await self._compact_window(start, window_end, stats)
+                start = window_end
+                stats["windows"] += 1
+                await self.state.update_one(
+                    {"_id": STATE_ID, "owner": self.owner},
+                    {"$set": {"watermark": start, "leaseUntil": datetime.utcnow() + LEASE}},
+                )
+        finally:
+            await self.state.update_one({"_id": STATE_ID, "owner": self.owner}, {"$set": {"leaseUntil": datetime.utcnow()}})
+
+        if not self._raw_ttl_ready:
+            await self.ensure_raw_ttl()
+        stats["watermark"] = start
+        return stats
+
+    async def _acquire(self, now: datetime) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.state.find_one_and_update(
+                {"_id": STATE_ID, "$or": [
+                    {"leaseUntil": {"$lt": now}}, {"leaseUntil": {"$exists": False}}, {"owner": self.owner},
+                ]},
+                {"$set": {"leaseUntil": now + LEASE, "owner": self.owner}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            return None
+
+    async def _compact_window(self, start: datetime, end: datetime, stats: Dict[str, Any]) -> None:
+        pipeline = [
+            {"$match": {"timestamp": {"$gte": start, "$lt": end}}},
+            {"$group": {
+                "_id": {"client": "$client_name", "minute": {"$dateToString": {"format": MINUTE_FORMAT, "date": "$timestamp"}}},
+                "count": {"$sum": 1},
+                "firstSeen": {"$min": "$timestamp"},
+                "lastSeen": {"$max": "$timestamp"},
+            }},
+        ]
+        hours = set()
+        operations: List[UpdateOne] = []
+        async for group in self.checks.aggregate(pipeline):
+            minute = datetime.strptime(group["_id"]["minute"], MINUTE_FORMAT)
+            hours.add(minute.replace(minute=0))
+            stats["checks"] += group["count"]
+            operations.append(self._bucket_update(MINUTE, group["_id"]["client"], minute, group))
+            if len(operations) >= WRITE_BATCH_SIZE:
+                stats["minuteBuckets"] += await self._write(operations)
+        stats["minuteBuckets"] += await self._write(operations)
+        if hours:
+            stats["hourBuckets"] += await self._rollup_hours(min(hours), max(hours) + timedelta(hours=1))
+
+    async def _rollup_hours(self, start: datetime, end: datetime) -> int:
+        """Recompute the hour buckets in [start, end) from their minute buckets"""
+        pipeline = [
+            {"$match": {"granularity": MINUTE, "start": {"$gte": start, "$lt": end}}},
+            {"$group": {
+                "_id": {"client": "$client_name", "hour": {"$dateToString": {"format": HOUR_FORMAT, "date": "$start"}}},
+                "count": {"$sum": "$count"},
+                "firstSeen": {"$min": "$firstSeen"},
+                "lastSeen": {"$max": "$lastSeen"},
+            }},
+        ]
+        operations = [
+            self._bucket_update(HOUR, group["_id"]["client"], datetime.strptime(group["_id"]["hour"], HOUR_FORMAT), group)
+            async for group in self.buckets.aggregate(pipeline)
+        ]
+        return await self._write(operations)
+
+    @staticmethod
+    def _bucket_update(granularity: str, client_name: str, start: datetime, group: Dict[str, Any]) -> UpdateOne:
+        return UpdateOne(
+            {"granularity": granularity, "client_name": client_name, "start": start},
+            {"$set": {"count": group["count"], "firstSeen": group["firstSeen"], "lastSeen": group["lastSeen"]}},
+            upsert=True,
+        )
+
+    async def _write(self, operations: List[UpdateOne]) -> int:
+        if not operations:
+            return 0
+        await self.buckets.bulk_write(operations, ordered=False)
+        written = len(operations)
+        operations.clear()
+        return written
+
+    async def find_buckets(
+        self,
+        granularity: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        client_name: Optional[str] = None,
+        limit: int = 1000,
+    ) -> List[Dict[str, Any]]:
+        """Buckets starting in [since, until), in (start, client_name) order"""
+        query: Dict[str, Any] = {"granularity": granularity}
+        if client_name is not None:
+            query["client_name"] = client_name
+        if since is not None or until is not None:
+            query["start"] = {}
+            if since is not None:
+                query["start"]["$gte"] = since
+            if until is not None:
+                query["start"]["$lt"] = until
+        cursor = self.buckets.find(query, {"_id": 0, "granularity": 0}).sort([("start", ASCENDING), ("client_name", ASCENDING)])
+        return await cursor.limit(limit).to_list(limit)
+
+    async def client_summary(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Checks per client over the hour buckets starting in [since, until)"""
+        match: Dict[str, Any] = {"granularity": HOUR}
+        if since is not None or until is not None:
+            match["start"] = {}
+            if since is not None:
+                match["start"]["$gte"] = since
+            if until is not None:
+                match["start"]["$lt"] = until
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": "$client_name",
+                "count": {"$sum": "$count"},
+                "firstSeen": {"$min": "$firstSeen"},
+                "lastSeen": {"$max": "$lastSeen"},
+            }},
+            {"$sort": {"_id": ASCENDING}},
+        ]
+        return [
+            {"client_name": group.pop("_id"), **group}
+            async for group in self.buckets.aggregate(pipeline)
+        ]
+
+    def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                stats = await self.compact()
+                if stats and stats["windows"]:
+                    logger.info(
+                        "Compacted %d status checks into %d minute / %d hour buckets up to %s",
+                        stats["checks"], stats["minuteBuckets"], stats["hourBuckets"], stats["watermark"],
+                    )
+            except Exception:
+                logger.exception("Status check compaction failed")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,121 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, NamedTuple, Optional
+
+import msgpack
+import orjson
+from bson import ObjectId
+from fastapi import Response
+
+from catalog import MoveCatalog
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Top-level GameProgress fields that documents written by older versions of
+# the server may lack; everything else is always written through the models
+PROGRESS_DEFAULTS = {
+    "equippedMoves": {},
+    "ownedMoves": [],
+    "worldProgress": [],
+    "deathCount": 0,
+    "settings": {"soundEnabled": True, "musicEnabled": True},
+    "version": 0,
+}
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def encode_json(payload: Any) -> bytes:
+    return orjson.dumps(payload, default=_default)
+
+
+def encode_msgpack(payload: Any) -> bytes:
+    return msgpack.packb(payload, default=_default, use_bin_type=True)
+
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    return accept is not None and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)
+
+
+def progress_payload(doc: Dict[str, Any], catalog: MoveCatalog) -> Dict[str, Any]:
+    """GameProgress response body for a stored document.
+
+    Documents come from our own writes, which already went through the
+    models, so they are reshaped (`_id` to `id`, missing defaults filled,
+    equipped move ids expanded from the catalog) rather than validated
+    again. The document itself is left untouched as it may be shared with
+    the cache.
+    """
+    payload = {"id": str(doc["_id"])}
+    payload.update(PROGRESS_DEFAULTS)
+    payload.update(item for item in doc.items() if item[0] != "_id")
+    if payload["equippedMoves"]:
+        payload["equippedMoves"] = catalog.hydrate_equipped(payload["equippedMoves"])
+    return payload
+
+
+def encoded_response(payload: Any, accept: Optional[str], status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Encode once, as MessagePack when the client asks for it and JSON otherwise"""
+    headers = {"Vary": "Accept", **(headers or {})}
+    if wants_msgpack(accept):
+        return Response(encode_msgpack(payload), status_code=status_code, media_type=MSGPACK_MEDIA_TYPES[0], headers=headers)
+    return Response(encode_json(payload), status_code=status_code, media_type=JSON_MEDIA_TYPE, headers=headers)
+
+
+class ProgressETag(NamedTuple):
+    document_id: str
+    version: int
+
+
+def progress_etag(doc: Dict[str, Any], accept: Optional[str]) -> str:
+    """Strong ETag of a progress document in the representation `accept` selects.
+
+    Every write increments `version`, and `_id` changes if a player is
+    deleted and created again, so the pair identifies the stored state.
+    """
+    suffix = ".msgpack" if wants_msgpack(accept) else ""
+    return f'"{doc["_id"]}.{doc.get("version", 0)}{suffix}"'
+
+
+def parse_progress_etag(etag: str) -> Optional[ProgressETag]:
+    tag = etag.strip()
+    if tag.startswith("W/") or len(tag) < 2 or tag[0] != '"' or tag[-1] != '"':
+        return None  # If-Match only accepts strong tags
+    parts = tag[1:-1].removesuffix(".msgpack").split(".")
+    if len(parts) != 2 or not parts[1].isdigit():
+        return None
+    return ProgressETag(parts[0], int(parts[1]))
+
+
+def progress_headers(doc: Dict[str, Any], accept: Optional[str]) -> Dict[str, str]:
+    """Validators for a progress document; clients must revalidate before reuse"""
+    headers = {"ETag": progress_etag(doc, accept), "Cache-Control": "no-cache", "Vary": "Accept"}
+    updated_at = doc.get("updatedAt")
+    if isinstance(updated_at, datetime):
+        headers["Last-Modified"] = format_datetime(updated_at.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+
+def not_modified_since(doc: Dict[str, Any], if_modified_since: str) -> bool:
+    updated_at = doc.get("updatedAt")
+    if not isinstance(updated_at, datetime):
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have one second resolution
+    return updated_at.replace(tzinfo=timezone.utc, microsecond=0) <= since
+
+
+def progress_response(doc: Dict[str, Any], accept: Optional[str], catalog: MoveCatalog) -> Response:
+    return encoded_response(progress_payload(doc, catalog), accept, headers=progress_headers(doc, accept))
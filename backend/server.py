@@ -1,90 +1,228 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Header, Query, Request, Response, WebSocket
 from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import asyncio
 import logging
+import secrets
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-import uuid
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
 from bson import ObjectId
+from pydantic import ValidationError
+import numpy as np
+
+from models import (
+    StatusCheck,
+    StatusCheckCreate,
+    PlayerStats,
+    WorldProgress,
+    GameProgress,
+    GameProgressCreate,
+    GameProgressUpdate,
+    GameProgressPatch,
+    EquipSlot,
+    PurchaseRequest,
+    PurchaseResult,
+    EquipResult,
+    ProgressBatch,
+    ProgressBatchItem,
+    ProgressBatchItemResult,
+    ProgressBatchResult,
+    RunLog,
+    WorldPatch,
+)
+from catalog import EncodedResponse, MoveCatalog, equipped_move_ids
+from patches import build_equip, build_progress_patch, build_purchase, progress_patch_filter
+from batch import collect_batch_results, plan_progress_batch
+from write_behind import InsertBuffer, WriteBehindBuffer
+from partitions import PartitionRouter
+from pagination import encode_cursor, keyset_filter
+from serialization import (
+    encode_json,
+    not_modified_since,
+    parse_progress_etag,
+    progress_headers,
+    progress_response,
+)
+from leaderboard import Leaderboards
+from analytics import Analytics
+from retention import StatusRetention
+from jobs import JobQueue
+from sessions import CLOSE_TRY_AGAIN_LATER, ProgressSession, SessionManager
+from verifier import UNVERIFIED_RESULT, RunVerdicts, RunVerifier, unbacked_claims, unverified_results, verified_bests
+from cache import InMemoryLRUCache, ProgressCache
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics, MetricsMiddleware
+from profiling import MongoTimeListener, ProfilingMiddleware
+from settings import Settings
+import transfer
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Request and MongoDB command metrics, served at /api/metrics
+metrics = Metrics()
 
-# Create the main app without a prefix
-app = FastAPI()
+# Shop catalog, loaded once; the moves every new player starts with must exist in it
+move_catalog = MoveCatalog.load(ROOT_DIR / 'data' / 'moves.json')
+STARTER_MOVES = ("hold_1", "double_1", "triple_1")
+if move_catalog.missing(STARTER_MOVES):
+    raise RuntimeError(f"Starter moves missing from catalog: {move_catalog.missing(STARTER_MOVES)}")
 
-# Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+# Submitted runs are bounded against the move catalog; impossible ones are
+# rejected (422) or flagged (RUN_VERIFICATION), and flagged saves do not
+# reach the leaderboards
+run_verifier = RunVerifier(move_catalog)
+
+# Set up by connect() when the app starts; nothing here touches the network
+# at import time
+settings: Optional[Settings] = None
+client: Optional[AsyncIOMotorClient] = None
+db = None
+# Player progress, spread over the partitions in PROGRESS_PARTITIONS (by
+# default the single game_progress collection of DB_NAME); everything else
+# stays in DB_NAME
+partitions: Optional[PartitionRouter] = None
+# Read-through cache of progress documents, off unless PROGRESS_CACHE_SIZE is set
+progress_cache: Optional[ProgressCache] = None
+# Per-world rankings, kept current as saves improve players' bests
+leaderboards: Optional[Leaderboards] = None
+# Gameplay rollups behind /api/analytics; ANALYTICS_ENABLED=false disables them
+analytics: Optional[Analytics] = None
+analytics_cache: Optional[InMemoryLRUCache] = None
+# Follow-up work of saves (leaderboards, analytics), run after the response
+job_queue: Optional[JobQueue] = None
+# WebSocket run sessions open on this worker
+session_manager: Optional[SessionManager] = None
+# Optional write-behind mode: progress saves are merged in memory and
+# flushed to Mongo in batches instead of written on every request
+write_buffer: Optional[WriteBehindBuffer] = None
+# Raw status checks expire after STATUS_RETENTION_SECONDS once compacted into
+# per-client minute/hour buckets; STATUS_WRITE_BEHIND acknowledges pings
+# before they are inserted
+status_retention: Optional[StatusRetention] = None
+status_buffer: Optional[InsertBuffer] = None
+ready = False
+
+def connect(app_settings: Settings) -> None:
+    """Create the Motor client and the components built on it.
+
+    Motor connects lazily, so this does no I/O; the lifespan handler
+    warms the pool and ensures indexes afterwards.
+    """
+    global settings, client, db, partitions, progress_cache, leaderboards, analytics, analytics_cache, session_manager, write_buffer
+    global status_retention, status_buffer, job_queue
+    settings = app_settings
+
+    event_listeners = [metrics.commands]
+    if settings.profiling_enabled:
+        event_listeners.append(MongoTimeListener())
+    def open_client(url: str) -> AsyncIOMotorClient:
+        return AsyncIOMotorClient(url, event_listeners=event_listeners, **settings.client_options())
+
+    client = open_client(settings.mongo_url)
+    db = client[settings.db_name]
+    partitions = PartitionRouter.from_settings(settings, client, open_client)
 
+    progress_cache = None
+    if settings.progress_cache_size > 0:
+        progress_cache = ProgressCache(InMemoryLRUCache(
+            max_entries=settings.progress_cache_size,
+            ttl=settings.progress_cache_ttl_seconds,
+        ))
+
+    leaderboards = Leaderboards(
+        db.leaderboard_entries,
+        refresh_interval=settings.leaderboard_refresh_seconds,
+        top_size=settings.leaderboard_top_size,
+    )
+
+    analytics = None
+    if settings.analytics_enabled:
+        analytics = Analytics(db.analytics_rollups, db.analytics_contributions)
+        analytics_cache = InMemoryLRUCache(max_entries=64, ttl=settings.analytics_cache_seconds)
+
+    job_queue = JobQueue(
+        max_size=settings.job_queue_size,
+        workers=settings.job_workers,
+        overflow=settings.job_overflow,
+        block_timeout=settings.job_block_timeout_seconds,
+    )
+    job_queue.register(LEADERBOARD_JOBS, update_leaderboards, max_attempts=settings.job_max_attempts)
+    job_queue.register(ANALYTICS_JOBS, update_analytics, max_attempts=settings.job_max_attempts)
+    job_queue.register(PLAYER_ANALYTICS_JOBS, update_player_analytics, max_attempts=settings.job_max_attempts)
+
+    session_manager = SessionManager(settings.session_max_concurrent)
+
+    write_buffer = None
+    if settings.progress_write_behind:
+        write_buffer = WriteBehindBuffer(
+            partitions,
+            flush_interval=settings.progress_flush_interval_seconds,
+            max_pending=settings.progress_flush_max_pending,
+            on_flushed=invalidate_cached_progress,
+        )
+
+    status_retention = StatusRetention(
+        db.status_checks,
+        db.status_buckets,
+        db.compaction_state,
+        retention_seconds=settings.status_retention_seconds,
+        minute_retention_seconds=settings.status_minute_bucket_retention_seconds,
+        interval=settings.status_compaction_interval_seconds,
+        lag=settings.status_compaction_lag_seconds,
+    )
+    status_buffer = None
+    if settings.status_write_behind:
+        status_buffer = InsertBuffer(
+            db.status_checks,
+            flush_interval=settings.status_flush_interval_seconds,
+            max_pending=settings.status_buffer_max,
+        )
 
-# Define Models
-class StatusCheck(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    client_name: str
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
-
-class StatusCheckCreate(BaseModel):
-    client_name: str
-
-class AttackMove(BaseModel):
-    id: str
-    name: str
-    type: str  # 'hold', 'double', 'triple'
-    damage: int
-    cooldown: int
-    cost: int
-    description: str
-    color: str
-    isOwned: bool = False
-    isEquipped: bool = False
-
-class PlayerStats(BaseModel):
-    level: int = 1
-    xp: int = 0
-    xpToNext: int = 100
-    health: int = 100
-    maxHealth: int = 100
-    coins: int = 50
-
-class WorldProgress(BaseModel):
-    worldId: int
-    unlocked: bool = False
-    completed: bool = False
-    bestTime: int = 0
-    highScore: int = 0
-
-class GameProgress(BaseModel):
-    id: Optional[str] = Field(default_factory=lambda: str(ObjectId()))
-    playerId: str
-    playerStats: PlayerStats
-    equippedMoves: Dict[str, Optional[AttackMove]] = {}
-    ownedMoves: List[str] = []
-    worldProgress: List[WorldProgress] = []
-    deathCount: int = 0
-    settings: Dict[str, bool] = {"soundEnabled": True, "musicEnabled": True}
-    updatedAt: datetime = Field(default_factory=datetime.utcnow)
-
-class GameProgressCreate(BaseModel):
-    playerId: str
-    playerStats: Optional[PlayerStats] = None
-
-class GameProgressUpdate(BaseModel):
-    playerStats: Optional[PlayerStats] = None
-    equippedMoves: Optional[Dict[str, Optional[AttackMove]]] = None
-    ownedMoves: Optional[List[str]] = None
-    worldProgress: Optional[List[WorldProgress]] = None
-    deathCount: Optional[int] = None
-    settings: Optional[Dict[str, bool]] = None
+async def invalidate_cached_progress(player_ids: List[str]) -> None:
+    if progress_cache is not None:
+        for player_id in player_ids:
+            await progress_cache.invalidate(player_id)
+
+# Leaderboards and analytics are derived data: they are updated on the job
+# queue after the save has been answered, and their failures never fail it
+LEADERBOARD_JOBS = "leaderboards"
+ANALYTICS_JOBS = "analytics"
+PLAYER_ANALYTICS_JOBS = "player_analytics"
+
+async def record_leaderboards(player_id: str, worlds: Optional[List[Dict[str, Any]]]) -> None:
+    if worlds:
+        await job_queue.enqueue(LEADERBOARD_JOBS, (player_id, worlds))
+
+async def record_analytics(doc: Dict[str, Any]) -> None:
+    if analytics is not None:
+        await job_queue.enqueue(ANALYTICS_JOBS, doc)
+
+async def record_batch_analytics(player_ids: List[str]) -> None:
+    # Bulk writes do not return documents; the job reads back the ones written
+    if analytics is not None:
+        for player_id in player_ids:
+            await job_queue.enqueue(PLAYER_ANALYTICS_JOBS, player_id)
+
+async def update_leaderboards(saves: List[Tuple[str, List[Dict[str, Any]]]]) -> None:
+    await leaderboards.record_many(saves)
+
+async def update_analytics(docs: List[Dict[str, Any]]) -> None:
+    await analytics.record_many(docs)
+
+async def update_player_analytics(player_ids: List[str]) -> None:
+    await analytics.record_many(await partitions.find_many(player_ids))
+
+# Create a router with the /api prefix
+api_router = APIRouter(prefix="/api")
 
 
 # Basic endpoints
@@ -92,136 +230,834 @@ class GameProgressUpdate(BaseModel):
 async def root():
     return {"message": "Phoenix Flying Game API"}
 
+@api_router.get("/health/live")
+async def liveness():
+    """The process is up and serving requests"""
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness():
+    """MongoDB answers and the startup checks have passed; 503 otherwise"""
+    try:
+        if ready:
+            await asyncio.wait_for(
+                asyncio.gather(client.admin.command("ping"), partitions.ping()),
+                timeout=settings.readiness_timeout_seconds,
+            )
+        else:
+            # Mongo was unreachable at startup; retry instead of staying unready
+            await asyncio.wait_for(startup_checks(), timeout=settings.readiness_timeout_seconds)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"MongoDB unavailable: {type(e).__name__}")
+    return {"status": "ready"}
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
-    status_dict = input.dict()
+    status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
+    if status_buffer is not None:
+        await status_buffer.add(status_obj.model_dump())
+    else:
+        await db.status_checks.insert_one(status_obj.model_dump())
     return status_obj
 
+STATUS_FIELDS = ("id", "client_name", "timestamp")
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+async def get_status_checks(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    client_name: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated subset of id,client_name,timestamp"),
+    format: Optional[str] = Query(None, pattern="^(json|ndjson)$"),
+    accept: Optional[str] = Header(None),
+):
+    """Status checks in (timestamp, id) order, one page at a time.
+
+    JSON responses hold at most `limit` (default 1000) checks, with the cursor
+    for the next page in the X-Next-Cursor header. With format=ndjson (or an
+    application/x-ndjson Accept header) matching checks are streamed as they
+    come off the Mongo cursor, and `limit` is only applied when given.
+    """
+    query: Dict[str, Any] = {}
+    if client_name is not None:
+        query["client_name"] = client_name
+    if since is not None or until is not None:
+        query["timestamp"] = {}
+        if since is not None:
+            query["timestamp"]["$gte"] = since
+        if until is not None:
+            query["timestamp"]["$lt"] = until
+    try:
+        after = keyset_filter(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if after:
+        query = {"$and": [query, after]} if query else after
+
+    output_fields = STATUS_FIELDS
+    if fields:
+        output_fields = tuple(field.strip() for field in fields.split(",") if field.strip())
+        unknown = set(output_fields) - set(STATUS_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    # The sort key is always read so a cursor can be built, then dropped if not asked for
+    projection = {"_id": 0, "id": 1, "timestamp": 1, **{field: 1 for field in output_fields}}
+
+    streaming = format == "ndjson" or (format is None and accept is not None and NDJSON_MEDIA_TYPE in accept)
+    status_cursor = db.status_checks.find(query, projection).sort([("timestamp", 1), ("id", 1)])
+
+    if streaming:
+        if limit is not None:
+            status_cursor = status_cursor.limit(limit)
+
+        async def stream_status_checks():
+            async for status_check in status_cursor.batch_size(500):
+                yield encode_json(public_status_check(status_check, output_fields)) + b"\n"
+
+        return StreamingResponse(stream_status_checks(), media_type=NDJSON_MEDIA_TYPE)
+
+    limit = limit or 1000
+    status_checks = await status_cursor.limit(limit).to_list(limit)
+    headers = {}
+    if len(status_checks) == limit:
+        last = status_checks[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last["timestamp"], last["id"])
+    return Response(encode_json([
+        public_status_check(status_check, output_fields) for status_check in status_checks
+    ]), media_type="application/json", headers=headers)
+
+def public_status_check(status_check: Dict[str, Any], output_fields) -> Dict[str, Any]:
+    if len(output_fields) == len(STATUS_FIELDS):
+        return status_check
+    return {field: status_check[field] for field in output_fields if field in status_check}
+
+@api_router.get("/status/buckets")
+async def get_status_buckets(
+    granularity: str = Query("hour", pattern="^(minute|hour)$"),
+    client_name: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+):
+    """Status check counts per client and minute or hour, in (start,
+    client_name) order. Checks younger than the compaction lag are not
+    counted yet."""
+    buckets = await status_retention.find_buckets(granularity, since, until, client_name, limit)
+    return Response(encode_json(buckets), media_type="application/json")
+
+@api_router.get("/status/clients")
+async def get_status_clients(since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Status check totals per client over the hours starting in [since, until)"""
+    summary = await status_retention.client_summary(since, until)
+    return Response(encode_json(summary), media_type="application/json")
 
 # Game Progress endpoints
-@api_router.post("/game/progress", response_model=GameProgress)
-async def create_game_progress(input: GameProgressCreate):
-    # Create default game progress
-    default_stats = PlayerStats()
-    if input.playerStats:
-        default_stats = input.playerStats
-    
-    # Create initial world progress (10 worlds, first unlocked)
-    worlds = []
-    for i in range(1, 11):
-        worlds.append(WorldProgress(
-            worldId=i,
-            unlocked=(i == 1),
-            completed=False,
-            bestTime=0,
-            highScore=0
-        ))
-    
+def new_progress_document(player_id: str, player_stats: Optional[PlayerStats]) -> Dict[str, Any]:
+    """Mongo document for a new player: 10 worlds with the first unlocked, starter moves owned"""
+    worlds = [
+        WorldProgress(worldId=i, unlocked=(i == 1), completed=False, bestTime=0, highScore=0)
+        for i in range(1, 11)
+    ]
     game_progress = GameProgress(
-        playerId=input.playerId,
-        playerStats=default_stats,
+        playerId=player_id,
+        playerStats=player_stats or PlayerStats(),
         worldProgress=worlds,
-        ownedMoves=["hold_1", "double_1", "triple_1"]  # Starter moves
+        ownedMoves=list(STARTER_MOVES)
+    )
+
+    progress_dict = game_progress.model_dump()
+    progress_dict["_id"] = ObjectId(progress_dict.pop("id"))
+    return progress_dict
+
+@api_router.post("/game/progress", response_model=GameProgress)
+async def create_game_progress(input: GameProgressCreate, accept: Optional[str] = Header(None)):
+    progress_dict = new_progress_document(input.playerId, input.playerStats)
+    collection = await partitions.locate(input.playerId)
+    try:
+        await collection.insert_one(progress_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Game progress already exists")
+    await cache_progress(progress_dict)
+    await record_analytics(progress_dict)
+    return progress_response(progress_dict, accept, move_catalog)
+
+@api_router.post("/game/progress/batch", response_model=ProgressBatchResult)
+async def batch_game_progress(batch: ProgressBatch):
+    """Apply creates/updates for many players with one unordered bulk write"""
+    rejected, flagged_players = await verify_batch_runs(batch.items)
+    writes, invalid = plan_progress_batch(batch.items, new_progress_document, rejected)
+    bulk_result: Dict[str, Any] = {}
+    if writes:
+        if write_buffer:
+            await write_buffer.flush(write.player_id for write in writes)
+        await partitions.relocate(write.player_id for write in writes)
+        # Split by partition; a partition that is down fails only its own items
+        bulk_result = await partitions.bulk_write([
+            (write.player_id, write.to_operation(new_progress_document)) for write in writes
+        ])
+        await invalidate_cached_progress([write.player_id for write in writes])
+        failed = {error["index"] for error in bulk_result.get("writeErrors", [])}
+        for op_index, write in enumerate(writes):
+            if op_index not in failed and write.player_id not in flagged_players:
+                await record_leaderboards(write.player_id, write.set_fields.get("worldProgress"))
+        await record_batch_analytics([write.player_id for op_index, write in enumerate(writes) if op_index not in failed])
+
+    return ProgressBatchResult(
+        results=collect_batch_results(batch.items, writes, invalid, bulk_result)
     )
-    
-    progress_dict = game_progress.dict()
-    progress_dict["_id"] = ObjectId(progress_dict["id"])
-    del progress_dict["id"]
-    
-    result = await db.game_progress.insert_one(progress_dict)
-    progress_dict["id"] = str(result.inserted_id)
-    del progress_dict["_id"]
-    
-    return GameProgress(**progress_dict)
 
 @api_router.get("/game/progress/{player_id}", response_model=GameProgress)
-async def get_game_progress(player_id: str):
-    progress = await db.game_progress.find_one({"playerId": player_id})
+async def get_game_progress(
+    player_id: str,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+):
+    # Revalidation only needs the validators, not the whole document
+    if if_none_match or if_modified_since:
+        validators = await read_progress_validators(player_id)
+        if not validators:
+            raise HTTPException(status_code=404, detail="Game progress not found")
+        headers = progress_headers(validators, accept)
+        if if_none_match:
+            not_modified = etag_matches(if_none_match, headers["ETag"])
+        else:
+            not_modified = not_modified_since(validators, if_modified_since)
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+
+    progress = await read_progress_document(player_id)
     if not progress:
         raise HTTPException(status_code=404, detail="Game progress not found")
     
-    progress["id"] = str(progress["_id"])
-    del progress["_id"]
-    return GameProgress(**progress)
+    if write_buffer:
+        progress = write_buffer.overlay(player_id, progress)
+    return progress_response(progress, accept, move_catalog)
 
-@api_router.put("/game/progress/{player_id}", response_model=GameProgress)
-async def update_game_progress(player_id: str, update: GameProgressUpdate):
-    # Get existing progress
-    existing = await db.game_progress.find_one({"playerId": player_id})
-    if not existing:
+@api_router.post("/game/progress/{player_id}/checkpoint")
+async def checkpoint_game_progress(player_id: str):
+    """Persist any buffered saves for a player right away"""
+    flushed = await write_buffer.flush_player(player_id) if write_buffer else False
+    return {"playerId": player_id, "flushed": flushed}
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    if progress_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **progress_cache.stats()}
+
+@api_router.get("/jobs/stats")
+async def get_job_stats():
+    """Depth, outcomes and latency of the background job queue"""
+    return job_queue.stats()
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of request, database and job queue metrics"""
+    return Response(metrics.render() + job_queue.render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+@api_router.get("/analytics")
+async def get_analytics(days: int = Query(30, ge=1, le=365)):
+    """Per-world completion, per-level averages, coin distribution and daily
+    activity, read from pre-aggregated rollups and cached briefly"""
+    if analytics is None:
+        raise HTTPException(status_code=404, detail="Analytics are disabled")
+    key = f"days:{days}"
+    body = await analytics_cache.get(key)
+    if body is None:
+        body = encode_json(await analytics.summary(days))
+        await analytics_cache.set(key, body)
+    return Response(body, media_type="application/json")
+
+async def load_progress_document(player_id: str) -> Optional[Dict[str, Any]]:
+    collection = await partitions.locate(player_id)
+    return await collection.find_one({"playerId": player_id})
+
+async def read_progress_document(player_id: str) -> Optional[Dict[str, Any]]:
+    """Stored progress document, served from the cache when enabled"""
+    if progress_cache is not None:
+        return await progress_cache.get(player_id, load_progress_document)
+    return await load_progress_document(player_id)
+
+PROGRESS_VALIDATOR_FIELDS = {"_id": 1, "version": 1, "updatedAt": 1}
+
+async def read_progress_validators(player_id: str) -> Optional[Dict[str, Any]]:
+    """`_id`, `version` and `updatedAt` of a player's progress, as a client last saw them"""
+    doc = await progress_cache.peek(player_id) if progress_cache is not None else None
+    if doc is None:
+        collection = await partitions.locate(player_id)
+        doc = await collection.find_one({"playerId": player_id}, PROGRESS_VALIDATOR_FIELDS)
+    if doc and write_buffer:
+        doc = write_buffer.overlay(player_id, doc)
+    return doc
+
+async def cache_progress(doc: Dict[str, Any]) -> None:
+    if progress_cache is not None:
+        await progress_cache.put(doc["playerId"], doc)
+
+async def find_missed_update_target(player_id: str) -> Dict[str, Any]:
+    """Load the document a conditional update did not match, or 404.
+
+    Only the failure path pays for this second query, to tell a missing
+    player apart from a stale write.
+    """
+    collection = await partitions.locate(player_id)
+    current = await collection.find_one({"playerId": player_id})
+    if not current:
         raise HTTPException(status_code=404, detail="Game progress not found")
-    
-    # Update fields
-    update_data = update.dict(exclude_unset=True)
-    update_data["updatedAt"] = datetime.utcnow()
-    
-    result = await db.game_progress.update_one(
-        {"playerId": player_id},
-        {"$set": update_data}
+    return current
+
+def version_conflict(current: Dict[str, Any]) -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail=f"Game progress was modified (current version {current.get('version', 0)})"
     )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Failed to update progress")
-    
-    # Return updated progress
-    updated = await db.game_progress.find_one({"playerId": player_id})
-    updated["id"] = str(updated["_id"])
-    del updated["_id"]
-    return GameProgress(**updated)
 
-@api_router.get("/moves/available")
-async def get_available_moves():
-    """Get all available moves in the shop"""
-    moves = []
-    
-    # Hold moves
-    hold_moves = [
-        {"id": "hold_1", "name": "Phoenix Inferno", "type": "hold", "damage": 50, "cooldown": 8000, "cost": 0, "description": "Channel a massive fire beam", "color": "#ff4444"},
-        {"id": "hold_2", "name": "Dragon's Breath", "type": "hold", "damage": 75, "cooldown": 10000, "cost": 100, "description": "Intense flame torrent", "color": "#ff2222"},
-        {"id": "hold_3", "name": "Solar Flare", "type": "hold", "damage": 100, "cooldown": 12000, "cost": 200, "description": "Blinding solar energy", "color": "#ff2222"},
-        {"id": "hold_4", "name": "Inferno Wave", "type": "hold", "damage": 125, "cooldown": 15000, "cost": 350, "description": "Devastating fire wave", "color": "#ff2222"},
-        {"id": "hold_5", "name": "Phoenix Nova", "type": "hold", "damage": 150, "cooldown": 18000, "cost": 500, "description": "Explosive nova blast", "color": "#ff2222"},
-    ]
-    
-    # Double click moves
-    double_moves = [
-        {"id": "double_1", "name": "Fire Dart", "type": "double", "damage": 15, "cooldown": 1500, "cost": 0, "description": "Quick fire projectile", "color": "#ff6644"},
-        {"id": "double_2", "name": "Flame Burst", "type": "double", "damage": 20, "cooldown": 1200, "cost": 50, "description": "Rapid fire burst", "color": "#ff6644"},
-        {"id": "double_3", "name": "Fire Lance", "type": "double", "damage": 25, "cooldown": 1000, "cost": 100, "description": "Piercing flame spear", "color": "#ff6644"},
-        {"id": "double_4", "name": "Spark Storm", "type": "double", "damage": 30, "cooldown": 800, "cost": 150, "description": "Multiple fire sparks", "color": "#ff6644"},
-        {"id": "double_5", "name": "Blaze Bullet", "type": "double", "damage": 35, "cooldown": 600, "cost": 250, "description": "High-speed fire bullet", "color": "#ff6644"},
-    ]
-    
-    # Triple click moves
-    triple_moves = [
-        {"id": "triple_1", "name": "Phoenix Strike", "type": "triple", "damage": 35, "cooldown": 4000, "cost": 0, "description": "Powerful flame burst", "color": "#ff8844"},
-        {"id": "triple_2", "name": "Phoenix Claw", "type": "triple", "damage": 45, "cooldown": 3500, "cost": 75, "description": "Powerful claw attack", "color": "#ff8844"},
-        {"id": "triple_3", "name": "Flame Tornado", "type": "triple", "damage": 60, "cooldown": 3000, "cost": 150, "description": "Spinning fire vortex", "color": "#ff8844"},
-        {"id": "triple_4", "name": "Fire Storm", "type": "triple", "damage": 75, "cooldown": 2500, "cost": 300, "description": "Chaotic flame storm", "color": "#ff8844"},
-        {"id": "triple_5", "name": "Solar Bomb", "type": "triple", "damage": 90, "cooldown": 2000, "cost": 450, "description": "Explosive solar energy", "color": "#ff8844"},
+def precondition_failed(current: Dict[str, Any]) -> HTTPException:
+    return HTTPException(
+        status_code=412,
+        detail=f"Game progress was modified (current version {current.get('version', 0)})"
+    )
+
+def stale_write(current: Dict[str, Any], if_match: Optional[str]) -> HTTPException:
+    return precondition_failed(current) if if_match else version_conflict(current)
+
+def if_match_precondition(if_match: str, body_version: Optional[int]) -> Tuple[Optional[str], Optional[int]]:
+    """Document id and version a write is conditional on, from an If-Match header"""
+    if if_match.strip() == "*":
+        return None, body_version
+    etag = parse_progress_etag(if_match.split(",")[0])
+    if etag is None or (body_version is not None and body_version != etag.version):
+        raise HTTPException(status_code=412, detail="If-Match does not match the current game progress")
+    return etag.document_id, etag.version
+
+def document_id_filter(document_id: str) -> Any:
+    return ObjectId(document_id) if ObjectId.is_valid(document_id) else document_id
+
+def version_filter(version: int) -> Dict[str, Any]:
+    """Match a stored version; documents saved before versioning count as 0"""
+    if version == 0:
+        return {"$in": [0, None]}
+    return version
+
+def impossible_runs(runs: List[RunLog], verdicts: RunVerdicts) -> List[Dict[str, Any]]:
+    return [
+        {"index": int(i), "worldId": runs[i].worldId, "reasons": verdicts.reasons(i)}
+        for i in np.flatnonzero(~verdicts.ok)
     ]
-    
+
+async def flag_runs(player_id: str, runs: List[RunLog], impossible: List[Dict[str, Any]]) -> None:
+    logger.warning("Flagged %d impossible run(s) from %s", len(impossible), player_id)
+    try:
+        await db.flagged_runs.insert_many([
+            {"playerId": player_id, "run": runs[run["index"]].model_dump(), "reasons": run["reasons"], "flaggedAt": datetime.utcnow()}
+            for run in impossible
+        ])
+    except Exception:
+        logger.exception("Failed to record flagged runs for %s", player_id)
+
+async def flag_results(player_id: str, unverified: List[Dict[str, Any]]) -> None:
+    logger.warning("Flagged %d unverified result(s) from %s", len(unverified), player_id)
+    try:
+        await db.flagged_runs.insert_many([
+            {"playerId": player_id, "result": result, "reasons": [UNVERIFIED_RESULT], "flaggedAt": datetime.utcnow()}
+            for result in unverified
+        ])
+    except Exception:
+        logger.exception("Failed to record flagged results for %s", player_id)
+
+async def read_stored_worlds(player_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Stored `worldProgress` of each player, buffered saves included"""
+    await partitions.relocate(player_ids)
+    docs = await partitions.find_many(player_ids, {"_id": 0, "playerId": 1, "worldProgress": 1})
+    if write_buffer:
+        docs = [write_buffer.overlay(doc["playerId"], doc) for doc in docs]
+    return {doc["playerId"]: doc.get("worldProgress") or [] for doc in docs}
+
+async def verify_save(
+    player_id: str,
+    runs: Optional[List[RunLog]],
+    worlds: Optional[List[Dict[str, Any]]],
+) -> Tuple[bool, List[Dict[str, Any]]]:
+    """Verify a save's runs.
+
+    Returns whether the runs can be trusted and the save's world results
+    they do not back (see verifier.unbacked_claims). Reject mode refuses
+    impossible runs with 422; flag mode records them. The claims are left
+    to the write: `held_claims_filter` lets it match when the player
+    already holds them, and `screen_claims` checks them after a miss.
+    """
+    if settings.run_verification == "off":
+        return True, []
+    runs = runs or []
+    verdicts = run_verifier.verify(runs)
+    impossible = impossible_runs(runs, verdicts)
+    if impossible:
+        if settings.run_verification == "reject":
+            raise HTTPException(status_code=422, detail={"message": "Impossible run submitted", "runs": impossible})
+        await flag_runs(player_id, runs, impossible)
+    return not impossible, unbacked_claims(worlds or [], verified_bests(runs, verdicts))
+
+def held_claims_filter(claims: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Match a document that already holds every claimed world result"""
+    conditions = []
+    for claim in claims:
+        if claim["field"] == "highScore":
+            bound = {"$gte": claim["claimed"]}
+        else:
+            bound = {"$gt": 0, "$lte": claim["claimed"]}
+        conditions.append({"worldProgress": {"$elemMatch": {"worldId": claim["worldId"], claim["field"]: bound}}})
+    return {"$and": conditions} if conditions else {}
+
+def screen_claims(claims: List[Dict[str, Any]], current: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Claims that improve on the `current` document, to flag; reject mode refuses them with 422"""
+    unverified = unverified_results(claims, current.get("worldProgress") or [])
+    if unverified and settings.run_verification == "reject":
+        raise HTTPException(status_code=422, detail={"message": "Unverified result submitted", "results": unverified})
+    return unverified
+
+async def verify_batch_runs(items: List[ProgressBatchItem]):
+    """Verify the runs of every batch item in one pass, as `verify_save`
+    does, and screen the results they do not back against the stored
+    worlds, read only for the players with such results.
+
+    Returns results for items rejected because of their runs or results
+    (reject mode) and the players whose runs were flagged (flag mode).
+    """
+    rejected: Dict[int, ProgressBatchItemResult] = {}
+    flagged_players = set()
+    if settings.run_verification == "off":
+        return rejected, flagged_players
+
+    spans: Dict[int, Tuple[int, int]] = {}  # item index -> slice of `runs`
+    runs: List[RunLog] = []
+    worlds: Dict[int, List[Dict[str, Any]]] = {}
+    for index, item in enumerate(items):
+        if item.op != "update":
+            continue
+        try:
+            update = GameProgressUpdate.model_validate(item.data)
+        except ValidationError:
+            continue  # reported as invalid when the item is validated
+        spans[index] = (len(runs), len(runs) + len(update.runs or []))
+        runs.extend(update.runs or [])
+        if update.worldProgress:
+            worlds[index] = [world.model_dump() for world in update.worldProgress]
+    if not spans:
+        return rejected, flagged_players
+
+    verdicts = run_verifier.verify(runs)
+    claims: Dict[int, List[Dict[str, Any]]] = {}
+    for index, item_worlds in worlds.items():
+        first, last = spans[index]
+        item_verdicts = RunVerdicts(*(array[first:last] for array in verdicts))
+        item_claims = unbacked_claims(item_worlds, verified_bests(runs[first:last], item_verdicts))
+        if item_claims:
+            claims[index] = item_claims
+    # Stored worlds are only needed for results no run backs
+    stored = await read_stored_worlds(list({items[index].playerId for index in claims})) if claims else {}
+    for index, (first, last) in spans.items():
+        item = items[index]
+        item_runs = runs[first:last]
+        item_verdicts = RunVerdicts(*(array[first:last] for array in verdicts))
+        impossible = impossible_runs(item_runs, item_verdicts)
+        unverified = unverified_results(claims.get(index, []), stored.get(item.playerId, []))
+        if settings.run_verification == "reject":
+            if impossible or unverified:
+                reasons = {reason for run in impossible for reason in run["reasons"]}
+                if unverified:
+                    reasons.add(UNVERIFIED_RESULT)
+                rejected[index] = ProgressBatchItemResult(
+                    index=index, playerId=item.playerId, status="invalid",
+                    error=f"{'Impossible run' if impossible else 'Unverified result'} submitted: {'; '.join(sorted(reasons))}",
+                )
+            continue
+        if unverified:
+            await flag_results(item.playerId, unverified)
+        if impossible:
+            flagged_players.add(item.playerId)
+            await flag_runs(item.playerId, item_runs, impossible)
+    return rejected, flagged_players
+
+@api_router.put("/game/progress/{player_id}", response_model=GameProgress)
+async def update_game_progress(
+    player_id: str,
+    update: GameProgressUpdate,
+    accept: Optional[str] = Header(None),
+    if_match: Optional[str] = Header(None),
+):
+    update_data = update.model_dump(exclude_unset=True)
+    expected_version = update_data.pop("version", None)
+    expected_id = None
+    if if_match:
+        expected_id, expected_version = if_match_precondition(if_match, expected_version)
+    update_data.pop("runs", None)
+    if update_data.get("equippedMoves"):
+        update_data["equippedMoves"] = equipped_move_ids(update_data["equippedMoves"])
+    trusted, claims = await verify_save(player_id, update.runs, update_data.get("worldProgress"))
+
+    if write_buffer:
+        return progress_response(await buffer_game_progress_update(
+            player_id, update_data, expected_version, expected_id, if_match, trusted, claims
+        ), accept, move_catalog)
+
+    query: Dict[str, Any] = {"playerId": player_id}
+    if expected_version is not None:
+        query["version"] = version_filter(expected_version)
+    if expected_id is not None:
+        query["_id"] = document_id_filter(expected_id)
+
+    # Single round trip: apply the update and get the post-update document back.
+    # Only a save that changes something matches, so identical re-saves keep
+    # their version (and ETag) and fall through to the read below. Results
+    # the runs do not back must already be held for the update to match.
+    updated = None
+    unverified: List[Dict[str, Any]] = []
+    if update_data:
+        query["$or"] = [{key: {"$ne": value}} for key, value in update_data.items()]
+        collection = await partitions.locate(player_id)
+        update = {
+            "$set": {**update_data, "updatedAt": datetime.utcnow()},
+            "$inc": {"version": 1},
+        }
+        updated = await collection.find_one_and_update(
+            {**query, **held_claims_filter(claims)}, update, return_document=ReturnDocument.AFTER
+        )
+
+    if not updated:
+        current = await find_missed_update_target(player_id)
+        repeated = is_repeated_update(current, update_data)
+        if is_stale(current, expected_version, expected_id) and not repeated:
+            raise stale_write(current, if_match)
+        updated = current
+        if claims and not repeated:
+            # Only the claims kept the update from matching: screen them
+            # against the document read and write over exactly that one
+            unverified = screen_claims(claims, current)
+            query.update(_id=current["_id"], version=version_filter(current.get("version") or 0))
+            updated = await collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+            if not updated:
+                raise stale_write(await find_missed_update_target(player_id), if_match)
+
+    if unverified:
+        await flag_results(player_id, unverified)
+    await cache_progress(updated)
+    await record_analytics(updated)
+    if trusted:
+        await record_leaderboards(player_id, update_data.get("worldProgress"))
+    return progress_response(updated, accept, move_catalog)
+
+def is_stale(current: Dict[str, Any], expected_version: Optional[int], expected_id: Optional[str]) -> bool:
+    return (
+        (expected_version is not None and (current.get("version") or 0) != expected_version)
+        or (expected_id is not None and str(current["_id"]) != expected_id)
+    )
+
+def is_repeated_update(current: Dict[str, Any], update_data: Dict[str, Any]) -> bool:
+    # A retried save that already landed is not a conflict; an empty one
+    # carries nothing to tell it apart from a stale write
+    return bool(update_data) and all(current.get(key) == value for key, value in update_data.items())
+
+async def buffer_game_progress_update(
+    player_id: str,
+    update_data: Dict[str, Any],
+    expected_version: Optional[int],
+    expected_id: Optional[str],
+    if_match: Optional[str],
+    trusted: bool,
+    claims: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Write-behind variant of a save: merged into the buffer, flushed later"""
+    current = await write_buffer.snapshot(player_id, read_progress_document)
+    if not current:
+        raise HTTPException(status_code=404, detail="Game progress not found")
+
+    repeated = is_repeated_update(current, update_data)
+    if is_stale(current, expected_version, expected_id) and not repeated:
+        raise stale_write(current, if_match)
+    if repeated or not update_data:
+        return current
+
+    unverified = screen_claims(claims, current)
+    set_fields = {**update_data, "updatedAt": datetime.utcnow()}
+    # No await since the snapshot, so nothing was flushed in between
+    write_buffer.buffer(player_id, set_fields, {"version": 1})
+    buffered = {**current, **set_fields, "version": (current.get("version") or 0) + 1}
+    if unverified:
+        await flag_results(player_id, unverified)
+    await record_analytics(buffered)
+    if trusted:
+        await record_leaderboards(player_id, update_data.get("worldProgress"))
+    return buffered
+
+@api_router.patch("/game/progress/{player_id}", response_model=GameProgress)
+async def patch_game_progress(player_id: str, patch: GameProgressPatch, accept: Optional[str] = Header(None)):
+    """Apply targeted changes (counters, one move, per-world bests, one slot)"""
+    try:
+        updated = await apply_progress_patch(player_id, patch)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return progress_response(updated, accept, move_catalog)
+
+async def apply_progress_patch(player_id: str, patch: GameProgressPatch) -> Dict[str, Any]:
+    """Write a patch and its follow-ups; returns the updated document.
+
+    Shared by PATCH and WebSocket sessions. Raises ValueError for patches
+    that cannot be built and HTTPException for rejected runs, missing
+    players, moves not owned and version conflicts.
+    """
+    trusted, claims = await verify_save(player_id, patch.runs, [world.model_dump(exclude_none=True) for world in patch.worlds])
+    update, array_filters = build_progress_patch(patch, move_catalog)
+    update.setdefault("$set", {})["updatedAt"] = datetime.utcnow()
+
+    # Buffered saves must land before a direct write so they apply in order
+    if write_buffer:
+        await write_buffer.flush_player(player_id)
+
+    query = {"playerId": player_id, **progress_patch_filter(patch, move_catalog)}
+    if patch.version is not None:
+        query["version"] = version_filter(patch.version)
+
+    collection = await partitions.locate(player_id)
+    updated = await collection.find_one_and_update(
+        {**query, **held_claims_filter(claims)},
+        update,
+        array_filters=array_filters or None,
+        return_document=ReturnDocument.AFTER,
+    )
+    unverified: List[Dict[str, Any]] = []
+    if not updated:
+        current = await find_missed_update_target(player_id)
+        if is_stale(current, patch.version, None):
+            raise version_conflict(current)
+        if "ownedMoves" in query and query["ownedMoves"] not in (current.get("ownedMoves") or []):
+            raise HTTPException(status_code=409, detail=f"Move {patch.equip.moveId} is not owned")
+        if not claims:
+            raise version_conflict(current)
+        # As in PUT: screen the claims and patch exactly the document read
+        unverified = screen_claims(claims, current)
+        query["version"] = version_filter(current.get("version") or 0)
+        updated = await collection.find_one_and_update(
+            query,
+            update,
+            array_filters=array_filters or None,
+            return_document=ReturnDocument.AFTER,
+        )
+        if not updated:
+            raise version_conflict(await find_missed_update_target(player_id))
+
+    if unverified:
+        await flag_results(player_id, unverified)
+    await cache_progress(updated)
+    await record_analytics(updated)
+    if patch.worlds and trusted:
+        patched = {world.worldId for world in patch.worlds}
+        await record_leaderboards(player_id, [w for w in updated.get("worldProgress", []) if w.get("worldId") in patched])
+    return updated
+
+@api_router.websocket("/game/session/{player_id}")
+async def progress_session(websocket: WebSocket, player_id: str):
+    """Stream one run's events over a WebSocket; protocol in sessions.ProgressSession"""
+    await websocket.accept()
+    if not await read_progress_document(player_id):
+        await websocket.close(code=4404, reason="Game progress not found")
+        return
+    if session_manager.full():
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="Too many sessions")
+        return
+    await session_manager.run(ProgressSession(
+        websocket,
+        player_id,
+        persist=lambda patch: apply_progress_patch(player_id, patch),
+        checkpoint_interval=settings.session_checkpoint_seconds,
+        max_unsaved_events=settings.session_max_unsaved_events,
+        idle_timeout=settings.session_idle_timeout_seconds,
+    ))
+
+@api_router.post("/shop/{player_id}/purchase", response_model=PurchaseResult)
+async def purchase_move(player_id: str, purchase: PurchaseRequest):
+    """Buy a move: one conditional update checks the balance, charges it and adds the move"""
+    move = move_catalog.get(purchase.moveId)
+    if move is None:
+        raise HTTPException(status_code=404, detail="Move not found")
+    query, update = build_purchase(player_id, move)
+    update["$set"] = {"updatedAt": datetime.utcnow()}
+
+    # Buffered saves may change coins; they must land before the balance is checked
+    if write_buffer:
+        await write_buffer.flush_player(player_id)
+
+    collection = await partitions.locate(player_id)
+    updated = await collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+    if not updated:
+        current = await find_missed_update_target(player_id)
+        if move.id in current.get("ownedMoves", []):
+            raise HTTPException(status_code=409, detail=f"Move {move.id} is already owned")
+        coins = current.get("playerStats", {}).get("coins", 0)
+        raise HTTPException(status_code=409, detail=f"Not enough coins: {move.cost} needed, {coins} available")
+
+    await cache_progress(updated)
+    await record_analytics(updated)
+    return PurchaseResult(playerId=player_id, moveId=move.id, coins=updated["playerStats"]["coins"], version=updated["version"])
+
+@api_router.post("/shop/{player_id}/equip", response_model=EquipResult)
+async def equip_move(player_id: str, equip: EquipSlot):
+    """Put an owned move in its slot (or clear the slot) with one conditional update"""
+    try:
+        query, update = build_equip(player_id, equip, move_catalog)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    update["$set"]["updatedAt"] = datetime.utcnow()
+
+    if write_buffer:
+        await write_buffer.flush_player(player_id)
+
+    collection = await partitions.locate(player_id)
+    updated = await collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+    if not updated:
+        await find_missed_update_target(player_id)
+        raise HTTPException(status_code=409, detail=f"Move {equip.moveId} is not owned")
+
+    await cache_progress(updated)
+    return EquipResult(playerId=player_id, slot=equip.slot, moveId=equip.moveId, version=updated["version"])
+
+@api_router.get("/leaderboards/{world_id}")
+async def get_leaderboard(
+    world_id: int,
+    metric: str = Query("highScore", pattern="^(highScore|bestTime)$"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """Top players of a world by high score (highest first) or best time (fastest first)"""
     return {
-        "moves": hold_moves + double_moves + triple_moves,
-        "total": len(hold_moves + double_moves + triple_moves)
+        "worldId": world_id,
+        "metric": metric,
+        "total": await leaderboards.total(world_id, metric),
+        "entries": await leaderboards.entries(world_id, metric, offset, offset + limit),
     }
 
-# Include the router in the main app
-app.include_router(api_router)
+@api_router.get("/leaderboards/{world_id}/players/{player_id}")
+async def get_leaderboard_rank(
+    world_id: int,
+    player_id: str,
+    metric: str = Query("highScore", pattern="^(highScore|bestTime)$"),
+    neighbors: int = Query(5, ge=0, le=50),
+):
+    """A player's rank in a world, with the players just above and below"""
+    ranked = await leaderboards.rank(world_id, metric, player_id)
+    if ranked is None:
+        raise HTTPException(status_code=404, detail="Player has no entry on this leaderboard")
+    rank, value = ranked
+    return {
+        "worldId": world_id,
+        "metric": metric,
+        "playerId": player_id,
+        "rank": rank,
+        "value": value,
+        "total": await leaderboards.total(world_id, metric),
+        "neighbors": await leaderboards.entries(world_id, metric, rank - 1 - neighbors, rank + neighbors),
+    }
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+def catalog_response(encoded: EncodedResponse, if_none_match: Optional[str]) -> Response:
+    headers = {"ETag": encoded.etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, encoded.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=encoded.body, media_type="application/json", headers=headers)
+
+@api_router.get("/moves/available")
+async def get_available_moves(
+    type: Optional[str] = None,
+    maxCost: Optional[int] = Query(None, ge=0),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Get all available moves in the shop, optionally filtered by type and price"""
+    return catalog_response(move_catalog.encoded_list(type, maxCost), if_none_match)
+
+@api_router.get("/moves/{move_id}")
+async def get_move(move_id: str, if_none_match: Optional[str] = Header(None)):
+    encoded = move_catalog.encoded_move(move_id)
+    if encoded is None:
+        raise HTTPException(status_code=404, detail="Move not found")
+    return catalog_response(encoded, if_none_match)
+
+def require_admin(authorization: Optional[str] = Header(None)) -> None:
+    # Without ADMIN_TOKEN the admin endpoints do not exist
+    if not settings.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    expected = f"Bearer {settings.admin_token}"
+    if authorization is None or not secrets.compare_digest(authorization.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+def transfer_collection(collection: str) -> transfer.CollectionSpec:
+    spec = transfer.COLLECTIONS.get(collection)
+    if spec is None:
+        raise HTTPException(status_code=404, detail=f"Unknown collection: {collection}")
+    return spec
+
+TRANSFER_FORMAT = Query("ndjson", pattern="^(ndjson|bson)$")
+
+@api_router.get("/admin/export/{collection}", dependencies=[Depends(require_admin)])
+async def export_collection(
+    collection: str,
+    format: str = TRANSFER_FORMAT,
+    gzip: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: int = Query(1000, ge=1, le=10000),
+):
+    """Stream a whole collection (or the documents updated in [since, until))
+    as Extended JSON lines or concatenated BSON, optionally gzipped"""
+    spec = transfer_collection(collection)
+    chunks = transfer.export_chunks(
+        partitions.collections if collection == "game_progress" else db[collection],
+        format,
+        transfer.time_filter(spec, since, until),
+        batch_size=batch_size,
+        compress=gzip,
+    )
+    filename = f"{collection}.{format}" + (".gz" if gzip else "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        # Already compressed; GZipMiddleware leaves responses with an encoding alone
+        return StreamingResponse(chunks, media_type="application/gzip", headers={**headers, "Content-Encoding": "identity"})
+    return StreamingResponse(chunks, media_type=transfer.MEDIA_TYPES[format], headers=headers)
+
+@api_router.post("/admin/import/{collection}", dependencies=[Depends(require_admin)])
+async def import_collection(
+    collection: str,
+    request: Request,
+    format: str = TRANSFER_FORMAT,
+    batch_size: int = Query(1000, ge=1, le=10000),
+):
+    """Upsert an export (gzipped or not) streamed in the request body.
+
+    Game progress is keyed by playerId and status checks by id. Leaderboards
+    and analytics are not updated; run `manage.py rebuild-leaderboards` and
+    `manage.py rebuild-analytics` afterwards.
+    """
+    spec = transfer_collection(collection)
+    progress = collection == "game_progress"
+    try:
+        return await transfer.import_chunks(
+            None if progress else db[collection], spec.key, request.stream(), format, batch_size=batch_size,
+            on_written=invalidate_cached_progress if progress else None,
+            partitions=partitions if progress else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {format} stream: {e}")
 
 # Configure logging
 logging.basicConfig(
@@ -230,6 +1066,105 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def ensure_indexes():
+    await partitions.ensure_indexes()
+    # Keyset pagination of status checks, optionally per client
+    await db.status_checks.create_index([("timestamp", 1), ("id", 1)])
+    await db.status_checks.create_index([("client_name", 1), ("timestamp", 1), ("id", 1)])
+    await leaderboards.ensure_indexes()
+    if analytics is not None:
+        await analytics.ensure_indexes()
+    await status_retention.ensure_indexes()
+
+async def warm_pool(connections: int) -> None:
+    # Concurrent pings each check out a connection, opening up to `connections`
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(connections)))
+
+async def startup_checks() -> None:
+    global ready
+    started = time.monotonic()
+    await warm_pool(min(settings.mongo_warm_connections, settings.mongo_max_pool_size))
+    await ensure_indexes()
+    ready = True
+    logger.info("Connected to MongoDB in %.2fs", time.monotonic() - started)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global ready
+    connect(app.state.settings)
+    try:
+        await startup_checks()
+    except Exception:
+        # Stay up and report not ready rather than crash-looping the worker
+        logger.exception("MongoDB startup checks failed")
+    if write_buffer:
+        write_buffer.start()
+    if status_buffer:
+        status_buffer.start()
+    status_retention.start()
+    job_queue.start()
+    try:
+        yield
+    finally:
+        ready = False
+        # Sessions save their pending events, possibly into the write buffer
+        await session_manager.shutdown()
+        if write_buffer:
+            await write_buffer.stop()
+        # Then the follow-ups of every save, sessions' final ones included
+        await job_queue.stop(settings.job_drain_seconds)
+        if status_buffer:
+            await status_buffer.stop()
+        await status_retention.stop()
+        await leaderboards.stop()
+        partitions.close()
+        client.close()
+
+def create_app(app_settings: Optional[Settings] = None) -> FastAPI:
+    """Build the ASGI app; the database is connected when its lifespan starts"""
+    app_settings = app_settings or Settings.from_env()
+    app = FastAPI(lifespan=lifespan)
+    app.state.settings = app_settings
+    app.include_router(api_router)
+
+    # Progress documents are ~1 KB of repetitive JSON; GZIP_MINIMUM_SIZE=0 disables
+    if app_settings.gzip_minimum_size > 0:
+        app.add_middleware(GZipMiddleware, minimum_size=app_settings.gzip_minimum_size)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        # Browsers only let cross-origin scripts read headers listed here
+        expose_headers=["X-Next-Cursor", "ETag"],
+    )
+
+    # Opt-in request profiling (X-Profile: <PROFILE_TOKEN> or a sampling rate)
+    # and slow-request logging; with neither configured nothing is installed
+    if app_settings.profiling_enabled:
+        app.add_middleware(
+            ProfilingMiddleware,
+            profile_dir=app_settings.profile_dir,
+            token=app_settings.profile_token,
+            sample_rate=app_settings.profile_sample_rate,
+            interval=app_settings.profile_interval_ms / 1000,
+            slow_seconds=app_settings.slow_request_seconds,
+        )
+
+    # Outermost, so time spent in the other middleware is included
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+    metrics.register_routes(app.routes)
+    return app
+
+def __getattr__(name: str) -> Any:
+    # `server:app` is built from the environment on first access rather than
+    # at import, so manage.py, tests and benchmarks can import this module
+    # and build apps from their own Settings; `uvicorn --factory
+    # server:create_app` skips it altogether
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,387 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+import msgpack
+import orjson
+from fastapi import HTTPException, WebSocket
+from pydantic import ValidationError
+from starlette.websockets import WebSocketDisconnect, WebSocketState
+
+from models import GameProgressPatch, RunLog, StatIncrements, WorldPatch
+
+logger = logging.getLogger(__name__)
+
+# Frames waiting for a slow client; beyond this the oldest notices are dropped
+# (acks are coalesced and state is never queued, so nothing else is lost)
+OUTBOX_LIMIT = 64
+
+CLOSE_NORMAL = 1000
+CLOSE_SAVE_FAILED = 1011
+CLOSE_SERVICE_RESTART = 1012
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def _count(event: Dict[str, Any], default: int = 1) -> int:
+    n = event.get("n", default)
+    if not isinstance(n, int) or isinstance(n, bool) or n < 0:
+        raise ValueError("n must be a non-negative integer")
+    return n
+
+
+class SessionProgress:
+    """Events of one session merged into the progress patch they add up to.
+
+    Counters are summed and world results kept at their best (highest score,
+    fastest time, flags raised), so merging is order independent and a
+    snapshot that failed to save can be merged back into newer events.
+    Runs are kept to be verified with the patch; they back its world results.
+    """
+
+    __slots__ = ("events", "kills", "coins", "xp", "deaths", "worlds", "runs")
+
+    def __init__(self):
+        self.events = 0
+        self.kills = 0  # reported in the session summary; progress has no kill counter
+        self.coins = 0
+        self.xp = 0
+        self.deaths = 0
+        self.worlds: Dict[int, Dict[str, Any]] = {}
+        self.runs: List[RunLog] = []
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        """Merge one event; raises ValueError (leaving the state unchanged) for invalid ones"""
+        kind = event["t"]
+        if kind == "kill":
+            self.kills += _count(event)
+        elif kind == "death":
+            self.deaths += _count(event)
+        elif kind == "coins":
+            self.coins += _count(event, 0)
+        elif kind == "xp":
+            self.xp += _count(event, 0)
+        elif kind == "world":
+            self._merge_world(self._world_result(event))
+        elif kind == "run":
+            self.runs.append(self._run(event))
+        else:
+            raise ValueError(f"Unknown event type: {kind}")
+        self.events += 1
+
+    @staticmethod
+    def _world_result(event: Dict[str, Any]) -> Dict[str, Any]:
+        world_id = event.get("w")
+        if not isinstance(world_id, int) or world_id < 1:
+            raise ValueError("w must be a world id")
+        result: Dict[str, Any] = {"worldId": world_id}
+        score, best_time = event.get("s"), event.get("ms")
+        if score is not None:
+            if not isinstance(score, int) or score < 0:
+                raise ValueError("s must be a non-negative score")
+            result["highScore"] = score
+        if best_time is not None:
+            if not isinstance(best_time, int) or best_time <= 0:
+                raise ValueError("ms must be a positive time")
+            result["bestTime"] = best_time
+        if event.get("c"):
+            result["completed"] = True
+        if event.get("u"):
+            result["unlocked"] = True
+        return result
+
+    @staticmethod
+    def _run(event: Dict[str, Any]) -> RunLog:
+        try:
+            return RunLog(
+                worldId=event.get("w"),
+                elapsedMs=event.get("ms"),
+                attacks=event.get("a") or {},
+                kills=event.get("k", 0),
+                bossDefeated=bool(event.get("b")),
+                score=event.get("s", 0),
+            )
+        except ValidationError as e:
+            raise ValueError(f"Invalid run: {e.errors()[0]['loc'][0]} {e.errors()[0]['msg']}")
+
+    def drop_results(self) -> None:
+        """Forget world results and runs, keeping the counters"""
+        self.worlds.clear()
+        self.runs.clear()
+
+    def _merge_world(self, result: Dict[str, Any]) -> None:
+        world = self.worlds.setdefault(result["worldId"], {"worldId": result["worldId"]})
+        for field in ("unlocked", "completed"):
+            if result.get(field):
+                world[field] = True
+        if "highScore" in result:
+            world["highScore"] = max(world.get("highScore", 0), result["highScore"])
+        if "bestTime" in result:
+            world["bestTime"] = min(world.get("bestTime", result["bestTime"]), result["bestTime"])
+
+    def merge(self, other: "SessionProgress") -> None:
+        self.events += other.events
+        self.kills += other.kills
+        self.coins += other.coins
+        self.xp += other.xp
+        self.deaths += other.deaths
+        for world in other.worlds.values():
+            self._merge_world(world)
+        self.runs.extend(other.runs)
+
+    def to_patch(self) -> Optional[GameProgressPatch]:
+        """The patch to persist, or None when nothing stored would change"""
+        if not (self.coins or self.xp or self.deaths or self.worlds):
+            return None
+        return GameProgressPatch(
+            increment=StatIncrements(coins=self.coins, xp=self.xp, deathCount=self.deaths),
+            worlds=[WorldPatch(**world) for world in self.worlds.values()],
+            runs=self.runs or None,
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        return {"events": self.events, "kills": self.kills, "coins": self.coins, "xp": self.xp, "deaths": self.deaths}
+
+
+class ProgressSession:
+    """One client's run streamed over a WebSocket.
+
+    Client frames are JSON text or MessagePack binary objects; replies use
+    the encoding of the client's latest frame. Events carry a type `t`, an
+    optional sequence number `i` and compact fields:
+
+        {"i": 1, "t": "kill", "n": 3}          {"i": 2, "t": "coins", "n": 25}
+        {"i": 3, "t": "xp", "n": 40}           {"i": 4, "t": "death"}
+        {"i": 5, "t": "world", "w": 2, "s": 18000, "ms": 241000, "c": 1}
+        {"i": 6, "t": "run", "w": 2, "ms": 241000, "a": {"hold_1": 31}, "k": 40, "b": 1, "s": 18000}
+        {"t": "checkpoint"}                    {"t": "end"}
+
+    The server replies with `ready`, cumulative `ack`s (coalesced when events
+    arrive faster than they are acknowledged), `saved` with the last sequence number persisted, `error` for
+    rejected events or failed saves, and a final `end` summary. Events are
+    merged in memory and persisted as one progress patch every
+    `checkpoint_interval` seconds, on `checkpoint`, and when the session
+    ends. After `max_unsaved_events` unsaved events the server stops reading
+    until they are saved, which pushes back on the client through the socket.
+    A client that loses its connection should resend, in a new session, the
+    events after the last `saved` sequence number.
+
+    A `run` summarizes a played run (world, elapsed ms, attacks fired by
+    move id, kills, boss defeated, score) and is verified with the next
+    save like the runs of PATCH; with run verification on, a better score or
+    time from a `world` event only counts when a run of the session backs
+    it. When the server rejects a save's results (422), they are dropped
+    and the session's counters are saved without them.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        player_id: str,
+        persist: Callable[[GameProgressPatch], Awaitable[Dict[str, Any]]],
+        checkpoint_interval: float = 30.0,
+        max_unsaved_events: int = 1000,
+        idle_timeout: float = 300.0,
+    ):
+        self.websocket = websocket
+        self.player_id = player_id
+        self.persist = persist
+        self.checkpoint_interval = checkpoint_interval
+        self.max_unsaved_events = max_unsaved_events
+        self.idle_timeout = idle_timeout
+
+        self.pending = SessionProgress()
+        self.totals = SessionProgress()
+        self.received_seq = 0
+        self.saved_seq = 0
+        self.close_code = CLOSE_NORMAL
+        self._checkpoint_lock = asyncio.Lock()
+        self._outbox: Deque[Dict[str, Any]] = deque(maxlen=OUTBOX_LIMIT)
+        self._wake = asyncio.Event()
+        self._acked = 0
+        self._binary = False
+        self._closing = False
+        self._stopping = False
+        self._receiving = False
+        self._reader: Optional[asyncio.Task] = None
+
+    async def run(self) -> None:
+        self._reader = asyncio.current_task()
+        writer = asyncio.create_task(self._write_loop())
+        ticker = asyncio.create_task(self._checkpoint_loop())
+        self._send({"t": "ready", "checkpointSeconds": self.checkpoint_interval, "maxUnsaved": self.max_unsaved_events})
+        try:
+            await self._read_loop()
+        finally:
+            ticker.cancel()
+            await self.checkpoint()
+            self._send({"t": "end", "saved": self.saved_seq, **self.totals.summary()})
+            self._closing = True
+            self._wake.set()
+            try:
+                await asyncio.wait_for(writer, timeout=5)
+            except asyncio.TimeoutError:
+                pass
+            if self.websocket.application_state == WebSocketState.CONNECTED:
+                try:
+                    await self.websocket.close(code=self.close_code)
+                except (RuntimeError, OSError):
+                    pass
+
+    def stop(self) -> None:
+        """End the session from outside (server shutdown); pending events are saved"""
+        self._stopping = True
+        self.close_code = CLOSE_SERVICE_RESTART
+        if self._receiving and self._reader is not None:
+            self._reader.cancel()
+
+    async def _receive(self) -> Optional[Dict[str, Any]]:
+        self._receiving = True
+        try:
+            return await asyncio.wait_for(self.websocket.receive(), self.idle_timeout)
+        except asyncio.TimeoutError:
+            return None
+        except asyncio.CancelledError:
+            if not self._stopping:
+                raise
+            asyncio.current_task().uncancel()
+            return None
+        finally:
+            self._receiving = False
+
+    async def _read_loop(self) -> None:
+        while not self._stopping:
+            message = await self._receive()
+            if message is None or message["type"] == "websocket.disconnect":
+                return
+            seq = None
+            try:
+                event = self._decode(message)
+                if event["t"] == "end":
+                    return
+                if event["t"] == "checkpoint":
+                    await self.checkpoint()
+                    continue
+                seq = event.get("i", self.received_seq + 1)
+                if not isinstance(seq, int) or isinstance(seq, bool):
+                    raise ValueError("i must be an integer")
+                self.pending.apply(event)
+            except ValueError as e:
+                self._send({"t": "error", "i": seq, "detail": str(e)})
+                continue
+            self.totals.apply(event)
+            self.received_seq = seq
+            self._wake.set()
+
+            # Backpressure: stop reading until the unsaved events are persisted
+            if self.pending.events >= self.max_unsaved_events and not await self.checkpoint():
+                self.close_code = CLOSE_SAVE_FAILED
+                return
+
+    def _decode(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            if message.get("bytes") is not None:
+                self._binary = True
+                event = msgpack.unpackb(message["bytes"], raw=False)
+            else:
+                self._binary = False
+                event = orjson.loads(message.get("text") or "")
+        except (ValueError, msgpack.UnpackException) as e:
+            raise ValueError(f"Undecodable frame: {e}")
+        if not isinstance(event, dict) or not isinstance(event.get("t"), str):
+            raise ValueError("Events must be objects with a type t")
+        return event
+
+    async def checkpoint(self) -> bool:
+        """Persist the events merged so far; False if the save failed (they are kept)"""
+        async with self._checkpoint_lock:
+            snapshot, seq = self.pending, self.received_seq
+            if seq == self.saved_seq:
+                return True
+            self.pending = SessionProgress()
+            patch = snapshot.to_patch()
+            try:
+                version = (await self.persist(patch))["version"] if patch is not None else None
+            except Exception as e:
+                if isinstance(e, HTTPException) and e.status_code == 422:
+                    # Rejected runs or results would fail every retry
+                    snapshot.drop_results()
+                # Events that arrived meanwhile are in self.pending; put these back with them
+                self.pending.merge(snapshot)
+                detail = e.detail if isinstance(e, HTTPException) else "Could not save progress"
+                if not isinstance(e, HTTPException):
+                    logger.exception("Failed to save session progress for %s", self.player_id)
+                self._send({"t": "error", "detail": detail})
+                return False
+            self.saved_seq = seq
+            self._send({"t": "saved", "i": seq, "v": version})
+            return True
+
+    async def _checkpoint_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            # Shielded: cancelling the ticker must not abandon a save half way
+            await asyncio.shield(self.checkpoint())
+
+    def _send(self, frame: Dict[str, Any]) -> None:
+        self._outbox.append(frame)
+        self._wake.set()
+
+    async def _write_loop(self) -> None:
+        try:
+            while True:
+                await self._wake.wait()
+                self._wake.clear()
+                while self._outbox:
+                    frame = self._outbox.popleft()
+                    # Notices go out after the ack covering the events they follow
+                    await self._send_ack()
+                    await self._send_frame(frame)
+                await self._send_ack()
+                if self._closing and not self._outbox:
+                    return
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            return  # the client went away; the reader sees the disconnect
+
+    async def _send_ack(self) -> None:
+        if self._acked != self.received_seq:
+            self._acked = self.received_seq
+            await self._send_frame({"t": "ack", "i": self._acked})
+
+    async def _send_frame(self, frame: Dict[str, Any]) -> None:
+        if self._binary:
+            await self.websocket.send_bytes(msgpack.packb(frame))
+        else:
+            await self.websocket.send_text(orjson.dumps(frame).decode())
+
+
+class SessionManager:
+    """The sessions of one worker, capped at `max_sessions`"""
+
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        self.sessions: Set[ProgressSession] = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def full(self) -> bool:
+        return len(self.sessions) >= self.max_sessions
+
+    async def run(self, session: ProgressSession) -> None:
+        self.sessions.add(session)
+        self._idle.clear()
+        try:
+            await session.run()
+        finally:
+            self.sessions.discard(session)
+            if not self.sessions:
+                self._idle.set()
+
+    async def shutdown(self, timeout: float = 10.0) -> None:
+        """Stop every session and wait for their final checkpoints"""
+        for session in list(self.sessions):
+            session.stop()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%d sessions still open at shutdown", len(self.sessions))
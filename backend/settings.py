@@ -0,0 +1,123 @@
+import os
+from pathlib import Path
+from typing import Any, Dict, Literal, Mapping, Optional
+
+from pydantic import BaseModel
+
+ROOT_DIR = Path(__file__).parent
+
+
+class Settings(BaseModel):
+    """Server configuration.
+
+    Every field is read by `from_env` from the environment variable of the
+    same name in upper case (MONGO_URL, PROGRESS_CACHE_SIZE, ...). Mongo
+    options left unset fall back to the driver's defaults.
+    """
+
+    mongo_url: str
+    db_name: str
+
+    # Connection pool, timeouts and consistency (pymongo.MongoClient options)
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_max_idle_time_ms: Optional[int] = None
+    mongo_connect_timeout_ms: Optional[int] = None
+    mongo_server_selection_timeout_ms: Optional[int] = None
+    mongo_socket_timeout_ms: Optional[int] = None
+    mongo_wait_queue_timeout_ms: Optional[int] = None
+    mongo_read_preference: Literal["primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"] = "primary"
+    mongo_write_concern: Optional[str] = None  # "majority" or a number of members
+    mongo_journal: Optional[bool] = None
+    # Connections opened at startup so the first requests do not pay for them
+    mongo_warm_connections: int = 10
+    readiness_timeout_seconds: float = 2.0
+
+    gzip_minimum_size: int = 500  # bytes; 0 disables response compression
+
+    # Player progress partitions, `name=database` or `name=mongodb://host/database`
+    # separated by `;` (see partitions.parse_partitions); unset keeps all
+    # players in DB_NAME. Set PROGRESS_PARTITIONS_MIGRATING while
+    # `manage.py rebalance-partitions` runs after adding partitions.
+    progress_partitions: Optional[str] = None
+    progress_partitions_migrating: bool = False
+
+    # The progress cache lives in each worker's memory: behind a load balancer
+    # a save on one worker leaves the others serving (and answering 304 for)
+    # the old document for up to the TTL. Off unless the server runs as a
+    # single worker or is given a shared CacheBackend.
+    progress_cache_size: int = 0  # 0 disables the cache
+    progress_cache_ttl_seconds: float = 30.0
+    leaderboard_refresh_seconds: float = 300.0
+    leaderboard_top_size: int = 1000  # players per world kept in each worker's memory
+    run_verification: Literal["off", "flag", "reject"] = "flag"
+    analytics_enabled: bool = True
+    analytics_cache_seconds: float = 60.0
+
+    # Background jobs for the follow-ups of saves (leaderboards, analytics);
+    # JOB_WORKERS=0 runs them inline before the response instead
+    job_workers: int = 4
+    job_queue_size: int = 10000
+    job_overflow: Literal["shed", "block"] = "shed"  # when the queue is full
+    job_block_timeout_seconds: float = 1.0
+    job_max_attempts: int = 5
+    job_drain_seconds: float = 10.0  # at shutdown
+
+    # WebSocket run sessions (/api/game/session/{player_id}), per worker
+    session_max_concurrent: int = 1000
+    session_checkpoint_seconds: float = 30.0
+    session_max_unsaved_events: int = 1000
+    session_idle_timeout_seconds: float = 300.0
+
+    # Raw status checks are compacted into per-client minute and hour buckets
+    # and then expire; 0 keeps them forever (retention) or stops compacting
+    status_retention_seconds: int = 7 * 86400
+    status_minute_bucket_retention_seconds: int = 30 * 86400
+    status_compaction_interval_seconds: float = 60.0
+    status_compaction_lag_seconds: float = 120.0  # allowance for late inserts
+    status_write_behind: bool = False
+    status_flush_interval_seconds: float = 1.0
+    status_buffer_max: int = 10000
+
+    progress_write_behind: bool = False
+    progress_flush_interval_seconds: float = 2.0
+    progress_flush_max_pending: int = 500
+
+    # Bearer token for the /api/admin endpoints; unset disables them
+    admin_token: Optional[str] = None
+
+    profile_token: Optional[str] = None
+    profile_sample_rate: float = 0.0
+    profile_interval_ms: float = 2.0
+    profile_dir: Path = ROOT_DIR / "profiles"
+    slow_request_seconds: float = 0.0
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> "Settings":
+        return cls(**{
+            name: environ[name.upper()]
+            for name in cls.model_fields
+            if environ.get(name.upper())
+        })
+
+    @property
+    def profiling_enabled(self) -> bool:
+        return bool(self.profile_token or self.profile_sample_rate > 0 or self.slow_request_seconds > 0)
+
+    def client_options(self) -> Dict[str, Any]:
+        """Keyword arguments for AsyncIOMotorClient"""
+        options: Dict[str, Any] = {
+            "maxPoolSize": self.mongo_max_pool_size,
+            "minPoolSize": self.mongo_min_pool_size,
+            "maxIdleTimeMS": self.mongo_max_idle_time_ms,
+            "connectTimeoutMS": self.mongo_connect_timeout_ms,
+            "serverSelectionTimeoutMS": self.mongo_server_selection_timeout_ms,
+            "socketTimeoutMS": self.mongo_socket_timeout_ms,
+            "waitQueueTimeoutMS": self.mongo_wait_queue_timeout_ms,
+            "readPreference": self.mongo_read_preference,
+            "journal": self.mongo_journal,
+        }
+        if self.mongo_write_concern is not None:
+            w = self.mongo_write_concern
+            options["w"] = int(w) if w.isdigit() else w
+        return {name: value for name, value in options.items() if value is not None}
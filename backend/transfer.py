@@ -0,0 +1,318 @@
+import asyncio
+import json
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Union
+
+import bson
+import orjson
+from bson import json_util
+from bson.errors import InvalidBSON
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+FORMATS = ("ndjson", "bson")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "bson": "application/bson"}
+# Relaxed Extended JSON: plain numbers and strings, with $oid/$date wrappers
+# so ObjectIds and datetimes come back as the same types on import
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+GZIP_MAGIC = b"\x1f\x8b"
+GZIP_WBITS = 31  # zlib window bits for a gzip container
+
+
+class CollectionSpec(NamedTuple):
+    key: str  # field imports upsert on; unique per document
+    time_field: str  # field incremental exports filter on
+
+
+COLLECTIONS = {
+    "game_progress": CollectionSpec(key="playerId", time_field="updatedAt"),
+    "status_checks": CollectionSpec(key="id", time_field="timestamp"),
+}
+
+
+def time_filter(spec: CollectionSpec, since: Optional[datetime] = None, until: Optional[datetime] = None) -> Dict[str, Any]:
+    """Query for documents with since <= time_field < until"""
+    bounds: Dict[str, Any] = {}
+    if since is not None:
+        bounds["$gte"] = since
+    if until is not None:
+        bounds["$lt"] = until
+    return {spec.time_field: bounds} if bounds else {}
+
+
+def _extended_json(value: Any) -> Any:
+    return json_util.default(value, JSON_OPTIONS)
+
+
+def _extended_json_hook(obj: Dict[str, Any]) -> Any:
+    # Only wrappers ({"$oid": ...}, {"$date": ...}) need json_util's checks
+    for name in obj:
+        if name[:1] == "$":
+            return json_util.object_hook(obj, JSON_OPTIONS)
+        break
+    return obj
+
+
+def encode_documents(docs: Iterable[Dict[str, Any]], fmt: str) -> bytes:
+    """One line of Extended JSON per document, or concatenated BSON documents
+    (the layout mongodump writes and bsondump reads).
+
+    orjson writes the plain JSON and calls back into json_util only for BSON
+    types (ObjectId, datetime, ...), which is what json_util.dumps would
+    produce for them, ~15x faster.
+    """
+    if fmt == "bson":
+        return b"".join(bson.encode(doc) for doc in docs)
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_APPEND_NEWLINE
+    return b"".join(orjson.dumps(doc, default=_extended_json, option=options) for doc in docs)
+
+
+async def _read_batches(collection, query: Dict[str, Any], batch_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    async for doc in collection.find(query).batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _merge(sources: Sequence[AsyncIterator[Any]]) -> AsyncIterator[Any]:
+    """Items of several async iterators in the order they are produced.
+
+    The sources are read concurrently, each at most one item ahead of the
+    consumer, so a slow consumer holds back all of them.
+    """
+    if len(sources) == 1:
+        async for item in sources[0]:
+            yield item
+        return
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=len(sources))
+    done = object()
+
+    async def pump(source: AsyncIterator[Any]) -> None:
+        try:
+            async for item in source:
+                await queue.put((item, None))
+        except Exception as e:
+            await queue.put((None, e))
+        else:
+            await queue.put((done, None))
+
+    tasks = [asyncio.create_task(pump(source)) for source in sources]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                remaining -= 1
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def export_chunks(
+    collection: Union[Any, Sequence[Any]],
+    fmt: str,
+    query: Optional[Dict[str, Any]] = None,
+    batch_size: int = 1000,
+    compress: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+) -> AsyncIterator[bytes]:
+    """Stream the matching documents of `collection` as encoded chunks.
+
+    Documents are read in cursor batches of `batch_size` and each batch is
+    encoded (and gzipped, with `compress`) into one chunk, so memory stays
+    at one batch however large the collection is. A list of collections
+    (partitions) is read concurrently, their batches interleaved. Counts of
+    documents and bytes yielded are kept in `stats` as the stream is
+    consumed.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    stats = stats if stats is not None else {}
+    stats.setdefault("documents", 0)
+    stats.setdefault("bytes", 0)
+    compressor = zlib.compressobj(wbits=GZIP_WBITS) if compress else None
+
+    def output(data: bytes) -> bytes:
+        if compressor is not None:
+            data = compressor.compress(data)
+        stats["bytes"] += len(data)
+        return data
+
+    collections = collection if isinstance(collection, (list, tuple)) else [collection]
+    async for batch in _merge([_read_batches(source, query or {}, batch_size) for source in collections]):
+        stats["documents"] += len(batch)
+        chunk = output(encode_documents(batch, fmt))
+        if chunk:
+            yield chunk
+    if compressor is not None:
+        tail = compressor.flush()
+        stats["bytes"] += len(tail)
+        yield tail
+
+
+class DocumentDecoder:
+    """Incremental decoder for exported streams.
+
+    Chunks can be split anywhere, including inside a document; whatever is
+    incomplete is kept until the next `feed`. Gzipped input is recognised
+    by its magic bytes and decompressed on the fly. Malformed input raises
+    ValueError.
+    """
+
+    def __init__(self, fmt: str):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format: {fmt}")
+        self.fmt = fmt
+        self._head = b""  # raw bytes held until gzip detection is possible
+        self._detected = False
+        self._decompressor = None
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        if not self._detected:
+            self._head += data
+            if len(self._head) < len(GZIP_MAGIC):
+                return []
+            data, self._head = self._head, b""
+            self._detected = True
+            if data.startswith(GZIP_MAGIC):
+                self._decompressor = zlib.decompressobj(wbits=GZIP_WBITS)
+        if self._decompressor is not None:
+            data = self._decompress(data)
+        self._buffer += data
+        return self._drain()
+
+    def close(self) -> List[Dict[str, Any]]:
+        """Decode what is left at the end of the stream"""
+        if not self._detected:
+            self._detected = True
+            self._buffer += self._head
+        elif self._decompressor is not None:
+            self._buffer += self._decompress(b"", flush=True)
+            if not self._decompressor.eof:
+                raise ValueError("Truncated gzip stream")
+        docs = self._drain()
+        if self.fmt == "ndjson" and self._buffer.strip():
+            docs.append(self._decode_line(bytes(self._buffer)))
+        elif self._buffer:
+            raise ValueError(f"Truncated BSON document ({len(self._buffer)} trailing bytes)")
+        self._buffer.clear()
+        return docs
+
+    def _decompress(self, data: bytes, flush: bool = False) -> bytes:
+        try:
+            return self._decompressor.flush() if flush else self._decompressor.decompress(data)
+        except zlib.error as e:
+            raise ValueError(f"Invalid gzip stream: {e}")
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        buffer = self._buffer
+        if self.fmt == "ndjson":
+            end = buffer.rfind(b"\n")
+            if end < 0:
+                return []
+            lines = bytes(buffer[:end]).split(b"\n")
+            del buffer[:end + 1]
+            return [self._decode_line(line) for line in lines if line.strip()]
+
+        # Find the complete documents by their length prefixes, then decode
+        # them in one call
+        offset = 0
+        while len(buffer) - offset >= 4:
+            size = int.from_bytes(buffer[offset:offset + 4], "little")
+            if size < 5:
+                raise ValueError(f"Invalid BSON document length {size}")
+            if len(buffer) - offset < size:
+                break
+            offset += size
+        if not offset:
+            return []
+        try:
+            docs = bson.decode_all(bytes(buffer[:offset]))
+        except InvalidBSON as e:
+            raise ValueError(f"Invalid BSON document: {e}")
+        del buffer[:offset]
+        return docs
+
+    @staticmethod
+    def _decode_line(line: bytes) -> Dict[str, Any]:
+        doc = json.loads(line, object_hook=_extended_json_hook)
+        if not isinstance(doc, dict):
+            raise ValueError("Each NDJSON line must be a JSON object")
+        return doc
+
+
+def upsert_operations(docs: Iterable[Dict[str, Any]], key: str) -> List[UpdateOne]:
+    """Upserts keyed by `key`; an exported `_id` is kept for new documents
+    and never rewritten on existing ones (it is immutable)"""
+    operations = []
+    for doc in docs:
+        fields = {name: value for name, value in doc.items() if name != "_id"}
+        update: Dict[str, Any] = {"$set": fields}
+        if "_id" in doc:
+            update["$setOnInsert"] = {"_id": doc["_id"]}
+        operations.append(UpdateOne({key: doc[key]}, update, upsert=True))
+    return operations
+
+
+async def import_chunks(
+    collection,
+    key: str,
+    chunks: AsyncIterable[bytes],
+    fmt: str,
+    batch_size: int = 1000,
+    on_written: Optional[Callable[[List[Any]], Awaitable[None]]] = None,
+    partitions=None,
+) -> Dict[str, int]:
+    """Upsert the documents of an exported stream into `collection`.
+
+    Documents are decoded as chunks arrive and written in unordered bulk
+    upserts of `batch_size`, so memory stays at one batch plus one chunk.
+    Documents without `key` are counted as skipped; write errors are counted
+    and the import carries on. `on_written` receives the keys of each batch.
+    With `partitions` (a PartitionRouter) each document is written to the
+    partition its key routes to rather than to `collection`.
+    """
+    decoder = DocumentDecoder(fmt)
+    stats = {"documents": 0, "inserted": 0, "updated": 0, "skipped": 0, "errors": 0}
+    pending: List[Dict[str, Any]] = []
+
+    async def write(docs: List[Dict[str, Any]]) -> None:
+        valid = [doc for doc in docs if doc.get(key) is not None]
+        stats["documents"] += len(docs)
+        stats["skipped"] += len(docs) - len(valid)
+        if not valid:
+            return
+        operations = upsert_operations(valid, key)
+        if partitions is not None:
+            details = await partitions.bulk_write([(doc[key], op) for doc, op in zip(valid, operations)])
+        else:
+            try:
+                details = (await collection.bulk_write(operations, ordered=False)).bulk_api_result
+            except BulkWriteError as e:
+                details = e.details
+        stats["errors"] += len(details.get("writeErrors", []))
+        stats["inserted"] += details.get("nUpserted", 0)
+        stats["updated"] += details.get("nModified", 0)
+        if on_written is not None:
+            await on_written([doc[key] for doc in valid])
+
+    async for chunk in chunks:
+        pending.extend(decoder.feed(chunk))
+        while len(pending) >= batch_size:
+            await write(pending[:batch_size])
+            del pending[:batch_size]
+    pending.extend(decoder.close())
+    for start in range(0, len(pending), batch_size):
+        await write(pending[start:start + batch_size])
+    return stats
@@ -0,0 +1,173 @@
+from typing import Any, Dict, Iterable, List, NamedTuple, Sequence
+
+import numpy as np
+
+from catalog import MoveCatalog
+from models import RunLog
+
+# Game rules the bounds are derived from; keep in sync with the client
+# (components/game/GameEngine.tsx and GameSystem.tsx). The bounds are
+# deliberately generous: they catch impossible runs, not unlikely ones.
+BOSS_SPAWN_MS = 300_000  # GameEngine spawns the boss at gameTime >= 300 s
+
+# The weakest enemy is the Fire Imp, whose health the two game loops define
+# differently: 30 + 5 * worldId in GameSystem, floor(30 * (1 + 0.3 *
+# (worldId - 1))) in GameEngine. Kills are bounded with the lower of the two.
+FIRE_IMP_HEALTH = 30
+FIRE_IMP_HEALTH_PER_WORLD = 5  # GameSystem
+FIRE_IMP_HEALTH_GROWTH = 0.3  # GameEngine, per world after the first
+
+# The client has no area damage yet (a projectile stops at the first enemy
+# it hits); this allows for hold moves that sweep several enemies.
+MAX_TARGETS_PER_HIT = 3
+
+# The client computes no score (GameUI is passed 0), so there is no formula
+# to mirror. Until there is, a run may score at most this allowance for the
+# damage it could deal, its kills and the boss.
+POINTS_PER_DAMAGE = 1
+POINTS_PER_KILL_BASE = 100  # per kill, plus POINTS_PER_KILL_PER_WORLD * worldId
+POINTS_PER_KILL_PER_WORLD = 20
+BOSS_POINTS_PER_WORLD = 5000
+
+# Reasons a run was rejected, as bit flags
+UNKNOWN_MOVE = 1
+FIRE_RATE = 2
+TOO_MANY_KILLS = 4
+EARLY_BOSS = 8
+SCORE_TOO_HIGH = 16
+
+REASONS = {
+    UNKNOWN_MOVE: "used a move that does not exist",
+    FIRE_RATE: "fired a move faster than its cooldown allows",
+    TOO_MANY_KILLS: "killed more enemies than the damage dealt allows",
+    EARLY_BOSS: "defeated the boss before it could appear",
+    SCORE_TOO_HIGH: "scored more than the run could earn",
+}
+# Reason for a saved best that no possible run of the save achieved
+UNVERIFIED_RESULT = "improved a best without a verified run to back it"
+
+
+class RunVerdicts(NamedTuple):
+    flags: np.ndarray  # int, one bit per reason, 0 when the run is possible
+    max_damage: np.ndarray  # most damage the run's attacks could have dealt
+    score_cap: np.ndarray  # highest score the run could have earned
+
+    @property
+    def ok(self) -> np.ndarray:
+        return self.flags == 0
+
+    def reasons(self, index: int) -> List[str]:
+        flags = int(self.flags[index])
+        return [reason for flag, reason in REASONS.items() if flags & flag]
+
+
+class RunVerifier:
+    """Bounds submitted runs using the move catalog's damage and cooldowns.
+
+    A run reports how often each move was fired, the kills, the elapsed time
+    and the score. From the cooldowns we know how often each move could have
+    been fired, from that the most damage the run could have dealt, and from
+    that how many kills and points were reachable. All runs of a batch are
+    checked together as arrays, so verifying thousands costs a few matrix
+    operations rather than a Python loop per rule.
+    """
+
+    def __init__(self, catalog: MoveCatalog):
+        self.move_index = {move.id: i for i, move in enumerate(catalog.moves)}
+        self.damage = np.array([move.damage for move in catalog.moves], dtype=np.int64)
+        self.cooldown = np.array([max(move.cooldown, 1) for move in catalog.moves], dtype=np.int64)
+
+    def verify(self, runs: Sequence[RunLog]) -> RunVerdicts:
+        count = len(runs)
+        fired = np.zeros((count, len(self.move_index)), dtype=np.int64)
+        flags = np.zeros(count, dtype=np.int64)
+
+        # Scatter the sparse per-run attack counts into a dense matrix
+        for row, run in enumerate(runs):
+            for move_id, times in run.attacks.items():
+                column = self.move_index.get(move_id)
+                if column is None:
+                    flags[row] |= UNKNOWN_MOVE
+                else:
+                    fired[row, column] = times
+
+        world = np.fromiter((run.worldId for run in runs), dtype=np.int64, count=count)
+        elapsed = np.fromiter((run.elapsedMs for run in runs), dtype=np.int64, count=count)
+        kills = np.fromiter((run.kills for run in runs), dtype=np.int64, count=count)
+        score = np.fromiter((run.score for run in runs), dtype=np.int64, count=count)
+        boss = np.fromiter((run.bossDefeated for run in runs), dtype=bool, count=count)
+
+        # A move is ready at the start and then once per cooldown
+        max_fired = elapsed[:, None] // self.cooldown[None, :] + 1
+        flags |= np.where((fired > max_fired).any(axis=1), FIRE_RATE, 0)
+
+        max_damage = np.minimum(fired, max_fired) @ self.damage
+        min_enemy_health = np.minimum(
+            FIRE_IMP_HEALTH + FIRE_IMP_HEALTH_PER_WORLD * world,
+            np.floor(FIRE_IMP_HEALTH * (1 + (world - 1) * FIRE_IMP_HEALTH_GROWTH)).astype(np.int64),
+        )
+        flags |= np.where(kills * min_enemy_health > max_damage * MAX_TARGETS_PER_HIT, TOO_MANY_KILLS, 0)
+        flags |= np.where(boss & (elapsed < BOSS_SPAWN_MS), EARLY_BOSS, 0)
+
+        score_cap = (
+            max_damage * MAX_TARGETS_PER_HIT * POINTS_PER_DAMAGE
+            + kills * (POINTS_PER_KILL_BASE + POINTS_PER_KILL_PER_WORLD * world)
+            + boss * BOSS_POINTS_PER_WORLD * world
+        )
+        flags |= np.where(score > score_cap, SCORE_TOO_HIGH, 0)
+
+        return RunVerdicts(flags=flags, max_damage=max_damage, score_cap=score_cap)
+
+
+def verified_bests(runs: Sequence[RunLog], verdicts: RunVerdicts) -> Dict[int, Dict[str, int]]:
+    """Per world, the highest score and the fastest boss kill among the possible runs"""
+    bests: Dict[int, Dict[str, int]] = {}
+    for index in np.flatnonzero(verdicts.ok):
+        run = runs[index]
+        best = bests.setdefault(run.worldId, {})
+        best["highScore"] = max(best.get("highScore", 0), run.score)
+        if run.bossDefeated and run.elapsedMs > 0:
+            best["bestTime"] = min(best.get("bestTime", run.elapsedMs), run.elapsedMs)
+    return bests
+
+
+def unbacked_claims(worlds: Iterable[Dict[str, Any]], bests: Dict[int, Dict[str, int]]) -> List[Dict[str, Any]]:
+    """World results of a save better than any of its possible runs achieved.
+
+    Such a result is only legitimate if it improves nothing, i.e. the player
+    already holds it (see `unverified_results`). Each claim names the world,
+    the field, the claimed value and what the runs back (None for a time no
+    run backs).
+    """
+    claims = []
+    for world in worlds:
+        best = bests.get(world["worldId"], {})
+        score = world.get("highScore")
+        if score and score > best.get("highScore", 0):
+            claims.append({"worldId": world["worldId"], "field": "highScore", "claimed": score, "backed": best.get("highScore", 0)})
+        time = world.get("bestTime")
+        if time and (best.get("bestTime") is None or time < best["bestTime"]):
+            claims.append({"worldId": world["worldId"], "field": "bestTime", "claimed": time, "backed": best.get("bestTime")})
+    return claims
+
+
+def unverified_results(claims: Iterable[Dict[str, Any]], stored: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The claims that improve on the `stored` worlds.
+
+    Each entry names the world and field, the claimed value and the best
+    the player is entitled to (`allowed`; None for a time nothing backs).
+    """
+    stored_worlds = {world["worldId"]: world for world in stored}
+    unverified = []
+    for claim in claims:
+        previous = stored_worlds.get(claim["worldId"], {}).get(claim["field"]) or None
+        if claim["field"] == "highScore":
+            allowed = max(previous or 0, claim["backed"])
+            improves = claim["claimed"] > allowed
+        else:
+            times = [t for t in (previous, claim["backed"]) if t]
+            allowed = min(times) if times else None
+            improves = allowed is None or claim["claimed"] < allowed
+        if improves:
+            unverified.append({"worldId": claim["worldId"], "field": claim["field"], "claimed": claim["claimed"], "allowed": allowed})
+    return unverified
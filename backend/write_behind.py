@@ -0,0 +1,298 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+class PendingWrite:
+    """Merged, not yet persisted changes for one player"""
+
+    __slots__ = ("set_fields", "inc_fields")
+
+    def __init__(self):
+        self.set_fields: Dict[str, Any] = {}
+        self.inc_fields: Dict[str, int] = {}
+
+    def merge(self, set_fields: Dict[str, Any], inc_fields: Dict[str, int]) -> None:
+        # Later values win, counters accumulate
+        self.set_fields.update(set_fields)
+        for field, amount in inc_fields.items():
+            self.inc_fields[field] = self.inc_fields.get(field, 0) + amount
+
+    def to_update(self) -> Dict[str, Any]:
+        update: Dict[str, Any] = {}
+        if self.set_fields:
+            update["$set"] = self.set_fields
+        if self.inc_fields:
+            update["$inc"] = self.inc_fields
+        return update
+
+    def apply_to(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy of `doc` as it will look once this write is flushed"""
+        doc = dict(doc)
+        for path, value in self.set_fields.items():
+            parent, key = _parent_for(doc, path)
+            parent[key] = value
+        for path, amount in self.inc_fields.items():
+            parent, key = _parent_for(doc, path)
+            parent[key] = (parent.get(key) or 0) + amount
+        return doc
+
+
+def _parent_for(doc: Dict[str, Any], path: str):
+    """Resolve a dotted path, copying nested dicts so `doc`'s source is untouched"""
+    *parents, key = path.split(".")
+    for part in parents:
+        doc[part] = dict(doc.get(part) or {})
+        doc = doc[part]
+    return doc, key
+
+
+class WriteBehindBuffer:
+    """Coalesces high-frequency progress saves and persists them in batches.
+
+    Saves for the same player are merged in memory and written with one
+    unordered bulk_write when the flush interval elapses, when
+    `max_pending` players are waiting, or when a flush is requested
+    explicitly (checkpoints, shutdown). Readers must go through `overlay`
+    so they see buffered state that has not reached Mongo yet.
+
+    `on_flushed` is awaited with the flushed player ids while their writes
+    are still visible through `overlay`, so copies of the stored documents
+    held elsewhere (caches) can be dropped without a window of stale reads.
+
+    Writes go to each player's partition of `partitions` (a PartitionRouter),
+    one bulk write per partition, concurrently; a partition that fails keeps
+    only its own players buffered.
+    """
+
+    def __init__(
+        self,
+        partitions,
+        flush_interval: float = 2.0,
+        max_pending: int = 500,
+        on_flushed: Optional[Callable[[List[str]], Awaitable[None]]] = None,
+    ):
+        self.partitions = partitions
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.on_flushed = on_flushed
+        self._pending: Dict[str, PendingWrite] = {}
+        # Writes handed to Mongo but not yet acknowledged, still visible to reads
+        self._in_flight: Dict[str, PendingWrite] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._threshold_flush: Optional[asyncio.Task] = None
+
+    @property
+    def pending_players(self) -> int:
+        return len(self._pending)
+
+    def buffer(self, player_id: str, set_fields: Dict[str, Any], inc_fields: Optional[Dict[str, int]] = None) -> None:
+        pending = self._pending.get(player_id)
+        if pending is None:
+            pending = self._pending[player_id] = PendingWrite()
+        pending.merge(set_fields, inc_fields or {})
+
+        if len(self._pending) >= self.max_pending and not self._threshold_flush:
+            self._threshold_flush = asyncio.create_task(self._flush_on_threshold())
+
+    def overlay(self, player_id: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """`doc` as stored in Mongo, with this player's unflushed writes applied"""
+        for writes in (self._in_flight, self._pending):
+            pending = writes.get(player_id)
+            if pending is not None:
+                doc = pending.apply_to(doc)
+        return doc
+
+    async def snapshot(
+        self,
+        player_id: str,
+        load: Callable[[str], Awaitable[Optional[Dict[str, Any]]]],
+    ) -> Optional[Dict[str, Any]]:
+        """Load a stored document with `load` and overlay it, with no flush in between.
+
+        A flush landing between the read and the overlay would drop its
+        writes from both: the read predates them and the buffer no longer
+        holds them. Writers checking versions against the result must
+        buffer before their next await.
+        """
+        async with self._flush_lock:
+            doc = await load(player_id)
+            return self.overlay(player_id, doc) if doc else None
+
+    async def flush(self, player_ids: Optional[Iterable[str]] = None) -> int:
+        """Persist buffered writes (all players, or only `player_ids`); returns players written"""
+        async with self._flush_lock:
+            if player_ids is None:
+                batch, self._pending = self._pending, {}
+            else:
+                batch = {
+                    player_id: self._pending.pop(player_id)
+                    for player_id in set(player_ids) if player_id in self._pending
+                }
+            if not batch:
+                return 0
+
+            self._in_flight = batch
+            try:
+                flushed = await asyncio.gather(*(
+                    self._write(partition, {player_id: batch[player_id] for player_id in player_ids})
+                    for partition, player_ids in self.partitions.group(batch).items()
+                ))
+                written = [player_id for player_ids in flushed for player_id in player_ids]
+                if written and self.on_flushed is not None:
+                    await self.on_flushed(written)
+            finally:
+                self._in_flight = {}
+            return len(written)
+
+    async def _write(self, partition, batch: Dict[str, PendingWrite]) -> List[str]:
+        """Write one partition's share of a flush; returns the players written"""
+        try:
+            await partition.collection.bulk_write(
+                [UpdateOne({"playerId": player_id}, pending.to_update()) for player_id, pending in batch.items()],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            # Rejected writes would be rejected again, so they are dropped
+            player_ids = list(batch)
+            for error in e.details.get("writeErrors", []):
+                logger.error("Write-behind flush dropped save for %s: %s", player_ids[error["index"]], error.get("errmsg"))
+        except Exception:
+            logger.exception("Write-behind flush to partition %s failed, keeping %d players buffered", partition.name, len(batch))
+            self._requeue(batch)
+            return []
+        return list(batch)
+
+    async def flush_player(self, player_id: str) -> bool:
+        if player_id not in self._pending:
+            return False
+        return await self.flush([player_id]) > 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic flush and persist everything still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def _requeue(self, batch: Dict[str, PendingWrite]) -> None:
+        # Failed writes are older than anything buffered since, so newer
+        # pending writes are merged on top of them
+        for player_id, failed in batch.items():
+            newer = self._pending.get(player_id)
+            if newer is not None:
+                failed.merge(newer.set_fields, newer.inc_fields)
+            self._pending[player_id] = failed
+
+    async def _flush_on_threshold(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self._threshold_flush = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Periodic write-behind flush failed")
+
+
+class InsertBuffer:
+    """Acknowledges inserts before they reach Mongo and writes them in batches.
+
+    Documents are queued and written with one unordered insert_many when
+    the flush interval elapses, when `max_pending` are waiting, or on
+    `stop`. The queue is bounded: at `max_pending`, `add` waits for a
+    flush, and if Mongo is failing it inserts the document itself so the
+    caller gets the error instead of the queue growing. Documents keep the
+    `_id` given on the first attempt, so retrying a batch that partly
+    landed only re-inserts the missing ones.
+    """
+
+    def __init__(self, collection, flush_interval: float = 1.0, max_pending: int = 10000):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: List[Dict[str, Any]] = []
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._threshold_flush: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def add(self, doc: Dict[str, Any]) -> None:
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+            if len(self._pending) >= self.max_pending:
+                await self.collection.insert_one(doc)
+                return
+        self._pending.append(doc)
+        if len(self._pending) >= self.max_pending // 2 and not self._threshold_flush:
+            self._threshold_flush = asyncio.create_task(self._flush_on_threshold())
+
+    async def flush(self) -> int:
+        """Insert everything queued; returns the documents written"""
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # Duplicate _ids landed on an earlier attempt; anything else would fail again
+                errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+                for error in errors:
+                    logger.error("Insert buffer dropped document: %s", error.get("errmsg"))
+                return len(batch) - len(errors)
+            except Exception:
+                logger.exception("Insert buffer flush failed, keeping %d documents queued", len(batch))
+                self._pending[:0] = batch
+                return 0
+            return len(batch)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic flush and insert everything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _flush_on_threshold(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self._threshold_flush = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Periodic insert buffer flush failed")
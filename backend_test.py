@@ -8,7 +8,9 @@ import requests
 import json
 import sys
 import os
-from datetime import datetime
+import subprocess
+import time
+from datetime import datetime, timedelta
 
 # Get backend URL from frontend .env file
 def get_backend_url():
@@ -24,6 +26,48 @@ def get_backend_url():
 BASE_URL = get_backend_url() + "/api"
 print(f"Testing Phoenix Flying Game API at: {BASE_URL}")
 
+# Admin routes only exist when the server has ADMIN_TOKEN; read it from the backend .env
+def get_admin_token():
+    if os.environ.get('ADMIN_TOKEN'):
+        return os.environ['ADMIN_TOKEN']
+    try:
+        with open('/app/backend/.env', 'r') as f:
+            for line in f:
+                if line.startswith('ADMIN_TOKEN='):
+                    return line.split('=', 1)[1].strip().strip('"')
+    except:
+        pass
+    return None
+
+ADMIN_TOKEN = get_admin_token()
+ADMIN_HEADERS = {"Authorization": f"Bearer {ADMIN_TOKEN}"}
+
+# Maintenance commands (migrations, rebalancing) run from the backend directory
+BACKEND_DIR = "/app/backend"
+
+def run_manage(*args):
+    return subprocess.run(
+        [sys.executable, "manage.py", *args], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=300
+    )
+
+def can_run_manage():
+    return os.path.exists(os.path.join(BACKEND_DIR, "manage.py"))
+
+def export_documents(collection, since):
+    response = requests.get(
+        f"{BASE_URL}/admin/export/{collection}", params={"since": since}, headers=ADMIN_HEADERS, timeout=30
+    )
+    response.raise_for_status()
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+def export_since(progress):
+    # Mongo keeps milliseconds, so start a little before the server's timestamp
+    updated_at = datetime.fromisoformat(progress["updatedAt"].replace("Z", "+00:00"))
+    return (updated_at - timedelta(seconds=1)).isoformat()
+
+def unique_suffix():
+    return datetime.now().strftime("%Y%m%d%H%M%S%f")
+
 # Test data
 TEST_PLAYER_ID = "test_player_123"
 INVALID_PLAYER_ID = "nonexistent_player"
@@ -32,6 +76,7 @@ class TestResults:
     def __init__(self):
         self.passed = 0
         self.failed = 0
+        self.skipped = 0
         self.errors = []
     
     def log_pass(self, test_name):
@@ -43,10 +88,16 @@ class TestResults:
         self.failed += 1
         self.errors.append(f"{test_name}: {error}")
     
+    def log_skip(self, test_name, reason):
+        print(f"⏭️  SKIP: {test_name} - {reason}")
+        self.skipped += 1
+    
     def summary(self):
         total = self.passed + self.failed
         print(f"\n{'='*60}")
         print(f"TEST SUMMARY: {self.passed}/{total} tests passed")
+        if self.skipped:
+            print(f"Skipped: {self.skipped}")
         if self.errors:
             print(f"\nFAILED TESTS:")
             for error in self.errors:
@@ -139,6 +190,33 @@ def test_moves_available():
     except Exception as e:
         results.log_fail("Moves Available Endpoint", f"Request failed: {str(e)}")
 
+def test_moves_conditional_get():
+    """Test GET /api/moves/available with If-None-Match - Should return 304"""
+    try:
+        response = requests.get(f"{BASE_URL}/moves/available", timeout=10)
+        etag = response.headers.get("ETag")
+        
+        if not etag:
+            results.log_fail("Moves Conditional GET", "Missing ETag header")
+            return
+        
+        response = requests.get(f"{BASE_URL}/moves/available", headers={"If-None-Match": etag}, timeout=10)
+        
+        if response.status_code != 304:
+            results.log_fail("Moves Conditional GET", f"Expected status 304, got {response.status_code}")
+            return
+        
+        response = requests.get(f"{BASE_URL}/moves/available", params={"type": "hold", "maxCost": 100}, timeout=10)
+        data = response.json()
+        if data["total"] != 2 or any(m["type"] != "hold" or m["cost"] > 100 for m in data["moves"]):
+            results.log_fail("Moves Conditional GET", f"Unexpected filtered moves: {data}")
+            return
+        
+        results.log_pass("Moves Conditional GET")
+        
+    except Exception as e:
+        results.log_fail("Moves Conditional GET", f"Request failed: {str(e)}")
+
 def test_create_game_progress():
     """Test POST /api/game/progress - Create new game progress"""
     try:
@@ -324,6 +402,619 @@ def test_update_nonexistent_progress():
     except Exception as e:
         results.log_fail("Update Nonexistent Progress", f"Request failed: {str(e)}")
 
+def test_update_stale_version():
+    """Test PUT /api/game/progress/{player_id} with a stale version - Should return 409"""
+    try:
+        response = requests.get(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", timeout=10)
+        current = response.json()
+        current_version = current.get("version", 0)
+        
+        # A save that changes something bumps the version
+        update_payload = {"deathCount": current.get("deathCount", 0) + 1, "version": current_version}
+        response = requests.put(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", json=update_payload, timeout=10)
+        
+        if response.status_code != 200:
+            results.log_fail("Update Stale Version", f"Expected status 200, got {response.status_code}. Response: {response.text}")
+            return
+        
+        if response.json().get("version") != current_version + 1:
+            results.log_fail("Update Stale Version", f"Expected version={current_version + 1}, got {response.json().get('version')}")
+            return
+        
+        # Re-sending the same data is accepted and leaves the version alone
+        update_payload["version"] = current_version + 1
+        response = requests.put(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", json=update_payload, timeout=10)
+        
+        if response.status_code != 200 or response.json().get("version") != current_version + 1:
+            results.log_fail("Update Stale Version", f"Expected an unchanged version {current_version + 1} on an identical re-save, got {response.status_code}: {response.text}")
+            return
+        
+        # A different save based on the old version must be rejected
+        update_payload = {"deathCount": 5, "version": current_version}
+        response = requests.put(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", json=update_payload, timeout=10)
+        
+        if response.status_code != 409:
+            results.log_fail("Update Stale Version", f"Expected status 409, got {response.status_code}")
+            return
+        
+        # So must an empty save based on the old version
+        response = requests.put(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", json={"version": current_version}, timeout=10)
+        
+        if response.status_code != 409:
+            results.log_fail("Update Stale Version", f"Expected status 409 for an empty stale save, got {response.status_code}")
+            return
+        
+        results.log_pass("Update Stale Version")
+        
+    except Exception as e:
+        results.log_fail("Update Stale Version", f"Request failed: {str(e)}")
+
+def test_patch_game_progress():
+    """Test PATCH /api/game/progress/{player_id} - Apply targeted changes"""
+    try:
+        response = requests.get(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", timeout=10)
+        before = response.json()
+        
+        patch_payload = {
+            "increment": {"coins": 10, "deathCount": 1},
+            "addOwnedMove": "hold_2",
+            "worlds": [{"worldId": 1, "completed": True, "highScore": 500, "bestTime": 320000}],
+            # Improved bests must be backed by a verified run
+            "runs": [{"worldId": 1, "elapsedMs": 320000, "attacks": {"hold_1": 40}, "kills": 5, "bossDefeated": True, "score": 500}]
+        }
+        response = requests.patch(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", json=patch_payload, timeout=10)
+        
+        if response.status_code != 200:
+            results.log_fail("Patch Game Progress", f"Expected status 200, got {response.status_code}. Response: {response.text}")
+            return
+        
+        data = response.json()
+        if data["playerStats"]["coins"] != before["playerStats"]["coins"] + 10:
+            results.log_fail("Patch Game Progress", f"Expected coins={before['playerStats']['coins'] + 10}, got {data['playerStats']['coins']}")
+            return
+        
+        if "hold_2" not in data["ownedMoves"]:
+            results.log_fail("Patch Game Progress", "Expected 'hold_2' in ownedMoves")
+            return
+        
+        # A worse score and slower time must not replace the stored bests
+        patch_payload = {"worlds": [{"worldId": 1, "highScore": 100, "bestTime": 330000}]}
+        response = requests.patch(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", json=patch_payload, timeout=10)
+        world = response.json()["worldProgress"][0]
+        if world["highScore"] != 500 or world["bestTime"] != 320000 or not world["completed"]:
+            results.log_fail("Patch Game Progress", f"Expected world 1 bests to be kept, got {world}")
+            return
+        
+        # A better score with no run behind it is capped (flag mode) or rejected (reject mode)
+        patch_payload = {"worlds": [{"worldId": 1, "highScore": 999999}]}
+        response = requests.patch(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", json=patch_payload, timeout=10)
+        if response.status_code == 200 and response.json()["worldProgress"][0]["highScore"] != 500:
+            results.log_fail("Patch Game Progress", f"Expected an unverified highScore to be capped, got {response.json()['worldProgress'][0]}")
+            return
+        if response.status_code not in (200, 422):
+            results.log_fail("Patch Game Progress", f"Expected status 200 or 422 for an unverified highScore, got {response.status_code}")
+            return
+        
+        results.log_pass("Patch Game Progress")
+        
+    except Exception as e:
+        results.log_fail("Patch Game Progress", f"Request failed: {str(e)}")
+
+def test_batch_game_progress():
+    """Test POST /api/game/progress/batch - Creates/updates for many players"""
+    try:
+        batch_player_id = f"{TEST_PLAYER_ID}_batch_{int(datetime.now().timestamp())}"
+        payload = {
+            "items": [
+                {"op": "create", "playerId": batch_player_id},
+                {"op": "update", "playerId": batch_player_id, "data": {"deathCount": 3}},
+                {"op": "update", "playerId": TEST_PLAYER_ID, "data": {"deathCount": "not a number"}}
+            ]
+        }
+        response = requests.post(f"{BASE_URL}/game/progress/batch", json=payload, timeout=10)
+        
+        if response.status_code != 200:
+            results.log_fail("Batch Game Progress", f"Expected status 200, got {response.status_code}. Response: {response.text}")
+            return
+        
+        statuses = [item["status"] for item in response.json()["results"]]
+        if statuses != ["created", "created", "invalid"]:
+            results.log_fail("Batch Game Progress", f"Expected statuses ['created', 'created', 'invalid'], got {statuses}")
+            return
+        
+        response = requests.get(f"{BASE_URL}/game/progress/{batch_player_id}", timeout=10)
+        data = response.json()
+        if data.get("deathCount") != 3 or len(data.get("worldProgress", [])) != 10:
+            results.log_fail("Batch Game Progress", f"Unexpected batch-created progress: {data}")
+            return
+        
+        results.log_pass("Batch Game Progress")
+        
+    except Exception as e:
+        results.log_fail("Batch Game Progress", f"Request failed: {str(e)}")
+
+def test_progress_conditional_get():
+    """Test GET /api/game/progress/{player_id} with If-None-Match and PUT with If-Match"""
+    try:
+        response = requests.get(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", timeout=10)
+        etag = response.headers.get("ETag")
+        if not etag:
+            results.log_fail("Progress Conditional Get", "Expected an ETag header on game progress")
+            return
+        
+        response = requests.get(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", headers={"If-None-Match": etag}, timeout=10)
+        if response.status_code != 304:
+            results.log_fail("Progress Conditional Get", f"Expected status 304 for a current ETag, got {response.status_code}")
+            return
+        
+        response = requests.put(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", json={"deathCount": 7}, headers={"If-Match": etag}, timeout=10)
+        if response.status_code != 200 or response.headers.get("ETag") == etag:
+            results.log_fail("Progress Conditional Get", f"Expected a matching If-Match save to succeed with a new ETag, got {response.status_code}")
+            return
+        
+        # The old ETag is now stale for both reads and writes
+        response = requests.put(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", json={"deathCount": 8}, headers={"If-Match": etag}, timeout=10)
+        if response.status_code != 412:
+            results.log_fail("Progress Conditional Get", f"Expected status 412 for a stale If-Match, got {response.status_code}")
+            return
+        
+        response = requests.get(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", headers={"If-None-Match": etag}, timeout=10)
+        if response.status_code != 200:
+            results.log_fail("Progress Conditional Get", f"Expected status 200 for a stale ETag, got {response.status_code}")
+            return
+        
+        results.log_pass("Progress Conditional Get")
+        
+    except Exception as e:
+        results.log_fail("Progress Conditional Get", f"Request failed: {str(e)}")
+
+def test_shop_purchase_and_equip():
+    """Test POST /api/shop/{player_id}/purchase and /equip - Conditional purchases"""
+    try:
+        shop_player_id = f"{TEST_PLAYER_ID}_shop_{int(datetime.now().timestamp())}"
+        payload = {"playerId": shop_player_id, "playerStats": {"level": 1, "xp": 0, "xpToNext": 100, "health": 100, "maxHealth": 100, "coins": 60}}
+        requests.post(f"{BASE_URL}/game/progress", json=payload, timeout=10)
+        
+        response = requests.post(f"{BASE_URL}/shop/{shop_player_id}/purchase", json={"moveId": "double_2"}, timeout=10)
+        if response.status_code != 200 or response.json().get("coins") != 10:
+            results.log_fail("Shop Purchase And Equip", f"Expected purchase leaving 10 coins, got {response.status_code}: {response.text}")
+            return
+        
+        # Buying again must not charge twice; buying without enough coins must fail
+        for move_id in ("double_2", "double_3"):
+            response = requests.post(f"{BASE_URL}/shop/{shop_player_id}/purchase", json={"moveId": move_id}, timeout=10)
+            if response.status_code != 409:
+                results.log_fail("Shop Purchase And Equip", f"Expected status 409 buying {move_id}, got {response.status_code}")
+                return
+        
+        response = requests.post(f"{BASE_URL}/shop/{shop_player_id}/equip", json={"slot": "double", "moveId": "double_2"}, timeout=10)
+        if response.status_code != 200:
+            results.log_fail("Shop Purchase And Equip", f"Expected status 200 equipping, got {response.status_code}: {response.text}")
+            return
+        
+        response = requests.post(f"{BASE_URL}/shop/{shop_player_id}/equip", json={"slot": "double", "moveId": "double_3"}, timeout=10)
+        if response.status_code != 409:
+            results.log_fail("Shop Purchase And Equip", f"Expected status 409 equipping an unowned move, got {response.status_code}")
+            return
+        
+        data = requests.get(f"{BASE_URL}/game/progress/{shop_player_id}", timeout=10).json()
+        if data["playerStats"]["coins"] != 10 or data["equippedMoves"]["double"]["id"] != "double_2":
+            results.log_fail("Shop Purchase And Equip", f"Unexpected progress after shop actions: {data}")
+            return
+        
+        results.log_pass("Shop Purchase And Equip")
+        
+    except Exception as e:
+        results.log_fail("Shop Purchase And Equip", f"Request failed: {str(e)}")
+
+def test_progress_session():
+    """Test WS /api/game/session/{player_id} - Run events, acks and the final save"""
+    try:
+        from websockets.sync.client import connect
+        
+        coins_before = requests.get(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", timeout=10).json()["playerStats"]["coins"]
+        ws_url = BASE_URL.replace("https://", "wss://").replace("http://", "ws://")
+        with connect(f"{ws_url}/game/session/{TEST_PLAYER_ID}", open_timeout=10) as ws:
+            ready = json.loads(ws.recv(timeout=10))
+            if ready.get("t") != "ready":
+                results.log_fail("Progress Session", f"Expected a ready frame, got {ready}")
+                return
+            
+            for i in range(1, 6):
+                ws.send(json.dumps({"i": i, "t": "coins", "n": 2}))
+            ws.send(json.dumps({"i": 6, "t": "kill", "n": 4}))
+            ws.send(json.dumps({"t": "end"}))
+            
+            frames = []
+            while not frames or frames[-1].get("t") != "end":
+                frames.append(json.loads(ws.recv(timeout=10)))
+        
+        end = frames[-1]
+        if end.get("saved") != 6 or end.get("coins") != 10 or end.get("kills") != 4:
+            results.log_fail("Progress Session", f"Unexpected session summary: {end}")
+            return
+        
+        if not any(frame.get("t") == "ack" for frame in frames):
+            results.log_fail("Progress Session", f"Expected at least one ack, got {frames}")
+            return
+        
+        coins_after = requests.get(f"{BASE_URL}/game/progress/{TEST_PLAYER_ID}", timeout=10).json()["playerStats"]["coins"]
+        if coins_after != coins_before + 10:
+            results.log_fail("Progress Session", f"Expected coins {coins_before + 10}, got {coins_after}")
+            return
+        
+        results.log_pass("Progress Session")
+        
+    except Exception as e:
+        results.log_fail("Progress Session", f"Request failed: {str(e)}")
+
+def test_analytics():
+    """Test GET /api/analytics - Pre-aggregated gameplay rollups"""
+    try:
+        response = requests.get(f"{BASE_URL}/analytics", params={"days": 7}, timeout=10)
+        
+        if response.status_code != 200:
+            results.log_fail("Analytics", f"Expected status 200, got {response.status_code}. Response: {response.text}")
+            return
+        
+        data = response.json()
+        missing = {"players", "worlds", "levels", "coins", "days"} - set(data)
+        if missing:
+            results.log_fail("Analytics", f"Missing keys: {missing}")
+            return
+        
+        # The players created by earlier tests have all unlocked world 1
+        world_one = next((world for world in data["worlds"] if world["worldId"] == 1), None)
+        if data["players"] < 1 or world_one is None or world_one["players"] < 1:
+            results.log_fail("Analytics", f"Expected at least one player in world 1, got {data}")
+            return
+        
+        if len(data["days"]) > 7:
+            results.log_fail("Analytics", f"Expected at most 7 days, got {len(data['days'])}")
+            return
+        
+        results.log_pass("Analytics")
+        
+    except Exception as e:
+        results.log_fail("Analytics", f"Request failed: {str(e)}")
+
+def test_status_buckets():
+    """Test GET /api/status/buckets and /api/status/clients - Compacted status checks"""
+    try:
+        response = requests.post(f"{BASE_URL}/status", json={"client_name": "backend_test"}, timeout=10)
+        if response.status_code != 200:
+            results.log_fail("Status Buckets", f"Expected status 200 creating a check, got {response.status_code}")
+            return
+        
+        # Fresh checks are only counted once compaction passes them, so just check the shape
+        for granularity in ("minute", "hour"):
+            response = requests.get(f"{BASE_URL}/status/buckets", params={"granularity": granularity, "limit": 10}, timeout=10)
+            if response.status_code != 200 or not isinstance(response.json(), list):
+                results.log_fail("Status Buckets", f"Expected a list of {granularity} buckets, got {response.status_code}: {response.text}")
+                return
+            for bucket in response.json():
+                missing = {"client_name", "start", "count", "firstSeen", "lastSeen"} - set(bucket)
+                if missing:
+                    results.log_fail("Status Buckets", f"Bucket missing keys: {missing}")
+                    return
+        
+        response = requests.get(f"{BASE_URL}/status/buckets", params={"granularity": "day"}, timeout=10)
+        if response.status_code != 422:
+            results.log_fail("Status Buckets", f"Expected status 422 for an unknown granularity, got {response.status_code}")
+            return
+        
+        response = requests.get(f"{BASE_URL}/status/clients", timeout=10)
+        if response.status_code != 200 or not isinstance(response.json(), list):
+            results.log_fail("Status Buckets", f"Expected a list of clients, got {response.status_code}: {response.text}")
+            return
+        
+        results.log_pass("Status Buckets")
+        
+    except Exception as e:
+        results.log_fail("Status Buckets", f"Request failed: {str(e)}")
+
+def test_job_queue():
+    """Test GET /api/jobs/stats - Background follow-ups of saves"""
+    try:
+        response = requests.get(f"{BASE_URL}/jobs/stats", timeout=10)
+        
+        if response.status_code != 200:
+            results.log_fail("Job Queue", f"Expected status 200, got {response.status_code}. Response: {response.text}")
+            return
+        
+        data = response.json()
+        missing = {"workers", "maxSize", "size", "depth", "types"} - set(data)
+        if missing:
+            results.log_fail("Job Queue", f"Missing keys: {missing}")
+            return
+        
+        # Earlier tests saved world progress, which queues leaderboard updates
+        leaderboard_jobs = data["types"].get("leaderboards")
+        if leaderboard_jobs is None or leaderboard_jobs["enqueued"] < 1:
+            results.log_fail("Job Queue", f"Expected queued leaderboard jobs, got {data['types']}")
+            return
+        
+        response = requests.get(f"{BASE_URL}/metrics", timeout=10)
+        if "jobs_queue_depth" not in response.text:
+            results.log_fail("Job Queue", "Expected jobs_queue_depth in /api/metrics")
+            return
+        
+        results.log_pass("Job Queue")
+        
+    except Exception as e:
+        results.log_fail("Job Queue", f"Request failed: {str(e)}")
+
+def test_status_pagination():
+    """Test GET /api/status cursor pagination - Ordered pages without duplicates"""
+    try:
+        client_name = f"pagination_{unique_suffix()}"
+        created = set()
+        for _ in range(5):
+            response = requests.post(f"{BASE_URL}/status", json={"client_name": client_name}, timeout=10)
+            if response.status_code != 200:
+                results.log_fail("Status Pagination", f"Expected status 200 creating a check, got {response.status_code}")
+                return
+            created.add(response.json()["id"])
+        
+        # Buffered checks become visible once they are flushed
+        for _ in range(10):
+            checks, pages, cursor = [], 0, None
+            while True:
+                params = {"client_name": client_name, "limit": 2}
+                if cursor:
+                    params["cursor"] = cursor
+                response = requests.get(f"{BASE_URL}/status", params=params, timeout=10)
+                if response.status_code != 200:
+                    results.log_fail("Status Pagination", f"Expected status 200, got {response.status_code}. Response: {response.text}")
+                    return
+                checks.extend(response.json())
+                pages += 1
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor or pages > 10:
+                    break
+            if len(checks) >= len(created):
+                break
+            time.sleep(0.5)
+        
+        ids = [check["id"] for check in checks]
+        if len(ids) != len(set(ids)):
+            results.log_fail("Status Pagination", f"Duplicate checks across pages: {ids}")
+            return
+        
+        if set(ids) != created:
+            results.log_fail("Status Pagination", f"Expected checks {sorted(created)}, got {sorted(ids)}")
+            return
+        
+        keys = [(datetime.fromisoformat(check["timestamp"].replace("Z", "+00:00")), check["id"]) for check in checks]
+        if keys != sorted(keys):
+            results.log_fail("Status Pagination", "Expected checks in (timestamp, id) order")
+            return
+        
+        if pages != 3:
+            results.log_fail("Status Pagination", f"Expected 3 pages of at most 2 checks, got {pages}")
+            return
+        
+        response = requests.get(f"{BASE_URL}/status", params={"format": "ndjson", "client_name": client_name}, timeout=10)
+        streamed = [json.loads(line)["id"] for line in response.text.splitlines() if line]
+        if streamed != ids:
+            results.log_fail("Status Pagination", f"Expected the streamed checks to match the pages, got {streamed}")
+            return
+        
+        response = requests.get(f"{BASE_URL}/status", params={"cursor": "not-a-cursor"}, timeout=10)
+        if response.status_code != 400:
+            results.log_fail("Status Pagination", f"Expected status 400 for a bad cursor, got {response.status_code}")
+            return
+        
+        results.log_pass("Status Pagination")
+        
+    except Exception as e:
+        results.log_fail("Status Pagination", f"Request failed: {str(e)}")
+
+def test_equipped_moves_hydration():
+    """Test equipped moves - Saved as sent, read back as whole moves"""
+    try:
+        player_id = f"hydration_{unique_suffix()}"
+        requests.post(f"{BASE_URL}/game/progress", json={"playerId": player_id}, timeout=10)
+        move = requests.get(f"{BASE_URL}/moves/hold_1", timeout=10).json()
+        
+        # Clients send whole moves; the server keeps their ids and hydrates them on read
+        response = requests.put(
+            f"{BASE_URL}/game/progress/{player_id}", json={"equippedMoves": {"hold": move, "double": None}}, timeout=10
+        )
+        if response.status_code != 200:
+            results.log_fail("Equipped Moves Hydration", f"Expected status 200, got {response.status_code}. Response: {response.text}")
+            return
+        
+        for source, data in (("save", response.json()), ("read", requests.get(f"{BASE_URL}/game/progress/{player_id}", timeout=10).json())):
+            equipped = data.get("equippedMoves") or {}
+            hold = equipped.get("hold") or {}
+            if hold.get("id") != "hold_1" or hold.get("name") != move["name"] or hold.get("damage") != move["damage"]:
+                results.log_fail("Equipped Moves Hydration", f"Expected the whole hold_1 move on {source}, got {equipped}")
+                return
+            if equipped.get("double") is not None:
+                results.log_fail("Equipped Moves Hydration", f"Expected an empty double slot on {source}, got {equipped}")
+                return
+        
+        results.log_pass("Equipped Moves Hydration")
+        
+    except Exception as e:
+        results.log_fail("Equipped Moves Hydration", f"Request failed: {str(e)}")
+
+def test_equipped_moves_migration():
+    """Test legacy embedded equipped moves - Served as-is, then migrated to ids"""
+    if not ADMIN_TOKEN:
+        results.log_skip("Equipped Moves Migration", "ADMIN_TOKEN is not set")
+        return
+    try:
+        player_id = f"legacy_moves_{unique_suffix()}"
+        requests.post(f"{BASE_URL}/game/progress", json={"playerId": player_id}, timeout=10)
+        response = requests.post(f"{BASE_URL}/shop/{player_id}/equip", json={"slot": "hold", "moveId": "hold_1"}, timeout=10)
+        if response.status_code != 200:
+            results.log_fail("Equipped Moves Migration", f"Expected status 200 equipping, got {response.status_code}: {response.text}")
+            return
+        created = requests.get(f"{BASE_URL}/game/progress/{player_id}", timeout=10).json()
+        since = export_since(created)
+        
+        stored = next(doc for doc in export_documents("game_progress", since) if doc["playerId"] == player_id)
+        if not all(move is None or isinstance(move, str) for move in stored["equippedMoves"].values()):
+            results.log_fail("Equipped Moves Migration", f"Expected move ids in storage, got {stored['equippedMoves']}")
+            return
+        
+        # Store it the way documents were written before moves were kept as ids
+        stored["equippedMoves"] = created["equippedMoves"]
+        response = requests.post(
+            f"{BASE_URL}/admin/import/game_progress", data=json.dumps(stored) + "\n", headers=ADMIN_HEADERS, timeout=30
+        )
+        if response.status_code != 200:
+            results.log_fail("Equipped Moves Migration", f"Expected status 200 importing, got {response.status_code}. Response: {response.text}")
+            return
+        
+        response = requests.get(f"{BASE_URL}/game/progress/{player_id}", timeout=10)
+        if response.json().get("equippedMoves") != created["equippedMoves"]:
+            results.log_fail("Equipped Moves Migration", f"Expected embedded moves to be served as-is, got {response.json().get('equippedMoves')}")
+            return
+        
+        if not can_run_manage():
+            results.log_skip("Equipped Moves Migration", f"{BACKEND_DIR}/manage.py not found; legacy reads checked only")
+            return
+        
+        migration = run_manage("migrate-equipped-moves")
+        if migration.returncode != 0:
+            results.log_fail("Equipped Moves Migration", f"manage.py migrate-equipped-moves failed: {migration.stderr}")
+            return
+        
+        stored = next(doc for doc in export_documents("game_progress", since) if doc["playerId"] == player_id)
+        expected_ids = {slot: move and move["id"] for slot, move in created["equippedMoves"].items()}
+        if stored["equippedMoves"] != expected_ids:
+            results.log_fail("Equipped Moves Migration", f"Expected migrated ids {expected_ids}, got {stored['equippedMoves']}")
+            return
+        
+        response = requests.get(f"{BASE_URL}/game/progress/{player_id}", timeout=10)
+        if response.json().get("equippedMoves") != created["equippedMoves"]:
+            results.log_fail("Equipped Moves Migration", f"Expected migrated ids to hydrate to whole moves, got {response.json().get('equippedMoves')}")
+            return
+        
+        results.log_pass("Equipped Moves Migration")
+        
+    except Exception as e:
+        results.log_fail("Equipped Moves Migration", f"Request failed: {str(e)}")
+
+def test_export_import_round_trip():
+    """Test GET /api/admin/export and POST /api/admin/import - Restore a player from an export"""
+    if not ADMIN_TOKEN:
+        results.log_skip("Export Import Round Trip", "ADMIN_TOKEN is not set")
+        return
+    try:
+        response = requests.get(f"{BASE_URL}/admin/export/game_progress", timeout=10)
+        if response.status_code != 401:
+            results.log_fail("Export Import Round Trip", f"Expected status 401 without the admin token, got {response.status_code}")
+            return
+        
+        player_id = f"transfer_{unique_suffix()}"
+        response = requests.post(f"{BASE_URL}/game/progress", json={"playerId": player_id}, timeout=10)
+        since = export_since(response.json())
+        response = requests.put(f"{BASE_URL}/game/progress/{player_id}", json={"deathCount": 7}, timeout=10)
+        saved = response.json()
+        
+        for format, gzip in (("ndjson", False), ("bson", True)):
+            response = requests.get(
+                f"{BASE_URL}/admin/export/game_progress",
+                params={"since": since, "format": format, "gzip": str(gzip).lower()},
+                headers=ADMIN_HEADERS, timeout=30,
+            )
+            if response.status_code != 200:
+                results.log_fail("Export Import Round Trip", f"Expected status 200 exporting {format}, got {response.status_code}. Response: {response.text}")
+                return
+            export = response.content
+            
+            # Change the player, then restore it from the export
+            requests.put(f"{BASE_URL}/game/progress/{player_id}", json={"deathCount": 99}, timeout=10)
+            response = requests.post(
+                f"{BASE_URL}/admin/import/game_progress", params={"format": format}, data=export, headers=ADMIN_HEADERS, timeout=30
+            )
+            if response.status_code != 200 or response.json().get("errors") or response.json().get("documents", 0) < 1:
+                results.log_fail("Export Import Round Trip", f"Unexpected {format} import result {response.status_code}: {response.text}")
+                return
+            
+            restored = requests.get(f"{BASE_URL}/game/progress/{player_id}", timeout=10).json()
+            if restored.get("deathCount") != 7 or restored.get("version") != saved["version"]:
+                results.log_fail("Export Import Round Trip", f"Expected the exported progress back after a {format} import, got {restored}")
+                return
+        
+        response = requests.post(
+            f"{BASE_URL}/admin/import/game_progress", data=b"not json\n", headers=ADMIN_HEADERS, timeout=10
+        )
+        if response.status_code != 400:
+            results.log_fail("Export Import Round Trip", f"Expected status 400 for a malformed import, got {response.status_code}")
+            return
+        
+        results.log_pass("Export Import Round Trip")
+        
+    except Exception as e:
+        results.log_fail("Export Import Round Trip", f"Request failed: {str(e)}")
+
+def test_partition_routing():
+    """Test game progress across partitions - Every player reachable, before and after a rebalance"""
+    try:
+        suffix = unique_suffix()
+        player_ids = [f"partition_{suffix}_{i}" for i in range(20)]
+        
+        response = requests.post(f"{BASE_URL}/game/progress/batch", json={"items": [
+            {"op": "create", "playerId": player_id} for player_id in player_ids
+        ]}, timeout=10)
+        statuses = [item["status"] for item in response.json()["results"]]
+        if statuses != ["created"] * len(player_ids):
+            results.log_fail("Partition Routing", f"Expected every player created, got {statuses}")
+            return
+        
+        # One batch spans every partition the players hash to
+        response = requests.post(f"{BASE_URL}/game/progress/batch", json={"items": [
+            {"op": "update", "playerId": player_id, "data": {"deathCount": i}} for i, player_id in enumerate(player_ids)
+        ]}, timeout=10)
+        statuses = [item["status"] for item in response.json()["results"]]
+        if statuses != ["updated"] * len(player_ids):
+            results.log_fail("Partition Routing", f"Expected every player updated, got {statuses}")
+            return
+        
+        def check_players(stage):
+            for i, player_id in enumerate(player_ids):
+                response = requests.get(f"{BASE_URL}/game/progress/{player_id}", timeout=10)
+                if response.status_code != 200 or response.json().get("deathCount") != i:
+                    results.log_fail("Partition Routing", f"Expected {player_id} with deathCount={i} {stage}, got {response.status_code}: {response.text}")
+                    return None
+            return response.json()
+        
+        last = check_players("after the batch")
+        if last is None:
+            return
+        
+        if ADMIN_TOKEN:
+            # Exports read every partition; each player is stored exactly once
+            first = requests.get(f"{BASE_URL}/game/progress/{player_ids[0]}", timeout=10).json()
+            exported = [doc["playerId"] for doc in export_documents("game_progress", export_since(first)) if doc["playerId"] in player_ids]
+            if sorted(exported) != sorted(player_ids):
+                results.log_fail("Partition Routing", f"Expected each player exported once, got {sorted(exported)}")
+                return
+        
+        if can_run_manage():
+            rebalance = run_manage("rebalance-partitions")
+            if rebalance.returncode != 0:
+                results.log_fail("Partition Routing", f"manage.py rebalance-partitions failed: {rebalance.stderr}")
+                return
+            
+            check = run_manage("rebalance-partitions", "--dry-run")
+            if check.returncode != 0 or "; 0 misplaced" not in check.stdout:
+                results.log_fail("Partition Routing", f"Expected no misplaced players after a rebalance, got: {check.stdout}{check.stderr}")
+                return
+            
+            if check_players("after a rebalance") is None:
+                return
+        
+        results.log_pass("Partition Routing")
+        
+    except Exception as e:
+        results.log_fail("Partition Routing", f"Request failed: {str(e)}")
+
 def main():
     print("🔥 Phoenix Flying Game Backend API Test Suite 🔥")
     print(f"Testing against: {BASE_URL}")
@@ -332,11 +1023,26 @@ def main():
     # Run all tests
     test_api_root()
     test_moves_available()
+    test_moves_conditional_get()
     test_create_game_progress()
     test_get_game_progress()
     test_get_nonexistent_progress()
     test_update_game_progress()
     test_update_nonexistent_progress()
+    test_update_stale_version()
+    test_patch_game_progress()
+    test_batch_game_progress()
+    test_shop_purchase_and_equip()
+    test_progress_conditional_get()
+    test_progress_session()
+    test_analytics()
+    test_status_buckets()
+    test_job_queue()
+    test_status_pagination()
+    test_equipped_moves_hydration()
+    test_equipped_moves_migration()
+    test_export_import_round_trip()
+    test_partition_routing()
     
     # Print summary
     success = results.summary()
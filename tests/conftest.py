@@ -0,0 +1,37 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+# The backend runs from its own directory and imports its modules flat
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture
+def run_api(monkeypatch):
+    """Run `scenario(client)` against a fresh app backed by an in-memory Motor fake.
+
+    Requests go through httpx's ASGI transport inside one event loop, so a
+    scenario can race them with asyncio.gather. Keyword arguments override
+    Settings fields.
+    """
+    import server
+    from settings import Settings
+
+    monkeypatch.setattr(server, "AsyncIOMotorClient", AsyncMongoMockClient)
+
+    def run(scenario, **settings):
+        app = server.create_app(Settings(mongo_url="mongodb://in-memory", db_name="test", **settings))
+
+        async def main():
+            async with app.router.lifespan_context(app):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test/api") as client:
+                    return await scenario(client)
+
+        return asyncio.run(main())
+
+    return run
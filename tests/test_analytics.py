@@ -0,0 +1,118 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import AutoReconnect
+
+from analytics import STATE_KINDS, Analytics, rollup_counters
+
+
+def progress(player_id, version, coins, level=1, updated_at=datetime(2026, 10, 17, 12)):
+    return {
+        "playerId": player_id,
+        "version": version,
+        "playerStats": {"coins": coins, "level": level},
+        "deathCount": version,
+        "updatedAt": updated_at,
+        "worldProgress": [{"worldId": 1, "unlocked": True, "highScore": coins}],
+    }
+
+
+class FlakyCollection:
+    """Applies the first operation of the next `failures` bulk writes, then raises"""
+
+    def __init__(self, collection, failures: int = 1):
+        self.collection = collection
+        self.failures = failures
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def bulk_write(self, operations, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            await self.collection.bulk_write(operations[:1], **kwargs)
+            raise AutoReconnect("connection reset")
+        return await self.collection.bulk_write(operations, **kwargs)
+
+
+def make_analytics():
+    db = AsyncMongoMockClient()["test"]
+    return Analytics(db.analytics_rollups, db.analytics_contributions)
+
+
+async def state_rollups(analytics):
+    docs = await analytics.rollups.find({"kind": {"$in": list(STATE_KINDS)}}).to_list(None)
+    return {
+        doc["_id"]: {field: value for field, value in doc.items() if field not in ("_id", "kind", "key", "batches") and value}
+        for doc in docs
+        if any(value for field, value in doc.items() if field not in ("_id", "kind", "key", "batches"))
+    }
+
+
+async def expected_rollups(analytics):
+    expected = defaultdict(dict)
+    async for contrib in analytics.contributions.find():
+        for rollup_id, fields in rollup_counters(contrib).items():
+            for field, value in fields.items():
+                expected[rollup_id][field] = expected[rollup_id].get(field, 0) + value
+    return {rollup_id: {f: v for f, v in fields.items() if v} for rollup_id, fields in expected.items()}
+
+
+def test_record_many_merges_saves_of_one_player():
+    async def run():
+        analytics = make_analytics()
+        saves = [progress("p1", 1, 0), progress("p1", 2, 100), progress("p1", 3, 500), progress("p2", 1, 5)]
+        assert await analytics.record_many(saves) == 4
+        assert await state_rollups(analytics) == await expected_rollups(analytics)
+        day = await analytics.rollups.find_one({"_id": "day:2026-10-17"})
+        assert (day["saves"], day["newPlayers"], day["activePlayers"]) == (4, 2, 2)
+        # Versions already counted are skipped
+        assert await analytics.record_many(saves[:2]) == 0
+
+    asyncio.run(run())
+
+
+def test_failed_batch_counts_once_when_retried():
+    async def run():
+        analytics = make_analytics()
+        await analytics.record_many([progress("p1", 1, 0), progress("p2", 1, 50)])
+
+        analytics.rollups = FlakyCollection(analytics.rollups)
+        saves = [progress("p1", 2, 100, level=12), progress("p1", 3, 500, level=15), progress("p3", 1, 7)]
+        try:
+            await analytics.record_many(saves)
+        except AutoReconnect:
+            pass
+        else:
+            raise AssertionError("the rollup write should have failed")
+        # Rolled back: rollups and contributions as before the batch
+        assert (await analytics.contributions.find_one({"_id": "p1"}))["version"] == 1
+        assert await analytics.contributions.find_one({"_id": "p3"}) is None
+        assert await state_rollups(analytics) == await expected_rollups(analytics)
+
+        assert await analytics.record_many(saves) == 3
+        assert await state_rollups(analytics) == await expected_rollups(analytics)
+        coins = {doc["_id"]: doc["players"] async for doc in analytics.rollups.find({"kind": "coins"})}
+        # p1 passed through 100 coins within the batch, which nets to nothing
+        assert coins == {"coins:0": 2, "coins:500": 1}
+        day = await analytics.rollups.find_one({"_id": "day:2026-10-17"})
+        assert (day["saves"], day["newPlayers"]) == (5, 3)
+
+    asyncio.run(run())
+
+
+def test_concurrent_recorders_of_one_player():
+    async def run():
+        analytics = make_analytics()
+        await analytics.record_many([progress("p1", 1, 0)])
+        await asyncio.gather(
+            analytics.record_many([progress("p1", 2, 100)]),
+            analytics.record_many([progress("p1", 3, 500)]),
+            analytics.record_many([progress("p1", 4, 1000)]),
+        )
+        assert (await analytics.contributions.find_one({"_id": "p1"}))["version"] == 4
+        assert await state_rollups(analytics) == await expected_rollups(analytics)
+
+    asyncio.run(run())
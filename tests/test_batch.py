@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from batch import collect_batch_results, plan_progress_batch
+from models import ProgressBatchItem
+
+
+def new_document(player_id, player_stats):
+    return {"playerId": player_id, "deathCount": 0, "version": 0, "updatedAt": datetime.utcnow()}
+
+
+def test_batch_results_map_back_to_items():
+    async def run():
+        collection = AsyncMongoMockClient()["test"]["game_progress"]
+        await collection.insert_one(new_document("old", None))
+        items = [
+            ProgressBatchItem(op="create", playerId="new"),
+            ProgressBatchItem(op="update", playerId="new", data={"deathCount": 2}),
+            ProgressBatchItem(op="create", playerId="old"),
+            ProgressBatchItem(op="update", playerId="old", data={"deathCount": "many"}),
+            ProgressBatchItem(op="update", playerId="old", data={"deathCount": 5}),
+            ProgressBatchItem(op="update", playerId="lost", data={"deathCount": 1}),
+        ]
+        writes, invalid = plan_progress_batch(items, new_document)
+        assert [write.player_id for write in writes] == ["new", "old", "lost"]
+        # The write for "lost" fails, as a BulkWriteError would report it
+        result = await collection.bulk_write([write.to_operation(new_document) for write in writes[:2]], ordered=False)
+        bulk_result = {**result.bulk_api_result, "writeErrors": [{"index": 2, "errmsg": "partition down"}]}
+        results = collect_batch_results(items, writes, invalid, bulk_result)
+        assert [(result.playerId, result.status) for result in results] == [
+            ("new", "created"), ("new", "created"), ("old", "exists"),
+            ("old", "invalid"), ("old", "updated"), ("lost", "error"),
+        ]
+        assert results[5].error == "partition down"
+
+        new = await collection.find_one({"playerId": "new"})
+        assert (new["deathCount"], new["version"]) == (2, 1)
+        old = await collection.find_one({"playerId": "old"})
+        assert (old["deathCount"], old["version"]) == (5, 1)
+
+    asyncio.run(run())
+
+
+def test_player_id_in_item_data_is_invalid():
+    items = [
+        ProgressBatchItem(op="create", playerId="p1", data={"playerId": "p2"}),
+        ProgressBatchItem(op="update", playerId="p1", data={"playerId": "p1", "deathCount": 1}),
+    ]
+    writes, invalid = plan_progress_batch(items, new_document)
+    assert writes == []
+    assert [(result.status, result.error) for result in invalid.values()] == [
+        ("invalid", "playerId is given on the item, not in its data"),
+    ] * 2
@@ -0,0 +1,35 @@
+import asyncio
+
+from cache import InMemoryLRUCache, ProgressCache
+
+
+def test_put_keeps_the_newest_version():
+    async def run():
+        cache = ProgressCache(InMemoryLRUCache())
+        await cache.put("p1", {"playerId": "p1", "version": 3})
+        # A slower save of an older version finishes last
+        await cache.put("p1", {"playerId": "p1", "version": 2})
+        assert (await cache.peek("p1"))["version"] == 3
+        await cache.put("p1", {"playerId": "p1", "version": 4})
+        assert (await cache.peek("p1"))["version"] == 4
+
+    asyncio.run(run())
+
+
+def test_write_during_load_is_not_overwritten():
+    async def run():
+        cache = ProgressCache(InMemoryLRUCache())
+        loaded = asyncio.Event()
+
+        async def slow_load(player_id):
+            await loaded.wait()
+            return {"playerId": player_id, "version": 1}
+
+        reader = asyncio.create_task(cache.get("p1", slow_load))
+        await asyncio.sleep(0)
+        await cache.put("p1", {"playerId": "p1", "version": 2})
+        loaded.set()
+        assert (await reader)["version"] == 1
+        assert (await cache.peek("p1"))["version"] == 2
+
+    asyncio.run(run())
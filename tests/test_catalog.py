@@ -0,0 +1,24 @@
+import json
+import random
+from pathlib import Path
+
+from catalog import MoveCatalog
+
+MOVES = Path(__file__).resolve().parent.parent / "backend" / "data" / "moves.json"
+CATALOG = MoveCatalog.load(MOVES)
+
+
+def test_listings_share_one_order():
+    shuffled = list(CATALOG.moves)
+    random.Random(0).shuffle(shuffled)
+    catalog = MoveCatalog(shuffled)
+
+    everything = catalog.filter()
+    types = list(dict.fromkeys(move.type for move in everything))
+    assert list(everything) == sorted(shuffled, key=lambda move: (types.index(move.type), move.cost))
+    assert catalog.filter(max_cost=10**9) == everything
+    assert catalog.filter(max_cost=100) == tuple(move for move in everything if move.cost <= 100)
+    assert catalog.filter("double") == tuple(move for move in everything if move.type == "double")
+    assert catalog.filter("double", 100) == tuple(move for move in everything if move.type == "double" and move.cost <= 100)
+    # The shipped file is already in this order
+    assert [move.id for move in CATALOG.filter()] == [move["id"] for move in json.loads(MOVES.read_text())]
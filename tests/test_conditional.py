@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_if_match_guards_saves(run_api, write_behind):
+    async def scenario(client):
+        await client.post("/game/progress", json={"playerId": "p1"})
+        etag = (await client.get("/game/progress/p1")).headers["ETag"]
+        assert (await client.get("/game/progress/p1", headers={"If-None-Match": etag})).status_code == 304
+
+        # Two saves made from the same state: the first wins, the other is told
+        # the document moved on rather than overwriting it
+        first, second = await asyncio.gather(*(
+            client.put("/game/progress/p1", json={"deathCount": deaths}, headers={"If-Match": etag})
+            for deaths in (1, 2)
+        ))
+        assert (first.status_code, second.status_code) == (200, 412)
+        assert first.headers["ETag"] != etag
+        assert (await client.get("/game/progress/p1")).json()["deathCount"] == 1
+
+        # Retrying a save that already landed is not a conflict
+        retried = await client.put("/game/progress/p1", json={"deathCount": 1}, headers={"If-Match": etag})
+        assert (retried.status_code, retried.headers["ETag"]) == (200, first.headers["ETag"])
+
+        for if_match, body in (
+            ('W/' + first.headers["ETag"], {"deathCount": 3}),  # weak tags are not accepted
+            ("not an etag", {"deathCount": 3}),
+            (first.headers["ETag"], {"deathCount": 3, "version": 0}),  # disagrees with the tag
+        ):
+            response = await client.put("/game/progress/p1", json=body, headers={"If-Match": if_match})
+            assert response.status_code == 412
+        assert (await client.put("/game/progress/p1", json={"deathCount": 3}, headers={"If-Match": "*"})).status_code == 200
+
+    run_api(scenario, progress_write_behind=write_behind, progress_flush_interval_seconds=30.0)
@@ -0,0 +1,100 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from leaderboard import BEST_TIME, HIGH_SCORE, Leaderboards, WorldBoard
+
+SCORES = {"a": 900, "b": 700, "c": 700, "d": 500, "e": 300}
+
+
+def leaderboards(top_size: int = 2) -> Leaderboards:
+    return Leaderboards(AsyncMongoMockClient()["test"]["leaderboard_entries"], top_size=top_size)
+
+
+async def record_scores(boards: Leaderboards) -> None:
+    await boards.record_many([
+        (player_id, [{"worldId": 1, HIGH_SCORE: score, BEST_TIME: 100_000 + score}])
+        for player_id, score in SCORES.items()
+    ])
+
+
+def test_board_keeps_only_the_top():
+    board = WorldBoard(capacity=2)
+    for player_id, score in SCORES.items():
+        board.update(HIGH_SCORE, player_id, score)
+    assert [entry["playerId"] for entry in board.entries(HIGH_SCORE, 0, 10)] == ["a", "b"]
+    assert board.rank(HIGH_SCORE, "c") is None
+    # An improvement past the cut pushes the last player out
+    assert board.update(HIGH_SCORE, "e", 800)
+    assert [entry["playerId"] for entry in board.entries(HIGH_SCORE, 0, 10)] == ["a", "e"]
+    assert not board.update(HIGH_SCORE, "a", 100)
+
+
+def test_rank_and_neighbors_beyond_the_top():
+    async def run():
+        boards = leaderboards()
+        await record_scores(boards)
+        assert await boards.total(1, HIGH_SCORE) == 5
+
+        # In memory, then from indexed counts; ties are broken by playerId
+        assert await boards.rank(1, HIGH_SCORE, "b") == (2, 700)
+        assert await boards.rank(1, HIGH_SCORE, "c") == (3, 700)
+        assert await boards.rank(1, HIGH_SCORE, "e") == (5, 300)
+        assert await boards.rank(1, BEST_TIME, "e") == (1, 100_300)
+        assert await boards.rank(1, BEST_TIME, "a") == (5, 100_900)
+        assert await boards.rank(1, HIGH_SCORE, "nobody") is None
+
+        neighbors = await boards.entries(1, HIGH_SCORE, 3 - 1 - 1, 3 + 1)
+        assert [(entry["rank"], entry["playerId"], entry["value"]) for entry in neighbors] == [
+            (2, "b", 700), (3, "c", 700), (4, "d", 500),
+        ]
+        page = await boards.entries(1, HIGH_SCORE, 0, 10)
+        assert [entry["playerId"] for entry in page] == ["a", "b", "c", "d", "e"]
+
+    asyncio.run(run())
+
+
+def test_only_improvements_are_written():
+    async def run():
+        boards = leaderboards()
+        await record_scores(boards)
+        assert await boards.record_many([
+            ("d", [{"worldId": 1, HIGH_SCORE: 400, BEST_TIME: 200_000}]),
+            ("e", [{"worldId": 1, HIGH_SCORE: 1000}]),
+        ]) == 1
+        # A loaded board picks up the improvement without a reload
+        assert await boards.rank(1, HIGH_SCORE, "e") == (1, 1000)
+        assert await boards.rank(1, HIGH_SCORE, "d") == (5, 500)
+
+    asyncio.run(run())
+
+
+def test_stale_board_reloads_in_the_background():
+    async def run():
+        boards = leaderboards()
+        await record_scores(boards)
+        board = await boards.board(1)
+        # Another worker records a new best straight into the collection
+        await boards.collection.update_one({"_id": "1:d"}, {"$max": {HIGH_SCORE: 2000}})
+        boards.refresh_interval = 1e-9
+
+        assert await boards.board(1) is board  # served while the reload runs
+        await asyncio.gather(*boards._reloads.values())
+        boards.refresh_interval = 300.0
+        assert await boards.rank(1, HIGH_SCORE, "d") == (1, 2000)
+
+    asyncio.run(run())
+
+
+def test_new_players_count_and_push_others_out_of_the_top():
+    async def run():
+        boards = leaderboards(top_size=2)
+        await boards.record_many([("a", [{"worldId": 1, HIGH_SCORE: 100}]), ("b", [{"worldId": 1, HIGH_SCORE: 200}])])
+        assert await boards.total(1, HIGH_SCORE) == 2  # loads the board
+        await boards.record("c", [{"worldId": 1, HIGH_SCORE: 300}])
+
+        assert await boards.total(1, HIGH_SCORE) == 3
+        page = await boards.entries(1, HIGH_SCORE, 0, 10)
+        assert [(entry["rank"], entry["playerId"]) for entry in page] == [(1, "c"), (2, "b"), (3, "a")]
+
+    asyncio.run(run())
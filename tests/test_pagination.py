@@ -0,0 +1,57 @@
+import base64
+from datetime import datetime
+
+import pytest
+
+from pagination import decode_cursor, encode_cursor, keyset_filter
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2026, 1, 2, 3, 4, 5, 678000)
+    cursor = encode_cursor(timestamp, "id-1")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (timestamp, "id-1")
+    assert keyset_filter(cursor) == {"$or": [
+        {"timestamp": {"$gt": timestamp}},
+        {"timestamp": timestamp, "id": {"$gt": "id-1"}},
+    ]}
+    assert keyset_filter(None) == {}
+
+
+def raw_cursor(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    raw_cursor(b"\xff\xfe"),
+    raw_cursor(b"5"),
+    raw_cursor(b'["2026-01-02T03:04:05"]'),
+    raw_cursor(b'["yesterday", "id-1"]'),
+    raw_cursor(b'[1, "id-1"]'),
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor)
+
+
+def test_status_pages_follow_the_cursor(run_api):
+    async def scenario(client):
+        for i in range(5):
+            await client.post("/status", json={"client_name": f"client-{i}"})
+
+        names, cursor = [], None
+        while True:
+            response = await client.get("/status", params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+            assert response.status_code == 200
+            names += [check["client_name"] for check in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        # Checks made within the same millisecond are ordered by id
+        assert sorted(names) == [f"client-{i}" for i in range(5)]
+
+        response = await client.get("/status", params={"cursor": "not a cursor!"})
+        assert (response.status_code, response.json()["detail"]) == (400, "Invalid cursor")
+
+    run_api(scenario)
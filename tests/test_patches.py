@@ -0,0 +1,57 @@
+import asyncio
+from pathlib import Path
+
+from mongomock_motor import AsyncMongoMockClient
+
+from catalog import MoveCatalog
+from models import EquipSlot, GameProgressPatch
+from patches import build_progress_patch, progress_patch_filter
+
+CATALOG = MoveCatalog.load(Path(__file__).resolve().parent.parent / "backend" / "data" / "moves.json")
+
+
+def test_patch_equips_only_owned_paid_moves():
+    async def run():
+        collection = AsyncMongoMockClient()["test"]["game_progress"]
+        await collection.insert_one({"playerId": "p1", "version": 1, "ownedMoves": ["hold_1"], "equippedMoves": {}})
+
+        async def apply(patch: GameProgressPatch):
+            update, _ = build_progress_patch(patch, CATALOG)
+            query = {"playerId": "p1", **progress_patch_filter(patch, CATALOG)}
+            return await collection.find_one_and_update(query, update)
+
+        assert await apply(GameProgressPatch(equip=EquipSlot(slot="hold", moveId="hold_2"))) is None
+        # Free moves need no entry in ownedMoves, and a patch may add the move it equips
+        assert await apply(GameProgressPatch(equip=EquipSlot(slot="double", moveId="double_1"))) is not None
+        assert await apply(GameProgressPatch(addOwnedMove="hold_2", equip=EquipSlot(slot="hold", moveId="hold_2"))) is not None
+        assert await apply(GameProgressPatch(equip=EquipSlot(slot="hold", moveId="hold_2"))) is not None
+
+        doc = await collection.find_one({"playerId": "p1"})
+        assert doc["equippedMoves"] == {"double": "double_1", "hold": "hold_2"}
+        assert doc["version"] == 4
+
+    asyncio.run(run())
+
+
+def test_patch_conflicts(run_api):
+    async def scenario(client):
+        coins = (await client.post("/game/progress", json={"playerId": "p1"})).json()["playerStats"]["coins"]
+
+        # Increments apply on top of each other; none is lost
+        responses = await asyncio.gather(*(
+            client.patch("/game/progress/p1", json={"increment": {"coins": 10}}) for _ in range(5)
+        ))
+        assert [response.status_code for response in responses] == [200] * 5
+        progress = (await client.get("/game/progress/p1")).json()
+        assert (progress["playerStats"]["coins"], progress["version"]) == (coins + 50, 5)
+
+        # Of two patches made against the same version only one lands
+        responses = await asyncio.gather(*(
+            client.patch("/game/progress/p1", json={"increment": {"deathCount": 1}, "version": 5}) for _ in range(2)
+        ))
+        assert sorted(response.status_code for response in responses) == [200, 409]
+        assert "current version 6" in next(r for r in responses if r.status_code == 409).json()["detail"]
+
+        assert (await client.patch("/game/progress/nobody", json={"increment": {"xp": 1}})).status_code == 404
+
+    run_api(scenario)
@@ -0,0 +1,54 @@
+import asyncio
+
+
+async def new_player(client, player_id: str, coins: int) -> None:
+    await client.post("/game/progress", json={"playerId": player_id, "playerStats": {"coins": coins}})
+
+
+async def equipped(client, player_id: str, slot: str):
+    move = (await client.get(f"/game/progress/{player_id}")).json()["equippedMoves"].get(slot)
+    return move["id"] if move else None
+
+
+def test_concurrent_purchases(run_api):
+    async def scenario(client):
+        await new_player(client, "p1", 250)
+
+        # The same move bought twice at once is charged once
+        responses = await asyncio.gather(*(client.post("/shop/p1/purchase", json={"moveId": "hold_2"}) for _ in range(3)))
+        assert sorted(response.status_code for response in responses) == [200, 409, 409]
+        assert [response.json()["coins"] for response in responses if response.status_code == 200] == [150]
+
+        # Two moves the balance only covers one of: coins never go negative
+        responses = await asyncio.gather(*(
+            client.post("/shop/p1/purchase", json={"moveId": move_id}) for move_id in ("hold_3", "double_3")
+        ))
+        assert sorted(response.status_code for response in responses) == [200, 409]
+        progress = (await client.get("/game/progress/p1")).json()
+        assert progress["playerStats"]["coins"] >= 0
+        assert len(set(progress["ownedMoves"]) & {"hold_3", "double_3"}) == 1
+
+        assert (await client.post("/shop/p1/purchase", json={"moveId": "no_such_move"})).status_code == 404
+        assert (await client.post("/shop/nobody/purchase", json={"moveId": "hold_2"})).status_code == 404
+
+    run_api(scenario)
+
+
+def test_equip_races_purchase(run_api):
+    async def scenario(client):
+        await new_player(client, "p1", 100)
+
+        equip, purchase = await asyncio.gather(
+            client.post("/shop/p1/equip", json={"slot": "hold", "moveId": "hold_2"}),
+            client.post("/shop/p1/purchase", json={"moveId": "hold_2"}),
+        )
+        assert purchase.status_code == 200
+        if equip.status_code == 409:
+            assert equip.json()["detail"] == "Move hold_2 is not owned"
+            assert await equipped(client, "p1", "hold") != "hold_2"
+            equip = await client.post("/shop/p1/equip", json={"slot": "hold", "moveId": "hold_2"})
+        assert equip.status_code == 200
+        assert await equipped(client, "p1", "hold") == "hold_2"
+        assert (await client.post("/shop/p1/equip", json={"slot": "double", "moveId": "hold_2"})).status_code == 400
+
+    run_api(scenario)
@@ -0,0 +1,96 @@
+from pathlib import Path
+
+import pytest
+
+from catalog import MoveCatalog
+from models import RunLog
+from verifier import (
+    EARLY_BOSS,
+    FIRE_RATE,
+    SCORE_TOO_HIGH,
+    TOO_MANY_KILLS,
+    UNKNOWN_MOVE,
+    RunVerifier,
+    unbacked_claims,
+    unverified_results,
+    verified_bests,
+)
+
+CATALOG = MoveCatalog.load(Path(__file__).resolve().parent.parent / "backend" / "data" / "moves.json")
+
+# hold_1: 50 damage every 8 s
+POSSIBLE = RunLog(worldId=1, elapsedMs=320_000, attacks={"hold_1": 40}, kills=5, bossDefeated=True, score=500)
+
+
+@pytest.fixture
+def verifier():
+    return RunVerifier(CATALOG)
+
+
+def test_possible_runs_are_accepted(verifier):
+    runs = [
+        POSSIBLE,
+        RunLog(worldId=3, elapsedMs=60_000, attacks={"hold_1": 8}, kills=10, score=2000),
+        RunLog(worldId=1, elapsedMs=0),
+    ]
+    verdicts = verifier.verify(runs)
+    assert verdicts.ok.tolist() == [True, True, True]
+    assert verdicts.max_damage.tolist() == [2000, 400, 0]
+
+
+@pytest.mark.parametrize("run, flag", [
+    (RunLog(worldId=1, elapsedMs=60_000, attacks={"no_such_move": 1}), UNKNOWN_MOVE),
+    (RunLog(worldId=1, elapsedMs=8_000, attacks={"hold_1": 3}), FIRE_RATE),
+    # 2 hits of 50 damage on up to 3 targets: 300 damage, 10 Fire Imps of 30 health
+    (RunLog(worldId=1, elapsedMs=8_000, attacks={"hold_1": 2}, kills=11), TOO_MANY_KILLS),
+    (RunLog(worldId=1, elapsedMs=299_999, attacks={"hold_1": 30}, bossDefeated=True), EARLY_BOSS),
+    (RunLog(worldId=1, elapsedMs=8_000, attacks={"hold_1": 2}, kills=1, score=10**6), SCORE_TOO_HIGH),
+])
+def test_impossible_runs_are_rejected(verifier, run, flag):
+    verdicts = verifier.verify([POSSIBLE, run])
+    assert verdicts.ok.tolist() == [True, False]
+    assert int(verdicts.flags[1]) == flag
+    assert len(verdicts.reasons(1)) == 1
+
+
+def test_kills_use_the_weaker_fire_imp():
+    # GameSystem: 30 + 5 * 10 = 80, GameEngine: floor(30 * 3.7) = 111 health in world 10
+    verifier = RunVerifier(CATALOG)
+    damage = 50 * 3
+    ok = RunLog(worldId=10, elapsedMs=0, attacks={"hold_1": 1}, kills=damage // 80)
+    too_many = RunLog(worldId=10, elapsedMs=0, attacks={"hold_1": 1}, kills=damage // 80 + 1)
+    assert verifier.verify([ok, too_many]).ok.tolist() == [True, False]
+
+
+def test_unbacked_results_that_improve_are_unverified(verifier):
+    cheat = RunLog(worldId=2, elapsedMs=1_000, attacks={"hold_1": 9}, score=90_000)
+    runs = [POSSIBLE, cheat]
+    bests = verified_bests(runs, verifier.verify(runs))
+    assert bests == {1: {"highScore": 500, "bestTime": 320_000}}
+
+    claims = unbacked_claims([
+        {"worldId": 1, "highScore": 900, "bestTime": 100},  # better than its run
+        {"worldId": 2, "highScore": 90_000, "bestTime": 1_000},  # only an impossible run
+        {"worldId": 3, "highScore": 700, "bestTime": 400_000},  # already stored
+        {"worldId": 4, "highScore": 0},
+    ], bests)
+    assert [(claim["worldId"], claim["field"]) for claim in claims] == [
+        (1, "highScore"), (1, "bestTime"), (2, "highScore"), (2, "bestTime"), (3, "highScore"), (3, "bestTime"),
+    ]
+
+    stored = [{"worldId": 3, "highScore": 700, "bestTime": 400_000}]
+    unverified = unverified_results(claims, stored)
+    assert [(result["worldId"], result["field"], result["allowed"]) for result in unverified] == [
+        (1, "highScore", 500), (1, "bestTime", 320_000), (2, "highScore", 0), (2, "bestTime", None),
+    ]
+
+
+def test_unbacked_time_without_a_stored_best_time(verifier):
+    bests = verified_bests([POSSIBLE], verifier.verify([POSSIBLE]))
+    claims = unbacked_claims([{"worldId": 5, "highScore": 0, "bestTime": 90_000}], bests)
+    # The world is stored, but without a best time: nothing backs the claim
+    stored = [{"worldId": 5, "highScore": 300}]
+    assert unverified_results(claims, stored) == [
+        {"worldId": 5, "field": "bestTime", "claimed": 90_000, "allowed": None},
+    ]
+    assert unverified_results(claims, [{"worldId": 5, "highScore": 300, "bestTime": 80_000}]) == []
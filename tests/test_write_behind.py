@@ -0,0 +1,38 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from partitions import Partition, PartitionRouter
+from write_behind import WriteBehindBuffer
+
+
+def test_snapshot_does_not_miss_a_concurrent_flush():
+    async def run():
+        collection = AsyncMongoMockClient()["test"]["game_progress"]
+        await collection.insert_one({"playerId": "p1", "version": 1, "deathCount": 0})
+        flushing = asyncio.Event()
+        release = asyncio.Event()
+
+        async def on_flushed(player_ids):
+            flushing.set()
+            await release.wait()
+
+        buffer = WriteBehindBuffer(PartitionRouter([Partition("default", collection)]), on_flushed=on_flushed)
+        buffer.buffer("p1", {"deathCount": 1}, {"version": 1})
+
+        async def load(player_id):
+            return await collection.find_one({"playerId": player_id})
+
+        # The snapshot starts while the flush is still running and waits for it
+        flush = asyncio.create_task(buffer.flush())
+        await flushing.wait()
+        snapshot = asyncio.create_task(buffer.snapshot("p1", load))
+        await asyncio.sleep(0)
+        release.set()
+        await flush
+        doc = await snapshot
+        assert doc["version"] == 2 and doc["deathCount"] == 1
+
+        assert await buffer.snapshot("nobody", load) is None
+
+    asyncio.run(run())